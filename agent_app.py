@@ -1,9 +1,13 @@
 from fastapi import FastAPI
 import paho.mqtt.client as mqtt
-import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from identity_provider import IdentityProvider
+from agent_session import AgentSession
 from provisioning_service.core.logger import get_logger
-import sys
+from provisioning_service.core.wire import ENCODING_JSON
 
 from provisioning_service.infra_utils import set_tab_title
 
@@ -14,82 +18,34 @@ logger = get_logger("AgentApp")
 id_provider = IdentityProvider()
 my_identity = id_provider.acquire_identity()
 
-AGENT_ID = my_identity["client_id"]
-TENANT_ID = "tenant-cp"
-MY_GROUPS = my_identity["groups"]
-MY_PRIVATE_TOPIC = f"sase/{TENANT_ID}/node/{AGENT_ID}"
-
-app = FastAPI()
-
+# Message handling lives in AgentSession (shared with agent_host.py, which runs many per process)
 mqtt_client = mqtt.Client(
     mqtt.CallbackAPIVersion.VERSION2, 
-    client_id=AGENT_ID, 
+    client_id=my_identity["client_id"], 
     clean_session=False 
 )
+agent = AgentSession(id_provider, mqtt_client, wire_encoding=os.getenv("AGENT_WIRE_ENCODING", ENCODING_JSON))
+AGENT_ID = agent.agent_id
+HEARTBEAT_SECONDS = float(os.getenv("AGENT_HEARTBEAT_SECONDS", "30"))
+mqtt_client.will_set(**agent.last_will())
 
-def on_connect(client, userdata, flags, reason_code, properties):
-    session_present = flags.session_present
-    logger.info(f"[{AGENT_ID}] Connected! (Session Present: {session_present})")
-
-    # 1. ALWAYS subscribe to private channel
-    client.subscribe(MY_PRIVATE_TOPIC, qos=1)
+# Handlers block (state files, policy downloads with retries) - run them off paho's network
+# thread, which must keep answering keepalives and PUBACKs. One thread: in order, never concurrent.
+handlers = ThreadPoolExecutor(max_workers=1, thread_name_prefix="agent-handler")
 
-    # 2. Check Local Disk for Segments
-    saved_segments = id_provider.data.get("assigned_segments", [])
-    
-    if saved_segments:
-        print(f"[{AGENT_ID}] Found {len(saved_segments)} segments on disk.")
-        for seg in saved_segments:
-            topic = f"sase/{TENANT_ID}/segment/{seg}"
-            client.subscribe(topic, qos=1)
-            logger.info(f"   ↪ Resubscribed to: {topic} (QoS 1)")
+app = FastAPI()
 
-        logger.info(f"[{AGENT_ID}] Skipping Bootstrap (Using Cached Policy)")
-        logger.info(f"[{AGENT_ID}] Waiting for queued messages...")
+def run_heartbeat_loop():
+    while True:
+        time.sleep(HEARTBEAT_SECONDS)
+        if mqtt_client.is_connected():
+            agent.send_heartbeat()
 
-    else:
-        # 3. No segments on disk? Bootstrap!
-        payload = {
-            "request_id": "init",
-            "agent_id": AGENT_ID,
-            "tenant_id": TENANT_ID,
-            "context": {"user_id": "u1", "groups": MY_GROUPS, "location": "TLV"}
-        }
-        client.publish("client_requests", json.dumps(payload))
-        logger.info(f"[{AGENT_ID}] Disk Empty -> Sent Bootstrap Request")
+def on_connect(client, userdata, flags, reason_code, properties):
+    handlers.submit(agent.on_connect, flags.session_present)
 
 def on_message(client, userdata, msg):
-    try:
-        raw_payload = msg.payload.decode()
-        data = json.loads(raw_payload)
-        
-        # CASE 1: Bootstrap Response (Private)
-        if msg.topic == MY_PRIVATE_TOPIC:
-            logger.info(f"[{AGENT_ID}] BOOTSTRAP RESPONSE ✨")
-
-            if 'assigned_segments' in data:
-                # Save to disk
-                id_provider.update_segments(data['assigned_segments'])
-            
-            # Subscribe with Version Info
-            topics = data.get("segment_topics", [])
-            versions = data.get("segment_versions", {})
-            
-            for topic in topics:
-                # Extract segment ID from topic (sase/tenant/segment/SEG_ID)
-                seg_id = topic.split("/")[-1]
-                ver = versions.get(seg_id, "?")
-                download_url = data.get("download_url", "N/A")
-                
-                client.subscribe(topic, qos=1)
-                logger.info(f"Subscribed to: {topic} (Current Version: v{ver}) | Download URL: {download_url})")
-
-        # CASE 2: Segment Update
-        elif "segment" in msg.topic:
-            logger.info(f"[{AGENT_ID}] UPDATE from {msg.topic} | New Version: {data.get('version', 'unknown')}")
-
-    except Exception as e:
-        logger.error(f"Error parsing msg: {e}")
+    handlers.submit(agent.on_message, msg.topic, msg.payload)
 
 @app.on_event("startup")
 async def startup():
@@ -100,5 +56,16 @@ async def startup():
     try:
         mqtt_client.connect("localhost", 1883, 60)
         mqtt_client.loop_start()
+        threading.Thread(target=run_heartbeat_loop, name="heartbeat", daemon=True).start()
     except:
-        print("Broker connection failed.")
\ No newline at end of file
+        print("Broker connection failed.")
+
+@app.on_event("shutdown")
+async def shutdown():
+    # A clean disconnect suppresses the last will - say goodbye explicitly
+    agent.send_heartbeat("OFFLINE", qos=1).wait_for_publish(2)
+    mqtt_client.disconnect()
+    # Let the running handler finish its state write before the ID is handed to someone else
+    handlers.shutdown(wait=True, cancel_futures=True)
+    # Free the ID for the next agent (a crash leaves it locked until the kernel drops the flock)
+    id_provider.release()
\ No newline at end of file
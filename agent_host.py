@@ -0,0 +1,272 @@
+"""
+Agent host: many agent identities in one asyncio process - an edge gateway, or a fleet
+simulation without a process (FastAPI, paho network thread, ~tens of MB) per agent.
+
+Every hosted agent has its own identity and state files (IdentityProvider), its own MQTT
+session (AsyncMqttClient, clean_session=False, last will) and its own AgentSession - the
+same request / response handling agent_app.py runs. All connections share the event loop;
+the blocking parts of message handling (state files, policy downloads) run on a thread
+pool, one handler at a time per agent, in arrival order.
+
+Once every agent has its policy (or --policy-timeout passes) the host reports the memory
+added per agent and the latency from starting to connect to holding the policy.
+
+    python agent_host.py --agents 1000 [--connect-concurrency 100] [--duration 0]
+"""
+import os
+
+# Per-message INFO logs of thousands of agents would dominate the host - opt in with LOG_LEVEL=INFO
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import argparse
+import asyncio
+import json
+import resource
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional
+
+HOST_STARTED = time.perf_counter()
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux), else the peak."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def raise_fd_limit(needed: int):
+    # Each agent holds a socket and an identity lock file
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed and soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard if hard != resource.RLIM_INFINITY else needed, hard))
+
+class LoopClient:
+    """
+    The MQTT client an AgentSession sees in the host. Sessions run on pool threads, while
+    the connection belongs to the event loop - every call is handed over to the loop.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.mqtt = None  # AsyncMqttClient, set once created (it needs the session's last will)
+
+    def subscribe(self, topic: str, qos: int = 1):
+        self.loop.call_soon_threadsafe(self.mqtt.subscribe, topic, qos)
+
+    def unsubscribe(self, topic: str):
+        self.loop.call_soon_threadsafe(self.mqtt.unsubscribe, topic)
+
+    def publish(self, topic: str, payload, qos: int = 0):
+        self.loop.call_soon_threadsafe(partial(self.mqtt.client.publish, topic, payload, qos=qos))
+
+class HostedAgent:
+    def __init__(self, id_provider, session, client: LoopClient):
+        self.id_provider = id_provider
+        self.session = session
+        self.client = client
+        self.lock = asyncio.Lock()  # FIFO - handlers run one at a time, in arrival order
+        self.connect_started: Optional[float] = None
+        self.connected_at: Optional[float] = None
+        self.policy_at: Optional[float] = None
+
+class AgentHost:
+    def __init__(self, args):
+        self.args = args
+        self.loop = asyncio.get_running_loop()
+        self.pool = ThreadPoolExecutor(max_workers=args.io_threads, thread_name_prefix="agent-io")
+        self.agents: List[HostedAgent] = []
+        self.failed = 0
+        self.all_ready = asyncio.Event()
+        self._pending_policies = 0
+
+    # --- Agents ---
+    def add_agent(self, id_provider, session_cls, mqtt_cls):
+        client = LoopClient(self.loop)
+        session = session_cls(id_provider, client, wire_encoding=self.args.wire_encoding)
+        agent = HostedAgent(id_provider, session, client)
+        client.mqtt = mqtt_cls(session.agent_id, clean_session=False, will=session.last_will())
+        client.mqtt.on_connect = lambda mqtt, session_present: self._dispatch(agent, session.on_connect, session_present)
+        client.mqtt.on_message = lambda mqtt, msg: self._dispatch(agent, session.on_message, msg.topic, msg.payload)
+        session.on_policy = lambda reason: self.loop.call_soon_threadsafe(self._policy_applied, agent)
+        self.agents.append(agent)
+        self._pending_policies += 1
+
+    def _dispatch(self, agent: HostedAgent, handler, *args):
+        self.loop.create_task(self._run_handler(agent, handler, *args))
+
+    async def _run_handler(self, agent: HostedAgent, handler, *args):
+        async with agent.lock:
+            await self.loop.run_in_executor(self.pool, handler, *args)
+
+    def _policy_applied(self, agent: HostedAgent):
+        if agent.policy_at is None:
+            agent.policy_at = time.perf_counter()
+            self._pending_policies -= 1
+            if self._pending_policies == 0:
+                self.all_ready.set()
+
+    async def connect_all(self):
+        slots = asyncio.Semaphore(self.args.connect_concurrency)
+
+        async def connect(agent: HostedAgent):
+            async with slots:
+                agent.connect_started = time.perf_counter()
+                try:
+                    await asyncio.wait_for(agent.client.mqtt.connect(self.args.host, self.args.port), self.args.connect_timeout)
+                    agent.connected_at = time.perf_counter()
+                except Exception as e:
+                    self.failed += 1
+                    self._pending_policies -= 1
+                    print(f"[{agent.session.agent_id}] Connect failed: {e!r}")
+
+        await asyncio.gather(*(connect(agent) for agent in self.agents))
+        if self._pending_policies <= 0:
+            self.all_ready.set()
+
+    async def heartbeat_loop(self):
+        # Spread over the interval, so the broker sees a steady trickle rather than N at once
+        while True:
+            for agent in self.agents:
+                await asyncio.sleep(self.args.heartbeat / max(len(self.agents), 1))
+                if agent.connected_at is not None:
+                    agent.session.send_heartbeat()
+
+    async def shutdown(self):
+        # A clean disconnect suppresses the last will - say goodbye explicitly
+        async def goodbye(agent: HostedAgent):
+            if agent.connected_at is None:
+                return
+            try:
+                await asyncio.wait_for(agent.client.mqtt.publish(
+                    agent.session.presence_topic, json.dumps({"status": "OFFLINE", "session": agent.session.session_id}), qos=1
+                ), 2)
+            except Exception:
+                pass
+            await agent.client.mqtt.disconnect()
+
+        await asyncio.gather(*(goodbye(agent) for agent in self.agents))
+        self.pool.shutdown(wait=True)
+        for agent in self.agents:
+            agent.id_provider.release()
+
+    # --- Report ---
+    def report(self, rss_before: int, rss_after: int, timings: dict) -> dict:
+        connect = [a.connected_at - a.connect_started for a in self.agents if a.connected_at]
+        policy = [a.policy_at - a.connect_started for a in self.agents if a.policy_at]
+
+        def stats(values):
+            return {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(max(values, default=0.0) * 1000, 2),
+            }
+
+        n = max(len(self.agents), 1)
+        return {
+            "agents": len(self.agents),
+            "connect_failed": self.failed,
+            "timings_s": timings,
+            "connect": stats(connect),
+            "connect_to_policy": stats(policy),
+            "rss_mb": {"before_agents": round(rss_before / 2**20, 1), "after_agents": round(rss_after / 2**20, 1)},
+            "kb_per_agent": round((rss_after - rss_before) / n / 1024, 1),
+        }
+
+def print_report(result: dict):
+    t = result["timings_s"]
+    print(f"\n{result['agents']} agents in one process ({result['connect_failed']} failed to connect)")
+    print(f"  startup: imports {t['imports']}s, identities {t['identities']}s, connect all {t['connect']}s, "
+          f"all policies {t['policies']}s")
+    print(f"  {'':<18} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name in ("connect", "connect_to_policy"):
+        s = result[name]
+        print(f"  {name:<18} {s['count']:>6} {s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['max_ms']:>9.1f}")
+    rss = result["rss_mb"]
+    print(f"  memory: RSS {rss['before_agents']} MB before agents -> {rss['after_agents']} MB "
+          f"= {result['kb_per_agent']} KB per agent")
+
+async def run_host(args):
+    # Imported here, not at the top: `--help` and argument errors stay instant
+    from identity_provider import IdentityProvider
+    from agent_session import AgentSession
+    from provisioning_service.adapters.async_mqtt import AsyncMqttClient
+    imported = time.perf_counter()
+
+    raise_fd_limit(args.agents * 2 + 256)
+    host = AgentHost(args)
+    rss_before = rss_bytes()
+
+    # 1. Identities (each its own ID + state file, like separate agent processes) - one block allocation
+    for id_provider in IdentityProvider.acquire_identities(args.agents, args.storage_dir, args.lock_dir):
+        host.add_agent(id_provider, AgentSession, AsyncMqttClient)
+    identities = time.perf_counter()
+
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        host.loop.add_signal_handler(sig, stop.set)
+
+    # 2. Connect (each agent bootstraps / resyncs from its on_connect)
+    await host.connect_all()
+    connected = time.perf_counter()
+    heartbeats = asyncio.create_task(host.heartbeat_loop())
+
+    # 3. Wait for the policies, then report
+    waiter = asyncio.create_task(host.all_ready.wait())
+    await asyncio.wait([waiter, asyncio.create_task(stop.wait())], timeout=args.policy_timeout,
+                       return_when=asyncio.FIRST_COMPLETED)
+    ready = time.perf_counter()
+    result = host.report(rss_before, rss_bytes(), {
+        "imports": round(imported - HOST_STARTED, 3),
+        "identities": round(identities - imported, 3),
+        "connect": round(connected - identities, 3),
+        "policies": round(ready - connected, 3),
+    })
+    print_report(result)
+    if not host.all_ready.is_set():
+        print(f"  {sum(1 for a in host.agents if a.connected_at and not a.policy_at)} connected agents "
+              f"without a policy after {args.policy_timeout:g}s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    # 4. Keep the fleet online (heartbeats, segment updates) until stopped or --duration ends
+    if not stop.is_set() and args.duration != 0:
+        try:
+            await asyncio.wait_for(stop.wait(), args.duration if args.duration > 0 else None)
+        except asyncio.TimeoutError:
+            pass
+    heartbeats.cancel()
+    await host.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=100)
+    parser.add_argument("--host", default=os.getenv("MQTT_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MQTT_PORT", "1883")))
+    parser.add_argument("--connect-concurrency", type=int, default=100, help="Connections being opened at once")
+    parser.add_argument("--connect-timeout", type=float, default=10.0)
+    parser.add_argument("--policy-timeout", type=float, default=60.0, help="Seconds to wait for every agent's policy")
+    parser.add_argument("--duration", type=float, default=-1,
+                        help="Seconds to stay online after the report (-1 = until SIGINT/SIGTERM, 0 = exit)")
+    parser.add_argument("--heartbeat", type=float, default=float(os.getenv("AGENT_HEARTBEAT_SECONDS", "30")))
+    parser.add_argument("--wire-encoding", default=os.getenv("AGENT_WIRE_ENCODING", "json"))
+    parser.add_argument("--io-threads", type=int, default=16, help="Threads for state files and downloads")
+    parser.add_argument("--storage-dir", default="./agent_storage")
+    parser.add_argument("--lock-dir", default="./locks")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+    asyncio.run(run_host(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import json
+import uuid
+from typing import Callable, Optional
+from identity_provider import IdentityProvider
+from provisioning_service.core.logger import get_logger
+from provisioning_service.core.delta import apply_delta, decompress_policy, policy_digest
+from provisioning_service.core.wire import ENCODING_JSON, decode_message, presence_topic, segment_topic
+
+logger = get_logger("AgentSession")
+
+REQUEST_TOPIC = "client_requests"
+
+class AgentSession:
+    """
+    One agent identity: its persisted state (IdentityProvider), the requests it sends when
+    it connects and the handling of what the service sends back.
+
+    Transport-agnostic - `client` only needs subscribe(topic, qos), unsubscribe(topic) and
+    publish(topic, payload, qos) - so the same logic runs in agent_app.py (one paho client
+    per process) and agent_host.py (many identities on one event loop). on_connect and
+    on_message may block (disk writes, policy downloads), so callers run them off the MQTT
+    network thread, one at a time.
+    """
+    def __init__(self, id_provider: IdentityProvider, client, wire_encoding: str = ENCODING_JSON):
+        self.id_provider = id_provider
+        self.client = client
+        identity = id_provider.data
+        self.agent_id = identity["client_id"]
+        self.tenant_id = identity.get("tenant_id", "tenant-cp")
+        self.groups = identity["groups"]
+        self.private_topic = f"sase/{self.tenant_id}/node/{self.agent_id}"
+        # Preferred wire encoding ("json" or "msgpack-v1"); the service falls back to json if it doesn't offer it
+        self.wire_encoding = wire_encoding
+
+        # Presence - periodic heartbeat, plus a last will the broker publishes if we drop off.
+        # The session ID lets the tracker ignore the will of a connection we have already replaced.
+        self.presence_topic = presence_topic(self.tenant_id, self.agent_id)
+        self.session_id = uuid.uuid4().hex[:12]
+
+        # Optional hook: on_policy(reason) once a BOOTSTRAP / RESYNC response has been applied
+        self.on_policy: Optional[Callable[[str], None]] = None
+
+    def last_will(self) -> dict:
+        return {"topic": self.presence_topic, "payload": self._presence("OFFLINE"), "qos": 1}
+
+    def _presence(self, status: str) -> str:
+        return json.dumps({"status": status, "session": self.session_id})
+
+    def send_heartbeat(self, status: str = "ONLINE", qos: int = 0):
+        """QoS 0: a lost heartbeat is covered by the next one."""
+        return self.client.publish(self.presence_topic, self._presence(status), qos=qos)
+
+    def on_connect(self, session_present: bool):
+        logger.info(f"[{self.agent_id}] Connected! (Session Present: {session_present})")
+        client, state = self.client, self.id_provider.data
+
+        # 1. ALWAYS subscribe to private channel
+        client.subscribe(self.private_topic, qos=1)
+        self.send_heartbeat()
+
+        # 2. Check Local Disk for Segments
+        saved_segments = state.get("assigned_segments", [])
+
+        if saved_segments:
+            logger.info(f"[{self.agent_id}] Found {len(saved_segments)} segments on disk.")
+            encoding = state.get("wire_encoding", ENCODING_JSON)
+            for seg in saved_segments:
+                topic = segment_topic(self.tenant_id, seg, encoding)
+                client.subscribe(topic, qos=1)
+                logger.info(f"   ↪ Resubscribed to: {topic} (QoS 1)")
+
+            # Ask only for what changed while we were away (covers an expired session too)
+            known = state.get("segment_versions", {})
+            payload = {
+                "type": "RESYNC",
+                "request_id": self.id_provider.pending_request_id("resync"),
+                "agent_id": self.agent_id,
+                "tenant_id": self.tenant_id,
+                "segment_versions": {seg: known.get(seg, 0) for seg in saved_segments},
+                "encoding": encoding
+            }
+            client.publish(REQUEST_TOPIC, json.dumps(payload), qos=0)
+            logger.info(f"[{self.agent_id}] Skipping Bootstrap (Using Cached Policy) -> Sent Resync Request")
+
+        else:
+            # 3. No segments on disk? Bootstrap!
+            payload = {
+                "request_id": self.id_provider.pending_request_id("bootstrap"),
+                "agent_id": self.agent_id,
+                "tenant_id": self.tenant_id,
+                "context": {"user_id": "u1", "groups": self.groups, "location": "TLV"},
+                "accept_encodings": [self.wire_encoding, ENCODING_JSON]
+            }
+            client.publish(REQUEST_TOPIC, json.dumps(payload), qos=0)
+            logger.info(f"[{self.agent_id}] Disk Empty -> Sent Bootstrap Request")
+
+    def on_message(self, topic: str, payload: bytes):
+        try:
+            data = decode_message(payload, topic)
+
+            # CASE 1: Resync Response (Private) - only the segments we are behind on
+            if topic == self.private_topic and data.get("type") == "RESYNC_RESPONSE":
+                stale = data.get("stale_segments", {})
+                logger.info(f"[{self.agent_id}] RESYNC RESPONSE: {len(stale)} stale segment(s) {stale}")
+                for update in data.get("updates", []):
+                    self.apply_segment_update(update)
+                self.id_provider.complete_request("resync")
+                self._policy_applied("RESYNC")
+
+            # CASE 2: Bootstrap Response / Reassignment after a rule change (Private)
+            elif topic == self.private_topic:
+                self._apply_policy_response(data)
+
+            # CASE 3: Segment Update
+            elif "segment" in topic:
+                logger.info(f"[{self.agent_id}] UPDATE from {topic} | New Version: {data.get('version', 'unknown')}")
+                self.apply_segment_update(data)
+
+        except Exception as e:
+            logger.error(f"[{self.agent_id}] Error parsing msg: {e}")
+
+    def _apply_policy_response(self, data: dict):
+        client, state = self.client, self.id_provider.data
+        reason = data.get("reason", "BOOTSTRAP")
+        logger.info(f"[{self.agent_id}] {reason} RESPONSE ✨")
+        if reason == "BOOTSTRAP":
+            self.id_provider.complete_request("bootstrap")
+
+        if 'assigned_segments' in data:
+            # Drop segments we are no longer assigned to
+            encoding = data.get("encoding", ENCODING_JSON)
+            for seg in set(state.get("assigned_segments", [])) - set(data['assigned_segments']):
+                client.unsubscribe(segment_topic(self.tenant_id, seg, state.get("wire_encoding", ENCODING_JSON)))
+                logger.info(f"   ↩ Unsubscribed from {seg}")
+            # Save to disk
+            self.id_provider.update_segments(data['assigned_segments'], encoding)
+
+        # Subscribe with Version Info
+        versions = data.get("segment_versions", {})
+        hashes = data.get("segment_hashes", {})
+        for topic in data.get("segment_topics", []):
+            # Extract segment ID from topic (sase/tenant/segment/SEG_ID[/c])
+            seg_id = topic.split("/")[3]
+            client.subscribe(topic, qos=1)
+            logger.info(f"Subscribed to: {topic} (Current Version: v{versions.get(seg_id, '?')})")
+
+        # Fetch each segment's current policy (skipped when we already hold that content)
+        for seg_id, sha256 in hashes.items():
+            try:
+                self.apply_segment_update({
+                    "segment": seg_id, "version": versions[seg_id], "sha256": sha256,
+                    "full_url": data["artifact_url_template"].format(sha256=sha256)
+                })
+            except Exception as e:
+                logger.warning(f"[{self.agent_id}] Could not sync {seg_id}: {e}")
+        self.id_provider.update_segment_versions({seg: ver for seg, ver in versions.items() if seg not in hashes})
+        if reason == "BOOTSTRAP":
+            self._policy_applied(reason)
+
+    def _policy_applied(self, reason: str):
+        if self.on_policy:
+            self.on_policy(reason)
+
+    # --- Segment Policies ---
+    def apply_segment_update(self, update: dict):
+        if "full_url" in update:
+            self.sync_segment(update)
+        elif "version" in update:
+            self.id_provider.update_segment_versions({update["segment"]: update["version"]})
+
+    def sync_segment(self, update: dict):
+        """Applies a delta when our stored version is one of its bases, otherwise downloads the full policy."""
+        seg_id, version = update["segment"], update["version"]
+        current = self.id_provider.load_segment_policy(seg_id)
+        if current and current["version"] >= version:
+            return
+        if current and policy_digest(current["rules"]) == update["sha256"]:
+            # New version, same content (e.g. a re-published policy) - nothing to download
+            self.id_provider.save_segment_policy(seg_id, version, current["rules"])
+            logger.info(f"[{self.agent_id}] {seg_id} v{version} unchanged (sha256 match) - download skipped")
+            return
+
+        rules = None
+        if current and current["version"] in update.get("delta_bases", []):
+            import requests  # only agents that actually download pay for the import
+            try:
+                delta_url = update["delta_url"].format(base=current["version"])
+                resp = requests.get(delta_url, timeout=5)
+                resp.raise_for_status()
+                rules = apply_delta(current["rules"], resp.content)
+                if policy_digest(rules) != update["sha256"]:
+                    logger.warning(f"[{self.agent_id}] Delta for {seg_id} v{version} failed verification")
+                    rules = None
+                else:
+                    logger.info(f"[{self.agent_id}] Applied delta v{current['version']} -> v{version} ({len(resp.content)} bytes)")
+            except Exception as e:
+                logger.warning(f"[{self.agent_id}] Delta fetch failed for {seg_id}: {e}")
+
+        if rules is None:
+            content = self.download(update["full_url"])
+            rules = decompress_policy(content)
+            if policy_digest(rules) != update["sha256"]:
+                raise ValueError(f"{seg_id} v{version} failed verification")
+            logger.info(f"[{self.agent_id}] Downloaded full {seg_id} v{version} ({len(content)} bytes)")
+
+        self.id_provider.save_segment_policy(seg_id, version, rules)
+
+    def download(self, url: str, attempts: int = 3) -> bytes:
+        """GET with resumption: after a broken transfer, asks for the remaining bytes only (Range + If-Range)."""
+        import requests
+        data, etag = bytearray(), None  # appended in place: += on bytes copies the whole body per chunk
+        for attempt in range(attempts):
+            headers = {"Range": f"bytes={len(data)}-", "If-Range": etag} if data and etag else {}
+            try:
+                with requests.get(url, headers=headers, timeout=5, stream=True) as resp:
+                    resp.raise_for_status()
+                    if resp.status_code != 206:
+                        data = bytearray()  # full body (first attempt, or the content changed)
+                    etag = resp.headers.get("ETag")
+                    for chunk in resp.iter_content(1 << 16):
+                        data += chunk
+                return bytes(data)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == attempts - 1:
+                    raise
+                logger.warning(f"[{self.agent_id}] Download interrupted at {len(data)} bytes, resuming: {e}")
+        return bytes(data)
@@ -0,0 +1,86 @@
+"""
+Artifact server benchmark: concurrent keep-alive clients against the built-in artifact
+server, for the three ways an agent fetches a segment policy:
+
+    full     - first download (200, body sent with sendfile)
+    cached   - revalidation with If-None-Match (304, no body)
+    resume   - second half of an interrupted download (206 Range)
+
+    python benchmarks/artifact_server_bench.py [--clients 16] [--requests 2000] [--rules 20000]
+"""
+import argparse
+import http.client
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from provisioning_service.adapters.artifact_server import start_artifact_server
+from provisioning_service.adapters.artifact_store import SegmentArtifactStore
+
+def run_clients(port: int, path: str, headers: dict, clients: int, per_client: int, expect: int):
+    latencies, sizes, errors = [], [], []
+    lock = threading.Lock()
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        mine, received = [], 0
+        for _ in range(per_client):
+            start = time.perf_counter()
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+            body = resp.read()
+            mine.append(time.perf_counter() - start)
+            received += len(body)
+            if resp.status != expect:
+                errors.append(resp.status)
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            sizes.append(received)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, sorted(latencies), sum(sizes), errors
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000, help="total per case")
+    parser.add_argument("--rules", type=int, default=20000, help="policy size (rule lines)")
+    parser.add_argument("--port", type=int, default=18089)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    store = SegmentArtifactStore(root=root, base_url=f"http://127.0.0.1:{args.port}/artifacts")
+    artifact = store.save_version("tenant-cp", "seg_0001", 1, [f"allow 10.{i // 256}.{i % 256}.0/24 tcp/443" for i in range(args.rules)])
+    path = artifact.full_url.split(f":{args.port}", 1)[1]
+    size = os.path.getsize(os.path.join(root, "blobs", f"{artifact.sha256}.json.z"))
+    server = start_artifact_server(root, args.port)
+
+    per_client = max(args.requests // args.clients, 1)
+    cases = [
+        ("full", {}, 200),
+        ("cached", {"If-None-Match": f'"{artifact.sha256}"'}, 304),
+        ("resume", {"Range": f"bytes={size // 2}-"}, 206),
+    ]
+    print(f"artifact {size} bytes, {args.clients} clients x {per_client} requests")
+    print(f"{'case':<8} {'req/s':>9} {'MB/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, headers, expect in cases:
+        elapsed, lat, received, errors = run_clients(args.port, path, headers, args.clients, per_client, expect)
+        if errors:
+            print(f"{name}: {len(errors)} unexpected statuses, e.g. {errors[0]}")
+        print(f"{name:<8} {len(lat) / elapsed:>9.0f} {received / elapsed / 1e6:>8.1f} "
+              f"{lat[len(lat) // 2] * 1000:>8.2f} {lat[int(len(lat) * 0.99)] * 1000:>8.2f}")
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""
+In-process stand-ins for the infrastructure in docker-compose.yaml, used by the
+benchmarks. They implement only the calls the service makes:
+
+    FakeDatabase / FakeCollection   - pymongo Database / Collection (MongoDB)
+    FakeSQS                         - boto3 SQS client (LocalStack)
+    RecordingMqttClient             - paho Client.publish (Mosquitto)
+
+`latency` (seconds) is added to every backend call to approximate a network
+round trip; 0 measures the service code alone. RecordingMqttClient can also
+delay PUBACKs (`ack_latency`) so publish confirmation and the in-flight window
+are exercised.
+"""
+import copy
+import itertools
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from typing import Dict, List
+
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+
+# --- MongoDB ---
+def _matches(doc: dict, query: dict) -> bool:
+    for field, cond in query.items():
+        value = doc.get(field)
+        if isinstance(cond, dict) and any(k.startswith("$") for k in cond):
+            for op, arg in cond.items():
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$ne" and value == arg:
+                    return False
+                if op == "$exists" and (field in doc) != bool(arg):
+                    return False
+                if op == "$lt" and not (value is not None and value < arg):
+                    return False
+                if op == "$gt" and not (value is not None and value > arg):
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+def _project(doc: dict, projection) -> dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    included = [k for k, v in projection.items() if v and k != "_id"]
+    result = {k: copy.deepcopy(doc[k]) for k in included if k in doc}
+    if projection.get("_id", 1) and "_id" in doc:
+        result["_id"] = doc["_id"]
+    return result
+
+class FakeCollection:
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self.docs: List[dict] = []
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        # field -> value -> docs, built on first equality lookup (stands in for real indexes)
+        self._indexes: Dict[str, Dict] = {}
+
+    def _call(self, op: str):
+        self.calls[op] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _apply_update(self, doc: dict, update: dict, inserting: bool):
+        for op, fields in update.items():
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                doc.update(copy.deepcopy(fields))
+            elif op == "$inc":
+                for k, v in fields.items():
+                    doc[k] = doc.get(k, 0) + v
+            elif op == "$max":
+                for k, v in fields.items():
+                    if doc.get(k) is None or v > doc[k]:
+                        doc[k] = v
+            elif op == "$unset":
+                for k in fields:
+                    doc.pop(k, None)
+
+    def _candidates(self, query: dict) -> List[dict]:
+        # Most selective equality field (tenant_id alone would match most of the collection)
+        best = self.docs
+        for field, cond in query.items():
+            if isinstance(cond, (str, int)):
+                if field not in self._indexes:
+                    index = self._indexes[field] = defaultdict(list)
+                    for doc in self.docs:
+                        if field in doc:
+                            index[doc[field]].append(doc)
+                bucket = self._indexes[field].get(cond, [])
+                if len(bucket) < len(best):
+                    best = bucket
+        return best
+
+    def _index_doc(self, doc: dict, old: dict = None):
+        for field, index in self._indexes.items():
+            if old is not None and field in old:
+                if doc.get(field) == old[field]:
+                    continue
+                index[old[field]].remove(doc)
+            if field in doc:
+                index[doc[field]].append(doc)
+
+    def _insert(self, doc: dict):
+        self.docs.append(doc)
+        self._index_doc(doc)
+
+    def _upsert_one(self, query: dict, update: dict, upsert: bool):
+        """Returns (before, after) copies of the matched/inserted document."""
+        for doc in self._candidates(query):
+            if _matches(doc, query):
+                before = copy.deepcopy(doc)
+                self._apply_update(doc, update, inserting=False)
+                self._index_doc(doc, before)
+                return before, doc
+        if not upsert:
+            return None, None
+        doc = {"_id": next(self._ids), **{k: v for k, v in query.items() if not isinstance(v, dict)}}
+        self._apply_update(doc, update, inserting=True)
+        self._insert(doc)
+        return None, doc
+
+    # Reads
+    def find_one(self, query=None, projection=None):
+        self._call("find_one")
+        with self._lock:
+            for doc in self._candidates(query or {}):
+                if _matches(doc, query or {}):
+                    return _project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None):
+        self._call("find")
+        with self._lock:
+            return [_project(doc, projection) for doc in self._candidates(query or {}) if _matches(doc, query or {})]
+
+    def distinct(self, field: str, query=None):
+        self._call("distinct")
+        with self._lock:
+            return list(dict.fromkeys(doc[field] for doc in self.docs if field in doc and _matches(doc, query or {})))
+
+    def count_documents(self, query: dict):
+        self._call("count_documents")
+        with self._lock:
+            return sum(1 for doc in self.docs if _matches(doc, query))
+
+    # Writes
+    def insert_many(self, docs: List[dict]):
+        self._call("insert_many")
+        with self._lock:
+            for doc in docs:
+                self._insert({"_id": next(self._ids), **copy.deepcopy(doc)})
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False):
+        self._call("update_one")
+        with self._lock:
+            self._upsert_one(query, update, upsert)
+
+    def find_one_and_update(self, query: dict, update: dict, upsert: bool = False,
+                            return_document=ReturnDocument.BEFORE, projection=None):
+        self._call("find_one_and_update")
+        with self._lock:
+            before, after = self._upsert_one(query, update, upsert)
+            doc = after if return_document == ReturnDocument.AFTER else before
+            return _project(doc, projection) if doc is not None else None
+
+    def bulk_write(self, requests, ordered: bool = True):
+        self._call("bulk_write")
+        with self._lock:
+            for op in requests:
+                self._upsert_one(op._filter, op._doc, op._upsert)
+
+    def create_index(self, keys, **kwargs):
+        self._call("create_index")
+        return kwargs.get("name", "_".join(f"{k}_{d}" for k, d in keys) if isinstance(keys, list) else f"{keys}_1")
+
+    def watch(self, *args, **kwargs):
+        # Like a standalone mongod: no change streams, so caches fall back to their TTL
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+class FakeDatabase:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self.latency)
+        return self.collections[name]
+
+# --- SQS ---
+class FakeSQS:
+    """
+    Single in-memory queue. Records when each message was first received and when it
+    was deleted, so latency covers prefetch wait, dispatch, handling and acknowledgement
+    (but not the time spent queued behind the pre-loaded backlog).
+
+    Visibility timeouts are simulated: a received message becomes receivable again once its
+    timeout (VisibilityTimeout of the receive, or the last visibility change) runs out
+    without a delete. `retried` counts those returns.
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._ready = deque()
+        self._inflight: Dict[str, tuple] = {}
+        self._cond = threading.Condition()
+        self.received_at: Dict[str, float] = {}
+        self.kinds: Dict[str, tuple] = {}  # message_id -> (type, tenant_id)
+        self.completed: List[tuple] = []  # (kind, latency_seconds, tenant_id)
+        self.retried = 0  # redeliveries (visibility ran out, or was set to 0)
+        self.default_visibility = 30
+
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def send_message(self, QueueUrl=None, MessageBody=None, **kwargs):
+        self._call()
+        message_id = str(uuid.uuid4())
+        with self._cond:
+            body = json.loads(MessageBody)
+            self.kinds[message_id] = (body.get("type", "?"), body.get("tenant_id", ""))
+            self._ready.append((message_id, MessageBody))
+            self._cond.notify()
+        return {"MessageId": message_id}
+
+    def send_message_batch(self, QueueUrl=None, Entries=(), **kwargs):
+        for entry in Entries:
+            self.send_message(QueueUrl, entry["MessageBody"])
+        return {"Successful": [{"Id": e["Id"]} for e in Entries], "Failed": []}
+
+    def _expire(self):
+        # Caller holds the lock
+        now = time.monotonic()
+        for handle in [h for h, (_, _, visible_at) in self._inflight.items() if visible_at <= now]:
+            message_id, body, _ = self._inflight.pop(handle)
+            self.retried += 1
+            self._ready.append((message_id, body))
+
+    def receive_message(self, QueueUrl=None, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=None, **kwargs):
+        self._call()
+        deadline = time.monotonic() + min(WaitTimeSeconds, 0.1)
+        visibility = self.default_visibility if VisibilityTimeout is None else VisibilityTimeout
+        messages = []
+        with self._cond:
+            self._expire()
+            while not self._ready and time.monotonic() < deadline:
+                self._cond.wait(max(deadline - time.monotonic(), 0))
+                self._expire()
+            while self._ready and len(messages) < MaxNumberOfMessages:
+                message_id, body = self._ready.popleft()
+                self.received_at.setdefault(message_id, time.perf_counter())
+                handle = f"{message_id}:{uuid.uuid4().hex[:8]}"
+                self._inflight[handle] = (message_id, body, time.monotonic() + visibility)
+                messages.append({"MessageId": message_id, "ReceiptHandle": handle, "Body": body})
+        return {"Messages": messages} if messages else {}
+
+    def _complete(self, handle: str):
+        entry = self._inflight.pop(handle, None)
+        if entry:
+            message_id = entry[0]
+            kind, tenant = self.kinds.pop(message_id)
+            self.completed.append((kind, time.perf_counter() - self.received_at.pop(message_id), tenant))
+            self._cond.notify_all()
+
+    def delete_message(self, QueueUrl=None, ReceiptHandle=None, **kwargs):
+        self._call()
+        with self._cond:
+            self._complete(ReceiptHandle)
+        return {}
+
+    def delete_message_batch(self, QueueUrl=None, Entries=(), **kwargs):
+        self._call()
+        with self._cond:
+            for entry in Entries:
+                self._complete(entry["ReceiptHandle"])
+        return {"Successful": [{"Id": e["Id"]} for e in Entries], "Failed": []}
+
+    def change_message_visibility(self, QueueUrl=None, ReceiptHandle=None, VisibilityTimeout=0, **kwargs):
+        self.change_message_visibility_batch(
+            QueueUrl, [{"Id": "0", "ReceiptHandle": ReceiptHandle, "VisibilityTimeout": VisibilityTimeout}]
+        )
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl=None, Entries=(), **kwargs):
+        self._call()
+        successful, failed = [], []
+        with self._cond:
+            for entry in Entries:
+                item = self._inflight.get(entry["ReceiptHandle"])
+                if item is None:
+                    failed.append({"Id": entry["Id"], "Code": "ReceiptHandleIsInvalid", "SenderFault": True})
+                    continue
+                successful.append({"Id": entry["Id"]})
+                self._inflight[entry["ReceiptHandle"]] = (item[0], item[1], time.monotonic() + entry.get("VisibilityTimeout", 0))
+            self._expire()
+            self._cond.notify_all()
+        return {"Successful": successful, "Failed": failed}
+
+    def wait_until_drained(self, expected: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while len(self.completed) < expected:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+# --- MQTT ---
+class FakeMessageInfo:
+    """Stands in for paho's MQTTMessageInfo."""
+    rc = 0
+
+    def __init__(self, mid: int, published: bool = True):
+        self.mid = mid
+        self._published = threading.Event()
+        if published:
+            self._published.set()
+
+    def is_published(self) -> bool:
+        return self._published.is_set()
+
+    def wait_for_publish(self, timeout=None):
+        self._published.wait(timeout)
+
+class RecordingMqttClient:
+    """Counts publishes per topic kind instead of talking to a broker."""
+    def __init__(self, latency: float = 0.0, ack_latency: float = 0.0):
+        self.latency = latency
+        self.ack_latency = ack_latency
+        self.published = defaultdict(int)
+        self.bytes = defaultdict(int)
+        self.max_unacked = 0
+        self.on_publish = None
+        self._unacked = deque()  # (due, info), in publish order
+        self._mids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        if ack_latency:
+            threading.Thread(target=self._ack_loop, name="fake-broker", daemon=True).start()
+
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        kind = topic.split("/")[2] if topic.count("/") >= 2 else topic
+        info = FakeMessageInfo(next(self._mids), published=not (self.ack_latency and qos))
+        with self._lock:
+            self.published[kind] += 1
+            self.bytes[kind] += len(payload or b"")
+            if not info.is_published():
+                self._unacked.append((time.monotonic() + self.ack_latency, info))
+                self.max_unacked = max(self.max_unacked, len(self._unacked))
+                self._cond.notify()
+        return info
+
+    def _ack_loop(self):
+        while True:
+            with self._cond:
+                while not self._unacked:
+                    self._cond.wait()
+                due, info = self._unacked[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                self._unacked.popleft()
+            info._published.set()
+            if self.on_publish:
+                self.on_publish(self, None, info.mid, 0, None)
@@ -0,0 +1,99 @@
+"""
+Startup-time benchmark for dense agent hosts: acquires N identities in one process
+(every IdentityProvider keeps its lock, like N agents running side by side) and
+reports the cost of the Nth acquisition for the allocation index (and, with --legacy,
+the previous linear probe of client_1, client_2, ... - quadratic, ~15 min for 10k).
+
+    python benchmarks/identity_alloc_bench.py [--identities 10000] [--with-state] [--legacy] [--bulk]
+
+--with-state times the full acquire_identity() (including creating each agent's
+state file); by default only ID allocation is measured. --bulk also times
+IdentityProvider.acquire_identities(N), the single block allocation agent_host.py uses.
+"""
+import argparse
+import fcntl
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from identity_provider import IdentityProvider
+
+def legacy_allocate(provider: IdentityProvider):
+    """The previous scheme: try every lock file from client_1 until one is free."""
+    i = 1
+    while True:
+        fp = open(provider._lock_path(i), 'w')
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return i, fp
+        except IOError:
+            fp.close()
+            i += 1
+
+def run(n: int, scheme: str, with_state: bool, checkpoints):
+    held, timings = [], {}
+    with tempfile.TemporaryDirectory() as root:
+        storage_dir, lock_dir = os.path.join(root, "agent_storage"), os.path.join(root, "locks")
+        start = last = time.perf_counter()
+        for i in range(1, n + 1):
+            provider = IdentityProvider(storage_dir, lock_dir)
+            if with_state and scheme == "index":
+                provider.acquire_identity()
+                held.append(provider.lock_file)
+            elif scheme == "index":
+                held.append(provider._allocate()[1])
+            else:
+                held.append(legacy_allocate(provider)[1])
+            if i in checkpoints:
+                now = time.perf_counter()
+                timings[i] = ((now - last) / (i - (max(k for k in timings) if timings else 0)), now - start)
+                last = now
+        for fp in held:
+            fp.close()
+    return timings
+
+def run_bulk(n: int) -> float:
+    with tempfile.TemporaryDirectory() as root:
+        start = time.perf_counter()
+        providers = IdentityProvider.acquire_identities(
+            n, os.path.join(root, "agent_storage"), os.path.join(root, "locks")
+        )
+        elapsed = time.perf_counter() - start
+        for provider in providers:
+            provider.release()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--identities", type=int, default=10000)
+    parser.add_argument("--with-state", action="store_true", help="Time acquire_identity() incl. state files")
+    parser.add_argument("--legacy", action="store_true", help="Also run the previous linear probe")
+    parser.add_argument("--bulk", action="store_true", help="Also time acquire_identities(N) (incl. state files)")
+    args = parser.parse_args()
+
+    # One descriptor per held identity
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    n = min(args.identities, hard - 64)
+    if n < args.identities:
+        print(f"Open file limit is {hard}: measuring {n} identities")
+
+    checkpoints = sorted({max(1, n // 10 * k) for k in range(1, 11)} | {n})
+    schemes = ["index", "legacy"] if args.legacy else ["index"]
+    results = {scheme: run(n, scheme, args.with_state and scheme == "index", checkpoints) for scheme in schemes}
+
+    print(f"{'identities':>10} " + " ".join(f"{s + ' us/acq':>16} {s + ' total s':>16}" for s in schemes))
+    for point in checkpoints:
+        row = " ".join(f"{results[s][point][0] * 1e6:>16.1f} {results[s][point][1]:>16.2f}" for s in schemes)
+        print(f"{point:>10} {row}")
+    if args.bulk:
+        elapsed = run_bulk(n)
+        print(f"acquire_identities({n}): {elapsed:.2f} s total, {elapsed / n * 1e6:.1f} us per identity")
+
+if __name__ == "__main__":
+    main()
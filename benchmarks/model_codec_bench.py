@@ -0,0 +1,73 @@
+"""
+Model codec benchmark: per-message CPU spent validating SQS envelopes and
+serializing MQTT responses, old path vs the hot-loop path.
+
+  decode: SQSMessage(**json.loads(body))  vs  SQS_ENVELOPE.validate_json(body)
+  encode: json.dumps(model.model_dump())  vs  model.model_dump_json()
+
+    python benchmarks/model_codec_bench.py [--iterations 20000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from provisioning_service.core.domain_models import SQS_ENVELOPE, PolicyResponse, SQSMessage
+from provisioning_service.core.wire import segment_topic
+
+TENANT = "tenant-cp"
+
+def envelopes() -> list:
+    return [
+        ("BOOTSTRAP", {"type": "BOOTSTRAP", "tenant_id": TENANT, "payload": {
+            "request_id": "req_1", "agent_id": "client_1", "accept_encodings": ["msgpack-v1", "json"],
+            "context": {"user_id": "u1", "groups": ["Engineering", "VPN-Users", "Admins"], "location": "TLV"}}}),
+        ("UPDATE_TRIGGER", {"type": "UPDATE_TRIGGER", "tenant_id": TENANT, "payload": {"segment_id": "seg_0042"}}),
+        ("RESYNC", {"type": "RESYNC", "tenant_id": TENANT, "payload": {
+            "request_id": "req_2", "agent_id": "client_1", "segment_versions": {f"seg_{i:04d}": 1000 + i for i in range(10)}}}),
+    ]
+
+def response_fields(n_segments: int) -> dict:
+    segments = [f"seg_{i:04d}" for i in range(n_segments)]
+    return dict(
+        status="SUCCESS",
+        assigned_segments=segments,
+        segment_topics=[segment_topic(TENANT, seg) for seg in segments],
+        segment_versions={seg: 1000 + i for i, seg in enumerate(segments)},
+    )
+
+def time_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def row(name: str, before: float, after: float):
+    print(f"{name:<30} {before:>10.2f} {after:>10.2f} {before / after:>7.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    print(f"{'case':<30} {'before us':>10} {'after us':>10} {'speedup':>8}")
+    for name, envelope in envelopes():
+        body = json.dumps(envelope)
+        # Both paths must agree before their cost is compared
+        assert SQSMessage(**json.loads(body)).model_dump() == SQS_ENVELOPE.validate_json(body).model_dump()
+        row(f"decode {name}", time_us(lambda: SQSMessage(**json.loads(body)), n),
+            time_us(lambda: SQS_ENVELOPE.validate_json(body), n))
+
+    for n_segments in (3, 50):
+        fields = response_fields(n_segments)
+        model = PolicyResponse(**fields)
+        assert json.loads(json.dumps(model.model_dump())) == json.loads(model.model_dump_json())
+        row(f"encode PolicyResponse ({n_segments})", time_us(lambda: json.dumps(model.model_dump()).encode(), n),
+            time_us(lambda: model.model_dump_json().encode(), n))
+
+if __name__ == "__main__":
+    main()
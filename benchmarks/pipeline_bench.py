@@ -0,0 +1,243 @@
+"""
+Offline benchmark of the provisioning pipeline: the real SQSConsumer, ProvisioningOrchestrator,
+repositories and MqttPublisher, running against the in-process backends in fakes.py
+(no MongoDB / LocalStack / Mosquitto needed).
+
+Every combination of --agents, --rules and --groups-per-agent is one scenario. Each scenario
+enqueues one BOOTSTRAP per agent plus UPDATE_TRIGGERs (--update-ratio), drains the queue and
+reports throughput and p50/p99 latency (receive -> delete) per message type. With --tenants N,
+--noisy-share of the messages belong to the first tenant and latency is reported per tenant:
+
+    python benchmarks/pipeline_bench.py --tenants 4 --noisy-share 0.9 --set SQS_BATCH_MODE=true
+
+    python benchmarks/pipeline_bench.py --agents 1000,5000 --rules 50,500
+    python benchmarks/pipeline_bench.py --set SQS_BATCH_MODE=true --set AGENT_WRITE_BATCHING=true
+    python benchmarks/pipeline_bench.py --puback-latency-ms 2 --set MQTT_PUBLISH_CONFIRM=false
+
+CI: record a baseline once, then fail the build when a run regresses by more than --max-regression:
+
+    python benchmarks/pipeline_bench.py --output baseline.json
+    python benchmarks/pipeline_bench.py --baseline baseline.json --max-regression 20
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from provisioning_service.core.config import settings
+from provisioning_service.adapters.sqs_consumer import SQSConsumer
+from provisioning_service.adapters.mqtt_publisher import MqttPublisher
+from provisioning_service.adapters.artifact_store import SegmentArtifactStore
+from provisioning_service.adapters.repositories import AgentRepository, RuleRepository, SegmentStateRepository
+from provisioning_service.logic.worker import ProvisioningOrchestrator
+from provisioning_service.main import decode_body
+from fakes import FakeDatabase, FakeSQS, RecordingMqttClient
+
+TENANT = "tenant-cp"
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def apply_overrides(pairs):
+    for pair in pairs:
+        key, _, raw = pair.partition("=")
+        current = getattr(settings, key)
+        if isinstance(current, bool):
+            value = raw.lower() in ("1", "true", "yes", "on")
+        else:
+            value = type(current)(raw)
+        setattr(settings, key, value)
+
+# --- Scenario Setup ---
+def tenant_names(n_tenants: int):
+    return [TENANT] + [f"tenant-{i}" for i in range(1, n_tenants)]
+
+def seed_rules(db, n_rules: int, n_groups: int, n_segments: int, rng: random.Random, n_tenants: int = 1):
+    groups = [f"grp_{i}" for i in range(n_groups)]
+    rules = [{"required_group": groups[i % n_groups], "target_segment": f"seg_{rng.randrange(n_segments)}"}
+             for i in range(n_rules)]
+    if n_tenants == 1:
+        for rule in rules:
+            rule["tenant_id"] = TENANT
+    db["segment_rules"].insert_many(rules)
+    return groups
+
+def build_messages(n_agents: int, groups, groups_per_agent: int, update_ratio: float, n_segments: int,
+                   rng: random.Random, n_tenants: int = 1, noisy_share: float = 0.0):
+    n_updates = int(n_agents * update_ratio)
+    tenants = tenant_names(n_tenants)
+
+    def pick_tenant():
+        # The first tenant gets `noisy_share` of the traffic (or an even share), the rest split the remainder
+        if n_tenants == 1 or rng.random() < (noisy_share or 1 / n_tenants):
+            return tenants[0]
+        return rng.choice(tenants[1:])
+
+    messages = [
+        {"type": "BOOTSTRAP", "tenant_id": pick_tenant(), "payload": {
+            "request_id": f"req_{i}", "agent_id": f"client_{i}",
+            "context": {"user_id": f"u{i}", "groups": rng.sample(groups, min(groups_per_agent, len(groups))),
+                        "location": "TLV"}
+        }}
+        for i in range(n_agents)
+    ]
+    messages += [
+        {"type": "UPDATE_TRIGGER", "tenant_id": pick_tenant(), "payload": {"segment_id": f"seg_{rng.randrange(n_segments)}"}}
+        for _ in range(n_updates)
+    ]
+    rng.shuffle(messages)
+    return messages
+
+def run_scenario(args, n_agents: int, n_rules: int, groups_per_agent: int) -> dict:
+    rng = random.Random(args.seed)
+    latency = args.backend_latency_ms / 1000
+    db = FakeDatabase(latency)
+    sqs = FakeSQS(latency)
+    mqtt = RecordingMqttClient(latency, args.puback_latency_ms / 1000)
+    groups = seed_rules(db, n_rules, args.groups, args.segments, rng, args.tenants)
+
+    artifact_dir = tempfile.TemporaryDirectory() if args.artifacts else None
+    orchestrator = ProvisioningOrchestrator(
+        agent_repo=AgentRepository(db),
+        rule_repo=RuleRepository(db),
+        seg_repo=SegmentStateRepository(db),
+        publisher=MqttPublisher(client=mqtt),
+        artifact_store=SegmentArtifactStore(root=artifact_dir.name) if artifact_dir else None
+    )
+
+    def process_message(msg):
+        orchestrator.handle_message(msg)
+
+    messages = build_messages(n_agents, groups, groups_per_agent, args.update_ratio, args.segments, rng,
+                              args.tenants, args.noisy_share)
+    for body in messages:
+        sqs.send_message(QueueUrl=settings.SQS_QUEUE_URL, MessageBody=json.dumps(body))
+
+    # The consumer loop never returns - run it on a daemon thread and wait for the queue to drain
+    start = time.perf_counter()
+    consumer = SQSConsumer(sqs_client=sqs, decode=decode_body)
+    threading.Thread(target=consumer.start_listening, args=(process_message,), daemon=True).start()
+    drained = sqs.wait_until_drained(len(messages), args.timeout)
+    elapsed = time.perf_counter() - start
+    orchestrator.close()
+    if artifact_dir:
+        artifact_dir.cleanup()
+
+    by_type = defaultdict(list)
+    for kind, seconds, tenant in sqs.completed:
+        by_type[f"{tenant} {kind}" if args.tenants > 1 else kind].append(seconds)
+    return {
+        "scenario": f"agents={n_agents},rules={n_rules},groups_per_agent={groups_per_agent}",
+        "drained": drained,
+        "messages": len(sqs.completed),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(sqs.completed) / elapsed, 1),
+        "retried": sqs.retried,
+        "mqtt_published": dict(mqtt.published),
+        "mqtt_max_unacked": mqtt.max_unacked,
+        "db_calls": {name: dict(col.calls) for name, col in db.collections.items()},
+        "types": {
+            kind: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 3),
+                "p99_ms": round(percentile(values, 99) * 1000, 3),
+            }
+            for kind, values in sorted(by_type.items())
+        },
+    }
+
+# --- Reporting ---
+def print_result(result: dict):
+    status = "" if result["drained"] else "  (TIMED OUT)"
+    print(f"\n{result['scenario']}: {result['messages']} msgs in {result['seconds']}s "
+          f"-> {result['throughput']} msg/s{status}")
+    width = max([16] + [len(kind) for kind in result["types"]])
+    for kind, stats in result["types"].items():
+        print(f"  {kind:<{width}} n={stats['count']:<7} p50={stats['p50_ms']:>9.3f}ms  p99={stats['p99_ms']:>9.3f}ms")
+
+def check_regressions(results, baseline_path: str, max_regression: float, slack_ms: float) -> list:
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    failures = []
+    for result in results:
+        base = baseline.get(result["scenario"])
+        if base is None:
+            continue
+        if not result["drained"]:
+            failures.append(f"{result['scenario']}: did not drain")
+        floor = base["throughput"] * (1 - max_regression / 100)
+        if result["throughput"] < floor:
+            failures.append(f"{result['scenario']}: throughput {result['throughput']} < {floor:.1f} msg/s")
+        for kind, stats in result["types"].items():
+            base_stats = base["types"].get(kind)
+            if base_stats is None:
+                continue
+            # Sub-millisecond p99s jitter by more than any sensible percentage - allow an absolute slack too
+            ceiling = base_stats["p99_ms"] * (1 + max_regression / 100) + slack_ms
+            if stats["p99_ms"] > ceiling:
+                failures.append(f"{result['scenario']}: {kind} p99 {stats['p99_ms']}ms > {ceiling:.3f}ms")
+    return failures
+
+def int_list(value: str):
+    return [int(v) for v in value.split(",")]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int_list, default=[1000], help="Fleet sizes (comma separated)")
+    parser.add_argument("--rules", type=int_list, default=[50], help="Rule counts (comma separated)")
+    parser.add_argument("--groups-per-agent", type=int_list, default=[2], help="Group mixes (comma separated)")
+    parser.add_argument("--groups", type=int, default=20, help="Distinct groups referenced by rules")
+    parser.add_argument("--segments", type=int, default=100, help="Distinct target segments")
+    parser.add_argument("--tenants", type=int, default=1, help="Tenants sharing the worker")
+    parser.add_argument("--noisy-share", type=float, default=0.0, help="Share of messages from the first tenant")
+    parser.add_argument("--update-ratio", type=float, default=0.1, help="UPDATE_TRIGGERs per BOOTSTRAP")
+    parser.add_argument("--backend-latency-ms", type=float, default=0.0, help="Added to every fake backend call")
+    parser.add_argument("--puback-latency-ms", type=float, default=0.0, help="Delay before the fake broker's PUBACK")
+    parser.add_argument("--artifacts", action="store_true", help="Store segment artifacts in a temp dir")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Override a setting")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-scenario drain timeout (seconds)")
+    parser.add_argument("--output", help="Write results as JSON (usable as a --baseline)")
+    parser.add_argument("--baseline", help="Compare against a previous --output file")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="Allowed regression in percent")
+    parser.add_argument("--p99-slack-ms", type=float, default=1.0, help="Absolute p99 slack for --baseline")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scenario; the fastest is reported")
+    args = parser.parse_args()
+
+    apply_overrides(args.set)
+    results = []
+    for n_agents, n_rules, gpa in itertools.product(args.agents, args.rules, args.groups_per_agent):
+        runs = [run_scenario(args, n_agents, n_rules, gpa) for _ in range(max(args.repeat, 1))]
+        result = max(runs, key=lambda r: r["throughput"])
+        print_result(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": args.set, "results": results}, f, indent=2)
+
+    if args.baseline:
+        failures = check_regressions(results, args.baseline, args.max_regression, args.p99_slack_ms)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.max_regression}% against {args.baseline}")
+
+    if not all(r["drained"] for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
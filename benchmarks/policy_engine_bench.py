@@ -0,0 +1,82 @@
+"""
+Compiled policy engine benchmark: single-agent evaluation cost (cold and memoized)
+and a bulk re-evaluation pass over a stored fleet after a rule change.
+
+    python benchmarks/policy_engine_bench.py [--rules 2000] [--agents 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from provisioning_service.core.policy_engine import CompiledPolicy, plan_reassignments
+
+TENANT = "tenant-cp"
+LOCATIONS = ["TLV", "NYC", "LON", "SFO", "BER"]
+
+def make_rules(n: int, n_groups: int, n_segments: int, rng: random.Random):
+    rules = []
+    for _ in range(n):
+        rule = {"required_group": f"grp_{rng.randrange(n_groups)}", "target_segment": f"seg_{rng.randrange(n_segments)}"}
+        if rng.random() < 0.2:
+            rule["required_location"] = rng.choice(LOCATIONS)
+        if rng.random() < 0.5:
+            rule["tenant_id"] = TENANT
+        rules.append(rule)
+    return rules
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=2000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--segments", type=int, default=500)
+    parser.add_argument("--agents", type=int, default=100000)
+    parser.add_argument("--groups-per-agent", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    rules = make_rules(args.rules, args.groups, args.segments, rng)
+    start = time.perf_counter()
+    policy = CompiledPolicy(rules)
+    print(f"compile {len(rules)} rules: {(time.perf_counter() - start) * 1000:.1f} ms "
+          f"({len(policy.attr_bits)} attributes, {len(policy.segments)} segments)")
+
+    # Single agent - distinct group sets (memo miss) vs repeated ones (memo hit)
+    samples = [([f"grp_{g}" for g in rng.sample(range(args.groups), args.groups_per_agent)], rng.choice(LOCATIONS))
+               for _ in range(20000)]
+    cold = CompiledPolicy(rules)
+    start = time.perf_counter()
+    for groups, location in samples:
+        cold.evaluate(TENANT, groups, location)
+    cold_us = (time.perf_counter() - start) / len(samples) * 1e6
+    start = time.perf_counter()
+    for groups, location in samples:
+        cold.evaluate(TENANT, groups, location)
+    warm_us = (time.perf_counter() - start) / len(samples) * 1e6
+    print(f"evaluate one agent: {cold_us:.2f} us (first time), {warm_us:.2f} us (memoized)")
+
+    # Bulk pass: a fleet drawn from a realistic number of distinct group combinations
+    combos = samples[:2000]
+    agents = []
+    for i in range(args.agents):
+        groups, location = rng.choice(combos)
+        agents.append({"agent_id": f"client_{i}", "tenant_id": TENANT, "groups": groups, "location": location,
+                       "assigned_segments": policy.evaluate(TENANT, groups, location)})
+
+    changed_rules = list(rules)
+    for _ in range(5):
+        changed_rules[rng.randrange(len(changed_rules))] = make_rules(1, args.groups, args.segments, rng)[0]
+    new_policy = CompiledPolicy(changed_rules)
+    start = time.perf_counter()
+    changes = plan_reassignments(new_policy, agents)
+    elapsed = time.perf_counter() - start
+    print(f"re-evaluate {len(agents)} agents after changing 5 rules: {elapsed * 1000:.1f} ms "
+          f"({len(agents) / elapsed / 1e6:.2f} M agents/s), {len(changes)} assignment(s) changed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Presence benchmark: a fleet heartbeating into the PresenceTracker, flushed into a
+FakeCollection on a simulated clock. Reports the agents_state write rate against
+the heartbeat rate (what writing on every heartbeat would cost) and the CPU spent
+per heartbeat and per flush.
+
+    python benchmarks/presence_bench.py [--agents 100000] [--heartbeat 30] [--duration 600]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from fakes import FakeDatabase
+from provisioning_service.adapters.repositories import AgentRepository
+from provisioning_service.core.config import settings
+from provisioning_service.logic.presence_tracker import OFFLINE, ONLINE, PresenceTracker
+
+class SimClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--agents", type=int, default=100000)
+    parser.add_argument("--heartbeat", type=float, default=30.0, help="agent heartbeat interval (s)")
+    parser.add_argument("--duration", type=float, default=600.0, help="simulated seconds")
+    parser.add_argument("--churn", type=float, default=0.001, help="share of agents dropping off per heartbeat interval")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    db = FakeDatabase()
+    agents = [f"client_{i}" for i in range(args.agents)]
+    db["agents_state"].insert_many([{"agent_id": a, "tenant_id": "tenant-cp", "assigned_segments": []} for a in agents])
+    repo = AgentRepository(db)
+    clock = SimClock()
+    flush_interval = settings.PRESENCE_FLUSH_SECONDS
+    tracker = PresenceTracker(
+        repo, flush_interval, settings.PRESENCE_LAST_SEEN_RESOLUTION_SECONDS, settings.PRESENCE_TIMEOUT_SECONDS,
+        int(settings.PRESENCE_MAX_WRITES_PER_SECOND * flush_interval), clock=clock
+    )
+
+    # Each agent heartbeats on its own phase; dropped agents send their last will and stay away
+    phase = {a: rng.uniform(0, args.heartbeat) for a in agents}
+    offline = set()
+    heartbeats = writes = 0
+    record_time = flush_time = 0.0
+    max_flush = 0
+    steps = int(args.duration / flush_interval)
+    for step in range(steps):
+        start_t = step * flush_interval
+        t0 = time.perf_counter()
+        for agent in agents:
+            if agent in offline:
+                continue
+            if (start_t - phase[agent]) % args.heartbeat < flush_interval:
+                if rng.random() < args.churn:
+                    offline.add(agent)
+                    tracker.record("tenant-cp", agent, OFFLINE, "s")
+                else:
+                    tracker.record("tenant-cp", agent, ONLINE, "s")
+                heartbeats += 1
+        record_time += time.perf_counter() - t0
+        clock.now += flush_interval
+        t0 = time.perf_counter()
+        written = tracker.flush()
+        flush_time += time.perf_counter() - t0
+        writes += written
+        max_flush = max(max_flush, written)
+
+    print(f"agents={args.agents} heartbeat={args.heartbeat:g}s flush={flush_interval:g}s "
+          f"resolution={settings.PRESENCE_LAST_SEEN_RESOLUTION_SECONDS:g}s simulated={args.duration:g}s")
+    print(f"  heartbeats        {heartbeats:>10}  ({heartbeats / args.duration:>9.1f}/s = write-per-heartbeat rate)")
+    print(f"  presence writes   {writes:>10}  ({writes / args.duration:>9.1f}/s, max {max_flush} per flush)")
+    print(f"  bulk_write calls  {db['agents_state'].calls['bulk_write']:>10}")
+    print(f"  record()          {record_time / max(heartbeats, 1) * 1e6:>10.2f} us per heartbeat")
+    print(f"  flush()           {flush_time / steps * 1000:>10.2f} ms per flush (in-process fake)")
+    print(f"  dropped agents    {len(offline):>10}  (written OFFLINE: "
+          f"{sum(1 for d in db['agents_state'].docs if d.get('status') == OFFLINE)})")
+
+if __name__ == "__main__":
+    main()
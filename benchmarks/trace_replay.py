@@ -0,0 +1,270 @@
+"""
+Replays an envelope trace recorded by the bridge (BRIDGE_TRACE_PATH) into the SQS queue
+and measures end-to-end latency per message type: from the moment an envelope is handed
+to the forwarder (where the bridge would) until the worker's answer arrives over MQTT.
+
+    BOOTSTRAP / RESYNC  - the response on the agent's private topic
+    UPDATE_TRIGGER      - the SEGMENT_UPDATE broadcast on the segment topic (one broadcast
+                          answers every trigger for that segment sent before it - coalescing)
+
+Envelopes are sent at the recorded pace scaled by --speed ("max" = as fast as possible).
+Request ids get a per-run suffix so the orchestrator's de-duplication does not answer a
+second replay from its cache (--keep-request-ids to replay them verbatim).
+
+Against the local stack (docker-compose + workers; start the bridge with ENABLE_SIMULATOR=false):
+
+    python benchmarks/trace_replay.py storm.trace.gz --speed 50
+
+Without any infrastructure - an in-process orchestrator on the fakes in fakes.py, with one
+rule per group seen in the trace:
+
+    python benchmarks/trace_replay.py storm.trace.gz --speed max --offline
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from provisioning_service.core.config import settings
+from provisioning_service.core.wire import decode_message
+from provisioning_service.adapters.repositories.dedup_repo import LEGACY_REQUEST_IDS
+from provisioning_service.adapters.sqs_forwarder import SqsBatchForwarder
+from provisioning_service.adapters.trace import read_trace
+
+REQUEST_TYPES = ("BOOTSTRAP", "RESYNC")
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def parse_speed(value: str) -> float:
+    """Speed factor; 0 = no pacing."""
+    return 0.0 if value == "max" else float(value)
+
+def tag_request_id(envelope: dict, run_tag: str) -> dict:
+    payload = envelope.get("payload") or {}
+    request_id = payload.get("request_id")
+    if envelope.get("type") not in REQUEST_TYPES or request_id in LEGACY_REQUEST_IDS or request_id is None:
+        return envelope
+    return {**envelope, "payload": {**payload, "request_id": f"{request_id}~{run_tag}"}}
+
+class ResponseMatcher:
+    """Pairs sent envelopes with the MQTT messages that answer them."""
+    def __init__(self):
+        self._pending = defaultdict(deque)  # (tenant, type, agent or segment id) -> deque of sent_at
+        self._lock = threading.Lock()
+        self.sent = defaultdict(int)
+        self.latencies = defaultdict(list)
+        self.outstanding = 0
+        self._all_answered = threading.Condition(self._lock)
+
+    def on_sent(self, envelope: dict, sent_at: float):
+        kind = envelope.get("type")
+        payload = envelope.get("payload") or {}
+        tenant = envelope.get("tenant_id")
+        if kind in REQUEST_TYPES:
+            key = (tenant, kind, payload.get("agent_id"))
+        elif kind == "UPDATE_TRIGGER":
+            key = (tenant, kind, payload.get("segment_id"))
+        else:
+            return
+        with self._lock:
+            self.sent[kind] += 1
+            self._pending[key].append(sent_at)
+            self.outstanding += 1
+
+    def on_message(self, topic: str, data: bytes, received_at: float):
+        parts = topic.split("/")
+        if len(parts) != 4 or parts[0] != "sase" or parts[2] not in ("node", "segment"):
+            return  # compact segment topics ("/c") duplicate the JSON broadcast
+        message = decode_message(data, topic)
+        if parts[2] == "node":
+            if message.get("type") == "RESYNC_RESPONSE":
+                answers = "RESYNC"
+            elif "assigned_segments" in message and message.get("reason", "BOOTSTRAP") == "BOOTSTRAP":
+                answers = "BOOTSTRAP"
+            else:
+                return  # reassignments are pushed, not requested
+        elif message.get("type") == "SEGMENT_UPDATE":
+            answers = "UPDATE_TRIGGER"
+        else:
+            return
+
+        with self._lock:
+            pending = self._pending.get((parts[1], answers, parts[3]))
+            # Requests: one response each, oldest first. Triggers: everything sent so far
+            while pending and pending[0] <= received_at:
+                self.latencies[answers].append(received_at - pending.popleft())
+                self.outstanding -= 1
+                if answers != "UPDATE_TRIGGER":
+                    break
+            if self.outstanding == 0:
+                self._all_answered.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        with self._all_answered:
+            return self._all_answered.wait_for(lambda: self.outstanding == 0, timeout)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                kind: {
+                    "sent": self.sent[kind],
+                    "answered": len(self.latencies[kind]),
+                    "p50_ms": round(percentile(self.latencies[kind], 50) * 1000, 3),
+                    "p95_ms": round(percentile(self.latencies[kind], 95) * 1000, 3),
+                    "p99_ms": round(percentile(self.latencies[kind], 99) * 1000, 3),
+                    "max_ms": round(max(self.latencies[kind], default=0.0) * 1000, 3),
+                }
+                for kind in sorted(self.sent)
+            }
+
+def replay(envelopes, forwarder, matcher: ResponseMatcher, speed: float) -> dict:
+    """Paces `envelopes` ((offset, envelope) pairs) onto the forwarder; returns send statistics."""
+    start = time.monotonic()
+    sent = dropped = 0
+    max_lag = 0.0
+    for offset, envelope in envelopes:
+        if speed:
+            due = start + offset / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                max_lag = max(max_lag, -delay)
+        now = time.monotonic()
+        matcher.on_sent(envelope, now)
+        if forwarder.forward(envelope):
+            sent += 1
+        else:
+            dropped += 1
+    elapsed = time.monotonic() - start
+    return {"sent": sent, "dropped": dropped, "seconds": round(elapsed, 3),
+            "rate": round(sent / elapsed, 1) if elapsed else 0.0, "max_lag_ms": round(max_lag * 1000, 3)}
+
+# --- Local stack ---
+def connect_stack(matcher: ResponseMatcher):
+    import boto3
+    import paho.mqtt.client as mqtt
+
+    subscribed = threading.Event()
+
+    def on_connect(client, userdata, flags, reason_code, properties):
+        client.subscribe([("sase/+/node/+", 1), ("sase/+/segment/+", 1)])
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, f"trace-replay-{uuid.uuid4().hex[:8]}")
+    client.on_connect = on_connect
+    client.on_subscribe = lambda *args: subscribed.set()
+    client.on_message = lambda c, u, msg: matcher.on_message(msg.topic, msg.payload, time.monotonic())
+    client.connect(settings.MQTT_HOST, settings.MQTT_PORT, 60)
+    client.loop_start()
+    if not subscribed.wait(10):
+        raise RuntimeError(f"No SUBACK from {settings.MQTT_HOST}:{settings.MQTT_PORT}")
+
+    sqs = boto3.client('sqs', endpoint_url=settings.SQS_ENDPOINT_URL, region_name=settings.AWS_REGION)
+    return SqsBatchForwarder(sqs, settings.SQS_QUEUE_URL), client.loop_stop
+
+# --- Offline (fakes) ---
+def start_offline(matcher: ResponseMatcher, envelopes):
+    from fakes import FakeDatabase, FakeSQS, RecordingMqttClient
+    from provisioning_service.adapters.sqs_consumer import SQSConsumer
+    from provisioning_service.adapters.mqtt_publisher import MqttPublisher
+    from provisioning_service.adapters.repositories import AgentRepository, RuleRepository, SegmentStateRepository
+    from provisioning_service.logic.worker import ProvisioningOrchestrator
+    from provisioning_service.main import decode_body
+
+    class DeliveringMqttClient(RecordingMqttClient):
+        """The broker hands every publish straight to the matcher (the replayer's subscription)."""
+        def publish(self, topic, payload=None, qos=0, retain=False, **kwargs):
+            info = super().publish(topic, payload, qos, retain, **kwargs)
+            matcher.on_message(topic, payload, time.monotonic())
+            return info
+
+    db = FakeDatabase()
+    groups, segments = set(), []
+    for _, envelope in envelopes:
+        payload = envelope.get("payload") or {}
+        if envelope.get("type") == "BOOTSTRAP":
+            groups.update(((payload.get("context") or {}).get("groups") or []))
+        elif envelope.get("type") == "UPDATE_TRIGGER" and payload.get("segment_id") not in segments:
+            segments.append(payload.get("segment_id"))
+    tenants = {envelope.get("tenant_id") for _, envelope in envelopes}
+    segments = segments or [f"seg_{i}" for i in range(max(len(groups), 1))]
+    rules = [{"required_group": group, "target_segment": segments[i % len(segments)], "tenant_id": tenant}
+             for i, group in enumerate(sorted(groups)) for tenant in tenants]
+    if rules:
+        db["segment_rules"].insert_many(rules)
+
+    sqs = FakeSQS()
+    orchestrator = ProvisioningOrchestrator(
+        agent_repo=AgentRepository(db),
+        rule_repo=RuleRepository(db),
+        seg_repo=SegmentStateRepository(db),
+        publisher=MqttPublisher(client=DeliveringMqttClient())
+    )
+    consumer = SQSConsumer(sqs_client=sqs, decode=decode_body)
+    threading.Thread(target=consumer.start_listening, args=(orchestrator.handle_message,), daemon=True).start()
+    return SqsBatchForwarder(sqs, settings.SQS_QUEUE_URL), orchestrator.close
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="Trace file written by the bridge (BRIDGE_TRACE_PATH)")
+    parser.add_argument("--speed", type=parse_speed, default=1.0, help='Pace factor (1 = as recorded, 50, "max")')
+    parser.add_argument("--only", help="Replay only these types (comma separated, e.g. BOOTSTRAP)")
+    parser.add_argument("--limit", type=int, default=0, help="Replay at most this many envelopes")
+    parser.add_argument("--keep-request-ids", action="store_true", help="Do not suffix request ids per run")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="Seconds to wait for outstanding answers")
+    parser.add_argument("--offline", action="store_true", help="In-process orchestrator on fakes, no infrastructure")
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+
+    only = set(args.only.split(",")) if args.only else None
+    run_tag = uuid.uuid4().hex[:8]
+    envelopes = []
+    for offset, envelope in read_trace(args.trace):
+        if only and envelope.get("type") not in only:
+            continue
+        envelopes.append((offset, envelope if args.keep_request_ids else tag_request_id(envelope, run_tag)))
+        if args.limit and len(envelopes) >= args.limit:
+            break
+    if not envelopes:
+        sys.exit(f"No envelopes to replay in {args.trace}")
+    # Filtering can leave a gap before the first envelope - start right away
+    first = envelopes[0][0]
+    envelopes = [(offset - first, envelope) for offset, envelope in envelopes]
+
+    matcher = ResponseMatcher()
+    forwarder, stop = start_offline(matcher, envelopes) if args.offline else connect_stack(matcher)
+    speed = "max" if not args.speed else f"{args.speed:g}x"
+    print(f"Replaying {len(envelopes)} envelopes ({envelopes[-1][0]:.1f}s recorded) at {speed}")
+    sending = replay(envelopes, forwarder, matcher, args.speed)
+    drained = matcher.wait(args.drain_timeout)
+    stop()
+
+    results = {"trace": args.trace, "speed": speed, "sending": sending, "drained": drained, "types": matcher.report()}
+    print(f"sent {sending['sent']} in {sending['seconds']}s ({sending['rate']}/s), dropped {sending['dropped']}, "
+          f"max lag behind schedule {sending['max_lag_ms']}ms")
+    print(f"{'type':<16} {'sent':>7} {'answered':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for kind, stats in results["types"].items():
+        print(f"{kind:<16} {stats['sent']:>7} {stats['answered']:>8} {stats['p50_ms']:>9.2f} "
+              f"{stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f}")
+    if not drained:
+        print(f"{matcher.outstanding} envelopes unanswered after {args.drain_timeout:g}s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not drained:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
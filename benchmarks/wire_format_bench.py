@@ -0,0 +1,69 @@
+"""
+Wire format benchmark: payload size and encode/decode cost of the MQTT control
+messages in JSON vs the compact msgpack-v1 encoding.
+
+    python benchmarks/wire_format_bench.py [--iterations 20000]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from provisioning_service.core.wire import ENCODING_COMPACT, ENCODING_JSON, decode_message, encode_message, segment_topic
+
+TENANT = "tenant-cp"
+
+def policy_response(n_segments: int) -> tuple:
+    segments = [f"seg_{i:04d}" for i in range(n_segments)]
+    payload = {
+        "status": "SUCCESS",
+        "assigned_segments": segments,
+        "segment_topics": [segment_topic(TENANT, seg) for seg in segments],
+        "segment_versions": {seg: 1000 + i for i, seg in enumerate(segments)},
+        "segment_hashes": {seg: f"{i:04x}" * 16 for i, seg in enumerate(segments)},
+        "artifact_url_template": "http://localhost:8080/artifacts/blobs/{sha256}.json.z",
+        "encoding": ENCODING_COMPACT,
+    }
+    return payload, f"sase/{TENANT}/node/client_1"
+
+def segment_update() -> tuple:
+    payload = {
+        "type": "SEGMENT_UPDATE",
+        "segment": "seg_0042",
+        "version": 1234,
+        "sha256": "9f2c" * 16,
+        "full_url": f"http://localhost:8080/artifacts/{TENANT}/seg_0042/v1234.json.z",
+        "delta_url": f"http://localhost:8080/artifacts/{TENANT}/seg_0042/v1234.from-v{{base}}.delta.z",
+        "delta_bases": [1233, 1232, 1231],
+    }
+    return payload, segment_topic(TENANT, "seg_0042", ENCODING_COMPACT)
+
+def time_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    cases = [
+        ("PolicyResponse (3 segments)", *policy_response(3)),
+        ("PolicyResponse (50 segments)", *policy_response(50)),
+        ("SEGMENT_UPDATE", *segment_update()),
+    ]
+
+    print(f"{'message':<30} {'encoding':<11} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+    for name, payload, topic in cases:
+        for encoding in (ENCODING_JSON, ENCODING_COMPACT):
+            data = encode_message(payload, encoding)
+            enc = time_us(lambda: encode_message(payload, encoding), args.iterations)
+            dec = time_us(lambda: decode_message(data, topic), args.iterations)
+            print(f"{name:<30} {encoding:<11} {len(data):>6} {enc:>10.2f} {dec:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 import json
 import os
 import fcntl
+import heapq
 import random
-from typing import Dict, List
+import uuid
+from typing import IO, Dict, List, Optional, Tuple
 from provisioning_service.core.logger import get_logger
 
 logger = get_logger("IdentityProvider") 
@@ -12,40 +14,136 @@ STORAGE_DIR = "./agent_storage"
 LOCK_DIR = "./locks"
 ALL_GROUPS = ["finance", "hr", "dev", "sales", "it"]
 
+# Allocation index: lets acquire_identity hand out IDs without probing every lock file.
+# Guarded by ALLOC_LOCK; the per-identity lock files remain the source of truth.
+ALLOC_INDEX = "allocation.json"
+ALLOC_LOCK = ".allocation.lock"
+RECLAIM_PROBES = 4  # allocated IDs checked per acquire for owners that died without releasing
+
 class IdentityProvider:
-    def __init__(self):
+    def __init__(self, storage_dir: str = STORAGE_DIR, lock_dir: str = LOCK_DIR):
         self.lock_file = None
         self.client_id = None
         self.data = {}
         self.my_file_path = None
+        self.storage_dir = storage_dir
+        self.lock_dir = lock_dir
         
         # Ensure directories exist
-        os.makedirs(LOCK_DIR, exist_ok=True)
-        os.makedirs(STORAGE_DIR, exist_ok=True)
+        os.makedirs(lock_dir, exist_ok=True)
+        os.makedirs(storage_dir, exist_ok=True)
 
     def acquire_identity(self) -> Dict:
-        """Finds the first available client ID by trying to lock files sequentially."""
-        i = 1
-        while True:
-            candidate_id = f"client_{i}"
-            lock_path = os.path.join(LOCK_DIR, f"{candidate_id}.lock")
-            
-            # Try to acquire an exclusive lock on this ID
-            fp = open(lock_path, 'w')
-            try:
-                fcntl.lockf(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                
-                # Success - we own this ID now
-                self.lock_file = fp
-                self.client_id = candidate_id
-                self.my_file_path = os.path.join(STORAGE_DIR, f"{candidate_id}.json")
-                logger.info(f"Acquired Identity: {candidate_id}")
-                return self._load_or_create_state()
-                
-            except IOError:
-                # Locked by another process, try next ID
-                fp.close()
-                i += 1
+        """Claims a free client ID (lowest released or reclaimed one first) and loads its state."""
+        return self._claim(*self._allocate())
+
+    @classmethod
+    def acquire_identities(cls, count: int, storage_dir: str = STORAGE_DIR, lock_dir: str = LOCK_DIR) -> List["IdentityProvider"]:
+        """
+        Claims `count` IDs under one allocation lock and one index read/write (agent hosts
+        running many identities). Returns one provider per ID, state loaded.
+        """
+        providers = [cls(storage_dir, lock_dir) for _ in range(count)]
+        if providers:
+            for provider, (number, fp) in zip(providers, providers[0]._allocate_block(count)):
+                provider._claim(number, fp)
+        return providers
+
+    def _claim(self, number: int, fp: IO) -> Dict:
+        candidate_id = f"client_{number}"
+
+        # Success - we own this ID now
+        self.lock_file = fp
+        self.client_id = candidate_id
+        self.my_file_path = os.path.join(self.storage_dir, f"{candidate_id}.json")
+        logger.info(f"Acquired Identity: {candidate_id}")
+        return self._load_or_create_state()
+
+    # --- Allocation ---
+    # flock (not lockf) so several providers in one process exclude each other and
+    # closing a probe descriptor never drops a lock held through another one.
+    def _lock_path(self, number: int) -> str:
+        return os.path.join(self.lock_dir, f"client_{number}.lock")
+
+    def _try_lock(self, number: int):
+        """Returns the open, exclusively locked file for this ID, or None if it is held."""
+        fp = open(self._lock_path(number), 'w')
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fp
+        except IOError:
+            fp.close()
+            return None
+
+    def _read_index(self) -> Dict:
+        try:
+            with open(os.path.join(self.lock_dir, ALLOC_INDEX), "r") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+        index.setdefault("next", 1)
+        index.setdefault("free", [])
+        index.setdefault("cursor", 1)
+        return index
+
+    def _write_index(self, index: Dict):
+        path = os.path.join(self.lock_dir, ALLOC_INDEX)
+        with open(path + ".tmp", "w") as f:
+            json.dump(index, f)
+        os.replace(path + ".tmp", path)
+
+    def _allocate(self):
+        return self._allocate_block(1)[0]
+
+    def _allocate_block(self, count: int) -> List[Tuple[int, IO]]:
+        """
+        Bounded work per ID, whatever the number of allocated IDs: pop the lowest ID from
+        the free-list, or take the next never-used one. Each ID also probes RECLAIM_PROBES
+        allocated IDs (round robin, cursor kept in the index), so IDs whose owner crashed
+        without release() return to the free-list; once there they go out before new IDs.
+        """
+        with open(os.path.join(self.lock_dir, ALLOC_LOCK), "w") as alloc_lock:
+            fcntl.flock(alloc_lock, fcntl.LOCK_EX)
+            index = self._read_index()
+            free = index["free"]
+
+            # 1. Reclaim IDs of dead owners
+            if index["next"] > 1:
+                free_set = set(free)
+                for _ in range(min(RECLAIM_PROBES * count, index["next"] - 1)):
+                    number = index["cursor"]
+                    index["cursor"] = number + 1 if number + 1 < index["next"] else 1
+                    if number in free_set:
+                        continue
+                    probe = self._try_lock(number)
+                    if probe:
+                        probe.close()
+                        heapq.heappush(free, number)
+                        free_set.add(number)
+
+            # 2. Lowest free IDs (skipping any that turn out to be held), else new ones
+            claimed = []
+            while len(claimed) < count:
+                fp = None
+                while free and fp is None:
+                    number = heapq.heappop(free)
+                    fp = self._try_lock(number)
+                while fp is None:
+                    number = index["next"]
+                    index["next"] += 1
+                    fp = self._try_lock(number)
+                claimed.append((number, fp))
+
+            self._write_index(index)
+            return claimed
+
+    def _release_id(self, number: int):
+        with open(os.path.join(self.lock_dir, ALLOC_LOCK), "w") as alloc_lock:
+            fcntl.flock(alloc_lock, fcntl.LOCK_EX)
+            index = self._read_index()
+            if number not in index["free"]:
+                heapq.heappush(index["free"], number)
+                self._write_index(index)
 
     def _load_or_create_state(self) -> Dict:
         """Loads THIS agent's specific JSON file."""
@@ -67,16 +165,63 @@ class IdentityProvider:
     def _init_new_state(self):
         self.data = {
             "client_id": self.client_id,
-            "tenant_id": "tenant-cp",
+            "tenant_id": os.getenv("AGENT_TENANT_ID", "tenant-cp"),
             "groups": random.sample(ALL_GROUPS, 3),
             "assigned_segments": [] 
         }
         self._save_to_disk()
 
-    def update_segments(self, segments: List[str]):
+    def update_segments(self, segments: List[str], wire_encoding: Optional[str] = None):
         """Updates the local state and writes to the specific agent file."""
         logger.info(f"Writing segments {segments} to {self.my_file_path}")
         self.data["assigned_segments"] = segments
+        if wire_encoding:
+            self.data["wire_encoding"] = wire_encoding
+        self._save_to_disk()
+
+    def pending_request_id(self, kind: str) -> str:
+        """
+        Request ID for a `kind` of request ("bootstrap", "resync") until it is answered.
+        Resends (reconnect loops, restarts) reuse it, so the service can spot them as duplicates.
+        """
+        pending = self.data.setdefault("pending_requests", {})
+        if kind not in pending:
+            pending[kind] = f"{kind}-{uuid.uuid4().hex}"
+            self._save_to_disk()
+        return pending[kind]
+
+    def complete_request(self, kind: str):
+        if self.data.get("pending_requests", {}).pop(kind, None):
+            self._save_to_disk()
+
+    def update_segment_versions(self, versions: Dict[str, int]):
+        """Records the last applied version per segment (sent back in resync requests)."""
+        self.data.setdefault("segment_versions", {}).update(versions)
+        self._save_to_disk()
+
+    # --- Segment Policies (one file per segment, next to the agent file) ---
+    def _segment_path(self, segment_id: str) -> str:
+        return os.path.join(self.storage_dir, f"{self.client_id}.segments", f"{segment_id}.json")
+
+    def load_segment_policy(self, segment_id: str) -> Optional[Dict]:
+        """Returns {"version": int, "rules": [...]} for the last applied version, if any."""
+        try:
+            with open(self._segment_path(segment_id), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save_segment_policy(self, segment_id: str, version: int, rules: List[str]):
+        path = self._segment_path(segment_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_file = path + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"version": version, "rules": rules}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, path)
+
+        self.data.setdefault("segment_versions", {})[segment_id] = version
         self._save_to_disk()
 
     def _save_to_disk(self):
@@ -92,4 +237,6 @@ class IdentityProvider:
 
     def release(self):
         if self.lock_file:
-            self.lock_file.close()
\ No newline at end of file
+            self.lock_file.close()
+            self.lock_file = None
+            self._release_id(int(self.client_id.split("_")[1]))
\ No newline at end of file
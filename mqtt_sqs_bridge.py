@@ -8,7 +8,13 @@ from pymongo import MongoClient
 
 # Use our Clean Architecture imports
 from provisioning_service.core.config import settings
-from provisioning_service.adapters.repositories import RuleRepository
+from provisioning_service.core.metrics import registry
+from provisioning_service.adapters.repositories import AgentRepository, RuleRepository
+from provisioning_service.adapters.sqs_forwarder import SqsBatchForwarder
+from provisioning_service.adapters.metrics_server import start_metrics_server
+from provisioning_service.adapters.trace import TraceRecorder
+from provisioning_service.core.wire import PRESENCE_TOPIC_FILTER
+from provisioning_service.logic.presence_tracker import PresenceTracker
 
 from provisioning_service.core.logger import get_logger
 from provisioning_service.infra_utils import set_tab_title
@@ -16,6 +22,11 @@ from provisioning_service.infra_utils import set_tab_title
 # Initialize Logger
 logger = get_logger("BridgeService")
 
+# Ingest stage (MQTT request -> buffered envelope); the SQS leg is measured by the forwarder
+REQUESTS = registry.counter("bridge_requests_total", "Agent requests received over MQTT", ["type"])
+REQUEST_ERRORS = registry.counter("bridge_request_errors_total", "Agent requests that could not be parsed")
+HANDLE_LATENCY = registry.histogram("bridge_handle_seconds", "Time to parse and buffer an agent request", ["type"])
+
 # --- Configuration ---
 MQTT_TOPIC = "client_requests"
 SQS_URL = settings.SQS_QUEUE_URL
@@ -26,34 +37,78 @@ sqs = boto3.client('sqs', endpoint_url=settings.SQS_ENDPOINT_URL, region_name=se
 mongo_client = MongoClient(settings.MONGO_URI)
 db = mongo_client[settings.DB_NAME]
 rule_repo = RuleRepository(db)
+forwarder = SqsBatchForwarder(sqs, SQS_URL)
+recorder = TraceRecorder(settings.BRIDGE_TRACE_PATH) if settings.BRIDGE_TRACE_PATH else None
+presence = PresenceTracker(
+    AgentRepository(db),
+    flush_interval=settings.PRESENCE_FLUSH_SECONDS,
+    resolution=settings.PRESENCE_LAST_SEEN_RESOLUTION_SECONDS,
+    timeout=settings.PRESENCE_TIMEOUT_SECONDS,
+    max_writes=int(settings.PRESENCE_MAX_WRITES_PER_SECOND * settings.PRESENCE_FLUSH_SECONDS)
+) if settings.PRESENCE_ENABLED else None
 
 # --- 1. MQTT Bridge Logic ---
 def on_connect(client, userdata, flags, reason_code, properties):
     logger.info(f"Connected. Subscribing to '{MQTT_TOPIC}'...")
     client.subscribe(MQTT_TOPIC)
+    if presence:
+        client.subscribe(PRESENCE_TOPIC_FILTER)
+
+def build_envelope(raw_payload: dict) -> dict:
+    """Agent request -> SQS envelope. Requests without a "type" are bootstraps (older agents)."""
+    request_type = raw_payload.get("type", "BOOTSTRAP")
+    if request_type == "RESYNC":
+        payload = {
+            "request_id": raw_payload.get("request_id"),
+            "agent_id": raw_payload.get("agent_id"),
+            "segment_versions": raw_payload.get("segment_versions", {}),
+            "encoding": raw_payload.get("encoding", "json")
+        }
+    else:
+        request_type = "BOOTSTRAP"
+        payload = {
+            "request_id": raw_payload.get("request_id"),
+            "agent_id": raw_payload.get("agent_id"),
+            "context": raw_payload.get("context"),
+            "accept_encodings": raw_payload.get("accept_encodings", ["json"])
+        }
+    # Agents name their tenant; TENANT_ID covers agents that predate multi-tenancy
+    return {"type": request_type, "tenant_id": raw_payload.get("tenant_id") or TENANT_ID, "payload": payload}
+
+def send_envelope(envelope: dict) -> bool:
+    """Everything bound for SQS goes through here, so a trace captures agent requests and simulated updates alike."""
+    if recorder:
+        recorder.record(envelope)
+    return forwarder.forward(envelope)
 
 def on_message(client, userdata, msg):
-    """Handle Agent Bootstrap Requests"""
+    """Handle Agent Requests (BOOTSTRAP / RESYNC)"""
+    started = time.perf_counter()
     try:
         raw_payload = json.loads(msg.payload.decode())
-        logger.info(f"Received Bootstrap Request from {raw_payload.get('agent_id')}")
-        
-        envelope = {
-            "type": "BOOTSTRAP",
-            "tenant_id": TENANT_ID,
-            "payload": {
-                "request_id": raw_payload.get("request_id"),
-                "agent_id": raw_payload.get("agent_id"),
-                "context": raw_payload.get("context")
-            }
-        }
+        envelope = build_envelope(raw_payload)
+        REQUESTS.inc(type=envelope['type'])
+        logger.info(f"Received {envelope['type']} Request from {raw_payload.get('agent_id')}")
         
-        sqs.send_message(QueueUrl=SQS_URL, MessageBody=json.dumps(envelope))
-        logger.info("Forwarded BOOTSTRAP to SQS")
+        # Buffered - never blocks on SQS latency (only on a full buffer)
+        if send_envelope(envelope):
+            logger.info(f"Queued {envelope['type']} for SQS")
+        HANDLE_LATENCY.observe(time.perf_counter() - started, type=envelope['type'])
 
     except Exception as e:
+        REQUEST_ERRORS.inc()
         logger.error(f"Bridge Error - {e}")
 
+def on_presence(client, userdata, msg):
+    """Heartbeats / last wills (sase/<tenant>/presence/<agent_id>) - memory only, flushed in bulk"""
+    try:
+        data = json.loads(msg.payload.decode())
+        _, tenant_id, _, agent_id = msg.topic.split("/")
+        presence.record(tenant_id, agent_id, data.get("status", "ONLINE"), data.get("session"))
+    except Exception as e:
+        REQUEST_ERRORS.inc()
+        logger.error(f"Presence Error - {e}")
+
 # --- 2. Simulator Logic (Dynamic) ---
 def run_simulator_loop():
     """Simulates Admin clicking 'Update Policy' in the UI"""
@@ -82,7 +137,7 @@ def run_simulator_loop():
                 }
             }
             
-            sqs.send_message(QueueUrl=SQS_URL, MessageBody=json.dumps(envelope))
+            send_envelope(envelope)
             logger.info(f"Triggered UPDATE for {target} -> SQS")
             
         except Exception as e:
@@ -92,13 +147,26 @@ def run_simulator_loop():
 if __name__ == "__main__":
     # Start Simulator Thread
     set_tab_title("Bridge & Simulator")
+    if settings.METRICS_ENABLED:
+        start_metrics_server(settings.BRIDGE_METRICS_PORT)
 
-    sim_thread = threading.Thread(target=run_simulator_loop, daemon=True)
-    sim_thread.start()
+    # Off when replaying a trace against this stack - random updates would skew the measurement
+    if settings.ENABLE_SIMULATOR:
+        sim_thread = threading.Thread(target=run_simulator_loop, daemon=True)
+        sim_thread.start()
 
     # Start MQTT Bridge (Blocking)
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, "bridge-service")
     client.on_connect = on_connect
     client.on_message = on_message
+    if presence:
+        presence.start()
+        client.message_callback_add(PRESENCE_TOPIC_FILTER, on_presence)
     client.connect(settings.MQTT_HOST, settings.MQTT_PORT, 60)
-    client.loop_forever()
\ No newline at end of file
+    try:
+        client.loop_forever()
+    finally:
+        if presence:
+            presence.stop()  # write what is still pending
+        if recorder:
+            recorder.close()
\ No newline at end of file
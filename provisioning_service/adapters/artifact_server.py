@@ -0,0 +1,197 @@
+import hashlib
+import os
+import re
+import stat
+import threading
+from collections import OrderedDict
+from functools import partial
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+from urllib.parse import unquote
+from ..core.config import settings
+from ..core.metrics import registry
+from .artifact_store import BLOB_DIR
+from provisioning_service.core.logger import get_logger
+
+logger = get_logger("ArtifactServer")
+
+URL_PREFIX = "/artifacts"
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+CONTENT_TYPES = {".z": "application/zlib", ".json": "application/json"}
+# Blob URLs name their content, so clients may keep them forever; other paths revalidate (ETag)
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+ETAG_CACHE_MAX_ENTRIES = 10000
+
+REQUESTS = registry.counter("artifact_requests_total", "Artifact HTTP responses", ["status"])
+BYTES_SENT = registry.counter("artifact_bytes_sent_total", "Artifact body bytes sent")
+
+class ETagCache:
+    """
+    Strong ETags: the blob's content hash (from its name), or the sha256 of the file's bytes.
+    Artifacts are only ever replaced by rename, so (inode, mtime, size) identifies the content.
+    """
+    def __init__(self, max_entries: int = ETAG_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, f, st: os.stat_result) -> str:
+        name = os.path.basename(path)
+        if os.path.basename(os.path.dirname(path)) == BLOB_DIR:
+            return f'"{name.split(".", 1)[0]}"'
+        key = (path, st.st_ino, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            etag = self._entries.get(key)
+        if etag is None:
+            digest = hashlib.sha256()
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+            f.seek(0)
+            etag = f'"{digest.hexdigest()}"'
+            with self._lock:
+                self._entries[key] = etag
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return etag
+
+ETAGS = ETagCache()
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Single byte range -> (start, end) inclusive. None = ignore the header (serve the whole
+    file, as RFC 9110 allows for unsupported forms); (size, size) = not satisfiable.
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        if int(last) == 0:
+            return size, size
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        return size, size
+    if end < start:
+        return None
+    return start, end
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match uses weak comparison: W/ prefixes are ignored."""
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+class ArtifactRequestHandler(BaseHTTPRequestHandler):
+    """
+    Read-only serving of the artifact directory under /artifacts/: strong ETags with
+    If-None-Match (304), single byte ranges (206 / 416, If-Range) and zero-copy bodies
+    (socket.sendfile -> os.sendfile where the platform has it).
+    """
+    protocol_version = "HTTP/1.1"  # keep-alive: an agent often fetches several artifacts
+    # Headers and the sendfile body are separate writes - without TCP_NODELAY the body waits
+    # for the client's delayed ACK (~40ms per response)
+    disable_nagle_algorithm = True
+
+    def __init__(self, *args, directory: str, **kwargs):
+        self.directory = directory
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def _resolve(self) -> Optional[str]:
+        path = unquote(self.path.split("?", 1)[0])
+        if not path.startswith(URL_PREFIX + "/"):
+            return None
+        parts = path[len(URL_PREFIX) + 1:].split("/")
+        if any(p in ("", ".", "..") or "\\" in p or "\0" in p for p in parts) or parts[-1].endswith(".tmp"):
+            return None
+        return os.path.join(self.directory, *parts)
+
+    def _serve(self, send_body: bool):
+        path = self._resolve()
+        try:
+            f = open(path, "rb") if path else None
+        except OSError:
+            f = None
+        if f is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                self.send_error(HTTPStatus.NOT_FOUND)
+                return
+            size = st.st_size
+            etag = ETAGS.get(path, f, st)
+            cache_control = IMMUTABLE if os.path.basename(os.path.dirname(path)) == BLOB_DIR else REVALIDATE
+
+            # 1. Conditional request - the client already holds this content
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match and etag_matches(if_none_match, etag):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", cache_control)
+                self.end_headers()
+                return
+
+            # 2. Range (resuming an interrupted download). If-Range: only if the content is unchanged
+            start, end = 0, size - 1
+            status = HTTPStatus.OK
+            range_header = self.headers.get("Range")
+            if range_header and self.headers.get("If-Range", etag) == etag:
+                requested = parse_range(range_header, size)
+                if requested == (size, size):
+                    self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if requested is not None:
+                    start, end = requested
+                    status = HTTPStatus.PARTIAL_CONTENT
+            length = end - start + 1 if size else 0
+
+            # 3. Headers
+            self.send_response(status)
+            self.send_header("Content-Type", CONTENT_TYPES.get(os.path.splitext(path)[1], "application/octet-stream"))
+            self.send_header("Content-Length", str(length))
+            self.send_header("ETag", etag)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Cache-Control", cache_control)
+            if status == HTTPStatus.PARTIAL_CONTENT:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+
+            # 4. Body - file -> socket in the kernel, no copy through Python
+            if send_body and length:
+                try:
+                    self.wfile.flush()
+                    sent = self.connection.sendfile(f, offset=start, count=length)
+                    BYTES_SENT.inc(sent)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+
+    def log_request(self, code="-", size="-"):
+        if isinstance(code, int):
+            REQUESTS.inc(status=str(int(code)))
+        super().log_request(code, size)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def start_artifact_server(root: str = None, port: int = None) -> ThreadingHTTPServer:
+    root = root or settings.ARTIFACT_DIR
+    port = port or settings.ARTIFACT_SERVER_PORT
+    os.makedirs(root, exist_ok=True)
+    server = ThreadingHTTPServer(("0.0.0.0", port), partial(ArtifactRequestHandler, directory=root))
+    threading.Thread(target=server.serve_forever, name="artifact-server", daemon=True).start()
+    logger.info(f"Serving artifacts from {root} on :{port}{URL_PREFIX}/")
+    return server
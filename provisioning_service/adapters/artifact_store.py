@@ -0,0 +1,265 @@
+import errno
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from ..core.config import settings
+from ..core.delta import compress_policy, decompress_policy, make_delta, policy_digest
+from ..core.domain_models import SAFE_ID_PATTERN, SegmentArtifact
+from provisioning_service.core.logger import get_logger
+
+logger = get_logger("ArtifactStore")
+
+FULL_PATTERN = re.compile(r"^v(\d+)\.json\.z$")
+SAFE_ID = re.compile(SAFE_ID_PATTERN)
+
+BLOB_DIR = "blobs"
+# An unreferenced blob is only collected once its link count has been stable this long,
+# so a concurrent save of the same content (in another worker) does not lose it
+BLOB_GC_GRACE_SECONDS = 60.0
+DESCRIBE_CACHE_MAX_ENTRIES = 50000
+# os.link errors meaning the filesystem can't hard-link at all - fall back to copies for good
+NO_LINK_ERRNOS = {errno.EPERM, errno.EXDEV, errno.ENOTSUP, errno.EOPNOTSUPP}
+
+class InvalidArtifactId(ValueError):
+    """A tenant or segment ID that can't be used as a path segment ("..", "/", ...)."""
+
+def check_ids(tenant_id: str, segment_id: str):
+    for value in (tenant_id, segment_id):
+        if not isinstance(value, str) or not SAFE_ID.match(value):
+            raise InvalidArtifactId(f"Invalid artifact path segment: {value!r}")
+
+class SegmentArtifactStore:
+    """
+    Versioned segment policies on disk (shared by the worker processes of a host):
+
+        {ARTIFACT_DIR}/blobs/{sha256}.json.z                       full policy (zlib), content-addressed
+        {ARTIFACT_DIR}/{tenant}/{segment}/v{N}.json.z              hard link to its blob
+        {ARTIFACT_DIR}/{tenant}/{segment}/v{N}.from-v{B}.delta.z   delta B -> N
+        {ARTIFACT_DIR}/{tenant}/{segment}/v{N}.meta.json           sha256 + delta bases
+
+    A version is compressed once, when it is saved. Its sha256 (of the canonical policy)
+    names the blob, so identical policies share one file and one URL, and agents that
+    already hold that content skip the download.
+    Deltas are produced against the ARTIFACT_DELTA_BASES most recent stored versions,
+    and only the newest ARTIFACT_RETENTION_VERSIONS versions are kept.
+    The directory is served by the artifact server under ARTIFACT_BASE_URL.
+    """
+    def __init__(self, root: str = None, base_url: str = None):
+        self.root = root or settings.ARTIFACT_DIR
+        self.base_url = (base_url or settings.ARTIFACT_BASE_URL).rstrip("/")
+        self._links = True  # False once the filesystem refused a hard link (blobs are then never collected)
+        self._unreferenced: Dict[str, float] = {}  # blob sha256 -> when its last known version expired
+        # Stored versions are immutable, so their descriptions can be cached indefinitely
+        self._described: "OrderedDict[tuple, SegmentArtifact]" = OrderedDict()
+        self._described_lock = threading.Lock()
+
+    # --- Paths / URLs ---
+    def _segment_dir(self, tenant_id: str, segment_id: str) -> str:
+        check_ids(tenant_id, segment_id)
+        return os.path.join(self.root, tenant_id, segment_id)
+
+    def _full_name(self, version: int) -> str:
+        return f"v{version}.json.z"
+
+    def _delta_name(self, version: int, base: int) -> str:
+        return f"v{version}.from-v{base}.delta.z"
+
+    def _meta_name(self, version: int) -> str:
+        return f"v{version}.meta.json"
+
+    def _blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, BLOB_DIR, f"{sha256}.json.z")
+
+    def blob_url_template(self) -> str:
+        return f"{self.base_url}/{BLOB_DIR}/{{sha256}}.json.z"
+
+    def blob_url(self, sha256: str) -> str:
+        return self.blob_url_template().format(sha256=sha256)
+
+    def full_url(self, tenant_id: str, segment_id: str, version: int) -> str:
+        check_ids(tenant_id, segment_id)
+        return f"{self.base_url}/{tenant_id}/{segment_id}/{self._full_name(version)}"
+
+    def delta_url_template(self, tenant_id: str, segment_id: str, version: int) -> str:
+        check_ids(tenant_id, segment_id)
+        return f"{self.base_url}/{tenant_id}/{segment_id}/v{version}.from-v{{base}}.delta.z"
+
+    # --- Reads ---
+    def stored_versions(self, tenant_id: str, segment_id: str) -> List[int]:
+        try:
+            names = os.listdir(self._segment_dir(tenant_id, segment_id))
+        except FileNotFoundError:
+            return []
+        return sorted(int(m.group(1)) for m in map(FULL_PATTERN.match, names) if m)
+
+    def load_policy(self, tenant_id: str, segment_id: str, version: int) -> Optional[List[str]]:
+        path = os.path.join(self._segment_dir(tenant_id, segment_id), self._full_name(version))
+        try:
+            with open(path, "rb") as f:
+                return decompress_policy(f.read())
+        except FileNotFoundError:
+            return None
+
+    def load_latest(self, tenant_id: str, segment_id: str, below: int) -> Optional[List[str]]:
+        """Most recent stored policy older than `below` (the base for the next version)."""
+        for version in reversed(self.stored_versions(tenant_id, segment_id)):
+            if version < below:
+                return self.load_policy(tenant_id, segment_id, version)
+        return None
+
+    def describe(self, tenant_id: str, segment_id: str, version: int) -> Optional[SegmentArtifact]:
+        """The SegmentArtifact announced for a stored version, without reading the policy."""
+        key = (tenant_id, segment_id, version)
+        with self._described_lock:
+            artifact = self._described.get(key)
+        if artifact is not None:
+            return artifact
+        path = os.path.join(self._segment_dir(tenant_id, segment_id), self._meta_name(version))
+        try:
+            with open(path, "r") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return self._artifact(tenant_id, segment_id, version, meta["sha256"], meta["delta_bases"])
+
+    def describe_many(self, tenant_id: str, versions: Dict[str, int]) -> Dict[str, SegmentArtifact]:
+        """segment -> artifact for every stored one of `versions` (segment -> version)."""
+        artifacts = {}
+        for segment_id, version in versions.items():
+            artifact = self.describe(tenant_id, segment_id, version)
+            if artifact is not None:
+                artifacts[segment_id] = artifact
+        return artifacts
+
+    def _artifact(self, tenant_id: str, segment_id: str, version: int, sha256: str, delta_bases: List[int]):
+        artifact = SegmentArtifact(
+            version=version,
+            sha256=sha256,
+            full_url=self.blob_url(sha256),
+            delta_url_template=self.delta_url_template(tenant_id, segment_id, version),
+            delta_bases=delta_bases
+        )
+        with self._described_lock:
+            self._described[(tenant_id, segment_id, version)] = artifact
+            while len(self._described) > DESCRIBE_CACHE_MAX_ENTRIES:
+                self._described.popitem(last=False)
+        return artifact
+
+    # --- Writes ---
+    def save_version(self, tenant_id: str, segment_id: str, version: int, rules: List[str]) -> SegmentArtifact:
+        seg_dir = self._segment_dir(tenant_id, segment_id)
+        os.makedirs(seg_dir, exist_ok=True)
+
+        # 1. Deltas from the most recent older versions
+        older = [v for v in self.stored_versions(tenant_id, segment_id) if v < version]
+        delta_bases = []
+        for base in reversed(older[-settings.ARTIFACT_DELTA_BASES:]):
+            base_rules = self.load_policy(tenant_id, segment_id, base)
+            if base_rules is None:
+                continue
+            self._write(os.path.join(seg_dir, self._delta_name(version, base)), make_delta(base_rules, rules))
+            delta_bases.append(base)
+
+        # 2. Manifest (answers resync requests without decompressing the policy)
+        sha256 = policy_digest(rules)
+        meta = {"sha256": sha256, "delta_bases": delta_bases}
+        self._write(os.path.join(seg_dir, self._meta_name(version)), json.dumps(meta).encode())
+
+        # 3. Full artifact last - its presence means the version is complete
+        self._materialize(sha256, rules, os.path.join(seg_dir, self._full_name(version)))
+
+        # 4. Retention
+        self._prune(tenant_id, segment_id)
+
+        return self._artifact(tenant_id, segment_id, version, sha256, delta_bases)
+
+    def _write(self, path: str, data: bytes):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def _materialize(self, sha256: str, rules: List[str], path: str):
+        """Compresses the policy into its blob (unless that content is already stored) and links it."""
+        blob = self._blob_path(sha256)
+        for attempt in range(2):
+            if attempt or not os.path.exists(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                self._write(blob, compress_policy(rules))
+            if not self._links:
+                break
+            tmp = f"{path}.{os.getpid()}.tmp"
+            try:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                os.link(blob, tmp)
+            except FileNotFoundError:
+                continue  # collected by another worker since the exists() check - write it again
+            except OSError as e:
+                if e.errno == errno.EMLINK:
+                    break  # this blob has too many links - copy it, keep linking the others
+                if e.errno not in NO_LINK_ERRNOS:
+                    raise
+                logger.warning(f"Hard links unavailable in {self.root}, copying artifacts instead ({e})")
+                self._links = False
+                break
+            os.replace(tmp, path)
+            return
+        try:
+            with open(blob, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = compress_policy(rules)
+        self._write(path, data)
+
+    def _prune(self, tenant_id: str, segment_id: str):
+        versions = self.stored_versions(tenant_id, segment_id)
+        expired = set(versions[:-settings.ARTIFACT_RETENTION_VERSIONS])
+        if not expired:
+            return
+        seg_dir = self._segment_dir(tenant_id, segment_id)
+        digests = set()
+        for name in os.listdir(seg_dir):
+            match = re.match(r"^v(\d+)\.", name)
+            if match and int(match.group(1)) in expired:
+                if name.endswith(".meta.json"):
+                    artifact = self.describe(tenant_id, segment_id, int(match.group(1)))
+                    if artifact:
+                        digests.add(artifact.sha256)
+                try:
+                    os.remove(os.path.join(seg_dir, name))
+                except FileNotFoundError:
+                    pass
+        with self._described_lock:
+            for version in expired:
+                self._described.pop((tenant_id, segment_id, version), None)
+        if self._links:
+            self._collect_blobs(digests)
+
+    def _collect_blobs(self, digests):
+        """
+        Removes blobs no stored version links to any more (link count 1 = only the blob itself).
+        Candidates wait out the grace period and are checked again on a later prune.
+        """
+        now = time.time()
+        for sha256 in digests:
+            self._unreferenced.setdefault(sha256, now)
+        for sha256, since in list(self._unreferenced.items()):
+            if now - since <= BLOB_GC_GRACE_SECONDS:
+                continue
+            del self._unreferenced[sha256]
+            blob = self._blob_path(sha256)
+            try:
+                st = os.stat(blob)
+                if st.st_nlink > 1:
+                    continue  # linked again by a newer version
+                if now - st.st_ctime > BLOB_GC_GRACE_SECONDS:
+                    os.remove(blob)
+                else:
+                    self._unreferenced[sha256] = now
+            except FileNotFoundError:
+                pass
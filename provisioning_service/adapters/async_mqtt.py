@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Union
+import paho.mqtt.client as mqtt
+from pydantic import BaseModel
+from ..core.config import settings
+from ..core.wire import ENCODING_JSON, ENCODING_COMPACT, encode_message, segment_topic
+from .mqtt_publisher import record_publish
+from provisioning_service.core.logger import get_logger
+
+logger = get_logger("AsyncMqtt")
+
+# paho's connect (DNS + TCP handshake) blocks - it runs here, so the loop and other connects go on.
+# Threads start on demand; the cap bounds how many connections can be opening at once.
+CONNECT_THREADS = 64
+_connect_pool: Optional[ThreadPoolExecutor] = None
+
+def _connect_executor() -> ThreadPoolExecutor:
+    global _connect_pool
+    if _connect_pool is None:
+        _connect_pool = ThreadPoolExecutor(max_workers=CONNECT_THREADS, thread_name_prefix="mqtt-connect")
+    return _connect_pool
+
+class AsyncMqttClient:
+    """
+    Drives a paho client from the asyncio event loop (no network thread):
+    socket readiness is wired to loop readers/writers and QoS 1 publishes
+    return once the broker's PUBACK arrives.
+    """
+    MISC_INTERVAL = 1.0
+    RECONNECT_DELAY = 2.0
+
+    def __init__(self, client_id: str, clean_session: bool = True, will: Optional[dict] = None):
+        self.loop = asyncio.get_running_loop()
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id, clean_session=clean_session)
+        if will:
+            self.client.will_set(**will)
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
+        self.client.on_message = self._on_message
+
+        # Optional hooks: on_connect(client, session_present), on_message(client, msg)
+        self.on_connect = None
+        self.on_message = None
+
+        self._loop_thread = threading.get_ident()
+        self._connecting = False
+        self._pending_acks: Dict[int, asyncio.Future] = {}
+        self._connected = asyncio.Event()
+        self._misc_task = None
+        self._closing = False
+
+    async def connect(self, host: str, port: int, keepalive: int = 60):
+        await self._open(self.client.connect, host, port, keepalive)
+        self._misc_task = self.loop.create_task(self._misc_loop())
+        await self._connected.wait()
+
+    async def publish(self, topic: str, payload, qos: int = 1):
+        info = self.client.publish(topic, payload, qos=qos)
+        if qos == 0 or info.is_published():
+            return
+        future = self.loop.create_future()
+        self._pending_acks[info.mid] = future
+        try:
+            await future
+        finally:
+            self._pending_acks.pop(info.mid, None)
+
+    def subscribe(self, topic: str, qos: int = 1):
+        self.client.subscribe(topic, qos=qos)
+
+    def unsubscribe(self, topic: str):
+        self.client.unsubscribe(topic)
+
+    async def disconnect(self):
+        self._closing = True
+        self.client.disconnect()
+        if self._misc_task:
+            self._misc_task.cancel()
+
+    async def _open(self, connect, *args):
+        """Runs paho's blocking (re)connect on the connect pool."""
+        self._connecting = True
+        try:
+            await self.loop.run_in_executor(_connect_executor(), connect, *args)
+        finally:
+            self._connecting = False
+
+    # --- paho callbacks (run on the event loop thread, except socket ones during _open) ---
+    def _on_loop(self, fn, sock, *args):
+        if threading.get_ident() == self._loop_thread:
+            fn(sock, *args)
+        else:
+            self.loop.call_soon_threadsafe(fn, sock.fileno(), *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._on_loop(self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_reader, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._on_loop(self.loop.remove_writer, sock)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        self._connected.set()
+        if self.on_connect:
+            self.on_connect(self, flags.session_present)
+
+    def _on_disconnect(self, client, userdata, flags, reason_code, properties):
+        self._connected.clear()
+        if not self._closing:
+            logger.warning(f"Disconnected ({reason_code}), reconnecting...")
+            self.loop.create_task(self._reconnect())
+
+    def _on_message(self, client, userdata, msg):
+        if self.on_message:
+            self.on_message(self, msg)
+
+    def _on_publish(self, client, userdata, mid, reason_code, properties):
+        future = self._pending_acks.pop(mid, None)
+        if future and not future.done():
+            future.set_result(None)
+
+    async def _misc_loop(self):
+        while not self._closing:
+            if not self._connecting:  # paho's state is being set up on the connect pool
+                self.client.loop_misc()
+            await asyncio.sleep(self.MISC_INTERVAL)
+
+    async def _reconnect(self):
+        while not self._closing:
+            await asyncio.sleep(self.RECONNECT_DELAY)
+            try:
+                await self._open(self.client.reconnect)
+                return
+            except OSError as e:
+                logger.warning(f"Reconnect failed: {e}")
+
+class AsyncMqttPublisher:
+    """
+    Same interface as MqttPublisher, but each send completes on PUBACK.
+    At most MQTT_MAX_INFLIGHT publishes await their PUBACK at once; further sends wait.
+    """
+    def __init__(self, client: AsyncMqttClient):
+        self.client = client
+        self.client.client.max_inflight_messages_set(settings.MQTT_MAX_INFLIGHT)
+        self._window = asyncio.Semaphore(settings.MQTT_MAX_INFLIGHT)
+
+    async def send_private_response(self, agent_id: str, tenant_id: str, payload: Union[dict, BaseModel], encoding: str = ENCODING_JSON):
+        topic = f"sase/{tenant_id}/node/{agent_id}"
+        await self._publish(topic, encode_message(payload, encoding), "private", encoding)
+        logger.info(f"Sent Private Response to {topic}")
+
+    async def broadcast_update(self, tenant_id: str, segment_id: str, payload: dict):
+        topic = segment_topic(tenant_id, segment_id)
+        sends = [self._publish(topic, encode_message(payload), "broadcast", ENCODING_JSON)]
+        if settings.WIRE_COMPACT_ENABLED:
+            sends.append(self._publish(
+                segment_topic(tenant_id, segment_id, ENCODING_COMPACT),
+                encode_message(payload, ENCODING_COMPACT), "broadcast", ENCODING_COMPACT
+            ))
+        await asyncio.gather(*sends)
+        logger.info(f"Broadcasted Update to {topic}")
+
+    async def _publish(self, topic: str, data: bytes, kind: str, encoding: str):
+        # Measured up to PUBACK
+        started = time.perf_counter()
+        async with self._window:
+            await asyncio.wait_for(self.client.publish(topic, data, qos=1), settings.MQTT_PUBLISH_TIMEOUT_SECONDS)
+        record_publish(kind, encoding, data, started)
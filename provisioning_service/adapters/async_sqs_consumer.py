@@ -0,0 +1,275 @@
+import asyncio
+import boto3
+import json
+import time
+from contextlib import nullcontext
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Optional
+from ..core.config import settings
+from provisioning_service.core.logger import get_logger
+from .sqs_consumer import (
+    envelope_fields, held_ack, visibility_heartbeat, SQS_MAX_BATCH, ACK_FLUSH_INTERVAL, TENANT_LATENCY,
+    ACK_DELETE, ACK_RETRY, ACK_RELEASE,
+    RECEIVE_LATENCY, RECEIVED, INFLIGHT, DISPATCH_WAIT, HANDLE_LATENCY, ACK_LATENCY, ACKED
+)
+from .tenant_scheduler import AsyncFairGate, tenant_label
+
+logger = get_logger("AsyncSQSConsumer")
+
+class AsyncSQSConsumer:
+    """
+    asyncio consumer: several long-pollers keep up to ASYNC_MAX_IN_FLIGHT messages in
+    flight as tasks, messages sharing an ordering key run one after another, and acks
+    go out in batches. boto3 has no asyncio API, so its calls run on a thread pool.
+    With TENANT_FAIR_SCHEDULING at most ASYNC_MAX_RUNNING handlers run at once, admitted
+    per tenant by weighted deficit round robin (AsyncFairGate); TENANT_MAX_CONCURRENCY
+    caps the handlers running for one tenant at once.
+    `decode`, visibility extension, stop() / draining and the metrics work as in SQSConsumer.
+    """
+    def __init__(self, sqs_client=None, decode: Optional[Callable[[str], object]] = None):
+        self.sqs = sqs_client or boto3.client(
+            'sqs',
+            endpoint_url=settings.SQS_ENDPOINT_URL,
+            region_name=settings.AWS_REGION
+        )
+        self.queue_url = settings.SQS_QUEUE_URL
+        self.decode = decode or json.loads
+        self.max_in_flight = max(settings.ASYNC_MAX_IN_FLIGHT, 1)
+        # Long polls hold a thread each for up to SQS_WAIT_TIME_SECONDS - acks get their own
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.SQS_ASYNC_POLLERS + max(settings.ASYNC_BLOCKING_THREADS, 1),
+            thread_name_prefix="sqs-io"
+        )
+        self._inflight = 0
+        self._capacity = None
+        self._completions = None
+        self._tails: Dict[str, asyncio.Task] = {}
+        self._tenant_slots: Dict[str, asyncio.Semaphore] = {}
+        self._gate: Optional[AsyncFairGate] = None
+        if settings.TENANT_FAIR_SCHEDULING:
+            self._gate = AsyncFairGate(
+                settings.ASYNC_MAX_RUNNING, settings.TENANT_WEIGHTS, settings.TENANT_MAX_CONCURRENCY
+            )
+        self._ack_tasks = set()
+        self.visibility = visibility_heartbeat(self.sqs, self.queue_url)
+        self._stopping = False
+
+    async def _call(self, fn, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, partial(fn, **kwargs))
+
+    def stop(self):
+        """Stops polling; start_listening then drains and returns. Call it on the consumer's loop."""
+        if not self._stopping:
+            logger.info("Stop requested - finishing in-flight messages")
+        self._stopping = True
+        self._spawn(self._wake_pollers())
+
+    async def _wake_pollers(self):
+        async with self._capacity:
+            self._capacity.notify_all()
+
+    async def start_listening(self, callback):
+        """`callback` is a coroutine function taking the decoded message body."""
+        self._capacity = asyncio.Condition()
+        self._completions = asyncio.Queue()
+        logger.info(f"Listening for SQS messages (asyncio: in-flight={self.max_in_flight}, "
+                    f"fair={settings.TENANT_FAIR_SCHEDULING})...")
+        ack_task = asyncio.create_task(self._ack_loop())
+        self.visibility.start()
+        pollers = [asyncio.create_task(self._poll_loop(callback)) for _ in range(settings.SQS_ASYNC_POLLERS)]
+        try:
+            await asyncio.gather(*pollers)
+            await self._drain()
+        finally:
+            ack_task.cancel()
+            await asyncio.to_thread(self.visibility.stop)
+
+    async def _drain(self):
+        """Waits (up to SQS_DRAIN_TIMEOUT_SECONDS) until every received message is acknowledged or released."""
+        logger.info(f"Draining {self._inflight} in-flight messages...")
+        try:
+            async with self._capacity:
+                await asyncio.wait_for(self._capacity.wait_for(lambda: self._inflight <= 0),
+                                       settings.SQS_DRAIN_TIMEOUT_SECONDS)
+            logger.info("Drained - stopped listening")
+        except asyncio.TimeoutError:
+            logger.warning(f"Drain timed out with {self._inflight} messages still being handled - "
+                           f"they are redelivered once their visibility timeout expires")
+
+    async def _poll_loop(self, callback):
+        while not self._stopping:
+            # 1. Reserve capacity
+            async with self._capacity:
+                await self._capacity.wait_for(lambda: self._stopping or self._inflight < self.max_in_flight)
+                if self._stopping:
+                    break
+                max_messages = min(SQS_MAX_BATCH, self.max_in_flight - self._inflight)
+                self._inflight += max_messages
+
+            # 2. Poll
+            try:
+                with RECEIVE_LATENCY.time():
+                    response = await self._call(
+                        self.sqs.receive_message,
+                        QueueUrl=self.queue_url,
+                        MaxNumberOfMessages=max_messages,
+                        WaitTimeSeconds=settings.SQS_WAIT_TIME_SECONDS,
+                        VisibilityTimeout=settings.SQS_VISIBILITY_TIMEOUT
+                    )
+                messages = response.get('Messages', [])
+            except Exception as e:
+                logger.error(f"Receive Error: {e}")
+                messages = []
+                await asyncio.sleep(1)
+
+            # Give back the slots that were not filled
+            await self._release(max_messages - len(messages))
+            INFLIGHT.inc(len(messages))
+            self.visibility.track([msg['ReceiptHandle'] for msg in messages])
+            if self._stopping:
+                # Stopped during the long poll - hand these straight back
+                for msg in messages:
+                    self._completions.put_nowait((msg['ReceiptHandle'], ACK_RELEASE))
+                break
+
+            # 3. Dispatch (per-key ordering)
+            received_at = time.perf_counter()
+            for msg in messages:
+                try:
+                    body = self.decode(msg['Body'])
+                except Exception as e:
+                    logger.error(f"Error: Malformed message body - {e}")
+                    RECEIVED.inc(type="malformed")
+                    self._completions.put_nowait((msg['ReceiptHandle'], ACK_RETRY))
+                    continue
+                if body is None:
+                    RECEIVED.inc(type="invalid")
+                    self._completions.put_nowait((msg['ReceiptHandle'], ACK_DELETE))
+                    continue
+                kind, tenant_id, key = envelope_fields(body)
+                RECEIVED.inc(type=kind)
+                key = f"{tenant_id}/{key}"
+                previous = self._tails.get(key)
+                task = asyncio.create_task(self._handle(callback, msg, body, previous, received_at))
+                self._tails[key] = task
+                task.add_done_callback(partial(self._forget_tail, key))
+
+    def _forget_tail(self, key: str, task: asyncio.Task):
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    def _tenant_slot(self, tenant: str):
+        if self._gate is not None:
+            return self._gate.slot(tenant)
+        if not settings.TENANT_MAX_CONCURRENCY:
+            return nullcontext()
+        slot = self._tenant_slots.get(tenant)
+        if slot is None:
+            slot = self._tenant_slots[tenant] = asyncio.Semaphore(settings.TENANT_MAX_CONCURRENCY)
+        return slot
+
+    async def _handle(self, callback, msg: dict, body, previous, received_at: float):
+        if previous is not None:
+            await asyncio.wait([previous])
+        kind, tenant_id, _ = envelope_fields(body)
+        ok = True
+        start = result = None
+        try:
+            async with self._tenant_slot(str(tenant_id)):
+                if self._stopping:
+                    # Not started before the stop - another worker can have it right away
+                    self._completions.put_nowait((msg['ReceiptHandle'], ACK_RELEASE))
+                    return
+                start = time.perf_counter()
+                DISPATCH_WAIT.observe(start - received_at, type=kind)
+                result = await callback(body)
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            ok = False
+        now = time.perf_counter()
+        if start is not None:
+            HANDLE_LATENCY.observe(now - start, type=kind, outcome="ok" if ok else "error")
+        if ok:
+            TENANT_LATENCY.observe(now - received_at, tenant=tenant_label(tenant_id), type=kind)
+        if isinstance(result, Future):
+            # Held until the handed-off work is done - not awaited, so later messages for this key can join it
+            loop = asyncio.get_running_loop()
+            result.add_done_callback(lambda future: loop.call_soon_threadsafe(
+                self._completions.put_nowait, (msg['ReceiptHandle'], held_ack(future))
+            ))
+            return
+        self._completions.put_nowait((msg['ReceiptHandle'], ACK_DELETE if ok else ACK_RETRY))
+
+    async def _ack_loop(self):
+        pending = {ACK_DELETE: [], ACK_RETRY: [], ACK_RELEASE: []}
+        deadline = time.monotonic() + ACK_FLUSH_INTERVAL
+        while True:
+            try:
+                handle, action = await asyncio.wait_for(
+                    self._completions.get(), timeout=max(deadline - time.monotonic(), 0.001)
+                )
+                pending[action].append(handle)
+            except asyncio.TimeoutError:
+                pass
+
+            now = time.monotonic()
+            for action, handles in pending.items():
+                if len(handles) >= SQS_MAX_BATCH or (handles and now >= deadline):
+                    batch = handles[:SQS_MAX_BATCH]
+                    del handles[:SQS_MAX_BATCH]
+                    if action == ACK_DELETE:
+                        self._spawn(self._delete_batch(batch))
+                    elif action == ACK_RETRY:
+                        self._spawn(self._visibility_batch(batch, settings.SQS_FAILURE_VISIBILITY_TIMEOUT, "retry", "retried"))
+                    else:
+                        self._spawn(self._visibility_batch(batch, 0, "release", "released"))
+            if now >= deadline:
+                deadline = now + ACK_FLUSH_INTERVAL
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._ack_tasks.add(task)
+        task.add_done_callback(self._ack_tasks.discard)
+
+    async def _delete_batch(self, handles):
+        self.visibility.untrack(handles)
+        entries = [{"Id": str(i), "ReceiptHandle": h} for i, h in enumerate(handles)]
+        failures = len(handles)
+        try:
+            with ACK_LATENCY.time(op="delete_batch"):
+                response = await self._call(self.sqs.delete_message_batch, QueueUrl=self.queue_url, Entries=entries)
+            failures = len(response.get('Failed', []))
+            for failed in response.get('Failed', []):
+                logger.error(f"Delete Failed: {failed.get('Code')} - {failed.get('Message')}")
+        except Exception as e:
+            logger.error(f"Delete Batch Error: {e}")
+        ACKED.inc(len(handles) - failures, result="deleted")
+        ACKED.inc(failures, result="failed")
+        INFLIGHT.dec(len(handles))
+        await self._release(len(handles))
+
+    async def _visibility_batch(self, handles, visibility_timeout: int, op: str, result: str):
+        # settle waits out an extension in flight (a thread lock) - keep it off the loop
+        await self._call(self.visibility.untrack, handles=handles, settle=True)
+        entries = [
+            {"Id": str(i), "ReceiptHandle": h, "VisibilityTimeout": visibility_timeout}
+            for i, h in enumerate(handles)
+        ]
+        try:
+            with ACK_LATENCY.time(op=f"{op}_batch"):
+                response = await self._call(self.sqs.change_message_visibility_batch, QueueUrl=self.queue_url, Entries=entries)
+            for failed in response.get('Failed', []):
+                logger.error(f"Visibility Change Failed: {failed.get('Code')} - {failed.get('Message')}")
+        except Exception as e:
+            logger.error(f"Visibility Batch Error: {e}")
+        ACKED.inc(len(handles), result=result)
+        INFLIGHT.dec(len(handles))
+        await self._release(len(handles))
+
+    async def _release(self, count: int):
+        if count <= 0:
+            return
+        async with self._capacity:
+            self._inflight -= count
+            self._capacity.notify_all()
@@ -0,0 +1,33 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ..core.config import settings
+from ..core.metrics import registry
+from provisioning_service.core.logger import get_logger
+
+logger = get_logger("MetricsServer")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Serves the process-wide registry at /metrics (Prometheus text format)."""
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def start_metrics_server(port: int = None) -> ThreadingHTTPServer:
+    port = port or settings.METRICS_PORT
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on :{port}/metrics")
+    return server
@@ -1,25 +1,154 @@
+import threading
+import time
+import zlib
+from typing import List, Union
 import paho.mqtt.client as mqtt
-import json
+from pydantic import BaseModel
 from ..core.config import settings
+from ..core.metrics import registry
+from ..core.wire import ENCODING_JSON, ENCODING_COMPACT, encode_message, segment_topic
 from provisioning_service.core.logger import get_logger
 
 logger = get_logger("MqttPublisher")
 
+# kind: "private" (per-agent topic) or "broadcast" (segment topic)
+PUBLISH_LATENCY = registry.histogram("mqtt_publish_seconds", "Time to publish (up to PUBACK when confirming)", ["kind"])
+PUBLISHED = registry.counter("mqtt_published_total", "Messages published", ["kind", "encoding"])
+PUBLISHED_BYTES = registry.counter("mqtt_published_bytes_total", "Encoded payload bytes published", ["kind"])
+WINDOW_WAIT = registry.histogram("mqtt_publish_window_wait_seconds", "Time blocked on a full in-flight window")
+PENDING_ACKS = registry.gauge("mqtt_publish_pending_acks", "QoS 1 publishes awaiting PUBACK")
+PUBLISH_FAILED = registry.counter("mqtt_publish_failed_total", "Publishes not acknowledged", ["reason"])
+
+def record_publish(kind: str, encoding: str, data: bytes, started: float):
+    PUBLISH_LATENCY.observe(time.perf_counter() - started, kind=kind)
+    PUBLISHED.inc(kind=kind, encoding=encoding)
+    PUBLISHED_BYTES.inc(len(data), kind=kind)
+
+OPEN_RC = (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_AGAIN)
+
+class PublishError(RuntimeError):
+    """A publish was not acknowledged in time - the handler fails and SQS redelivers."""
+
+class PublishWindow:
+    """
+    One broker connection plus its window of unacknowledged QoS 1 publishes.
+    publish() blocks while `size` messages are awaiting PUBACK, so a slow broker
+    slows the caller down instead of growing paho's outbound queue.
+    """
+    def __init__(self, client, size: int):
+        self.client = client
+        self.size = max(size, 1)
+        self._pending: List = []  # MQTTMessageInfo not yet acknowledged
+        self._reserved = 0
+        self._cond = threading.Condition()
+        if hasattr(client, "max_inflight_messages_set"):
+            client.max_inflight_messages_set(self.size)
+        client.on_publish = self._on_publish
+
+    def publish(self, topic: str, data: bytes, timeout: float):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._outstanding() >= self.size:
+                start = time.perf_counter()
+                while self._outstanding() >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        PUBLISH_FAILED.inc(reason="window_timeout")
+                        raise PublishError(f"In-flight window full for {timeout}s")
+                    self._cond.wait(remaining)
+                WINDOW_WAIT.observe(time.perf_counter() - start)
+            self._reserved += 1
+
+        # Outside the lock: paho may deliver PUBACKs (-> _on_publish) while we publish
+        info = None
+        try:
+            info = self.client.publish(topic, data, qos=1)
+        finally:
+            with self._cond:
+                self._reserved -= 1
+                if info is not None:
+                    self._pending.append(info)
+                    PENDING_ACKS.inc()
+        return info
+
+    def _outstanding(self) -> int:
+        # Caller holds the lock. Failed publishes (rc != 0, e.g. disconnected) free their slot too -
+        # paho re-sends them after a reconnect, but a confirming caller has already given up on them.
+        if self._pending:
+            before = len(self._pending)
+            self._pending = [i for i in self._pending if i.rc in OPEN_RC and not i.is_published()]
+            if before != len(self._pending):
+                PENDING_ACKS.dec(before - len(self._pending))
+        return len(self._pending) + self._reserved
+
+    def _on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        with self._cond:
+            self._outstanding()
+            self._cond.notify_all()
+
 class MqttPublisher:
-    def __init__(self):
-        # Initialize the client
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, "backend-worker")
-        self.client.connect(settings.MQTT_HOST, settings.MQTT_PORT)
-        self.client.loop_start()
-
-    def send_private_response(self, agent_id: str, tenant_id: str, payload: dict):
-        """Sends a message to a specific agent's private topic."""
+    def __init__(self, client_id: str = "backend-worker", client=None):
+        self.confirm = settings.MQTT_PUBLISH_CONFIRM
+        self.timeout = settings.MQTT_PUBLISH_TIMEOUT_SECONDS
+        if client is not None:
+            # Pre-built client (e.g. the recording client in benchmarks/)
+            self.client = client
+            self._windows = [PublishWindow(client, settings.MQTT_MAX_INFLIGHT)]
+            return
+
+        # One or more broker connections (client IDs must be unique per broker connection).
+        # A topic always maps to the same connection, which keeps its messages in order.
+        pool_size = max(settings.MQTT_CONNECTION_POOL_SIZE, 1)
+        self._windows = []
+        for i in range(pool_size):
+            client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id if pool_size == 1 else f"{client_id}-{i}")
+            window = PublishWindow(client, settings.MQTT_MAX_INFLIGHT)
+            client.connect(settings.MQTT_HOST, settings.MQTT_PORT)
+            client.loop_start()
+            self._windows.append(window)
+        self.client = self._windows[0].client
+
+    def send_private_response(self, agent_id: str, tenant_id: str, payload: Union[dict, BaseModel], encoding: str = ENCODING_JSON):
+        """Sends a message to a specific agent's private topic (in the agent's negotiated encoding)."""
         topic = f"sase/{tenant_id}/node/{agent_id}"
-        self.client.publish(topic, json.dumps(payload), qos=1)
+        started = time.perf_counter()
+        data = encode_message(payload, encoding)
+        self._confirm([self._publish(topic, data)])
+        record_publish("private", encoding, data, started)
         logger.info(f"Sent Private Response to {topic}")
 
     def broadcast_update(self, tenant_id: str, segment_id: str, payload: dict):
         """Broadcasts a message to all agents listening on a segment topic."""
-        topic = f"sase/{tenant_id}/segment/{segment_id}"
-        self.client.publish(topic, json.dumps(payload), qos=1)
-        logger.info(f"Broadcasted Update to {topic}")
\ No newline at end of file
+        topic = segment_topic(tenant_id, segment_id)
+        started = time.perf_counter()
+        sends = [(ENCODING_JSON, topic, encode_message(payload))]
+        if settings.WIRE_COMPACT_ENABLED:
+            # Agents that negotiated the compact encoding listen on a sibling topic
+            sends.append((ENCODING_COMPACT, segment_topic(tenant_id, segment_id, ENCODING_COMPACT),
+                          encode_message(payload, ENCODING_COMPACT)))
+        # Both publishes go out before waiting, so their round trips overlap
+        self._confirm([self._publish(t, data) for _, t, data in sends])
+        for encoding, _, data in sends:
+            record_publish("broadcast", encoding, data, started)
+        logger.info(f"Broadcasted Update to {topic}")
+
+    def _publish(self, topic: str, data: bytes):
+        window = self._windows[0]
+        if len(self._windows) > 1:
+            window = self._windows[zlib.crc32(topic.encode()) % len(self._windows)]
+        return window.publish(topic, data, self.timeout)
+
+    def _confirm(self, infos):
+        """Blocks until every publish was acknowledged (MQTT_PUBLISH_CONFIRM), so callers
+        - and the SQS delete that follows them - never run ahead of the broker."""
+        if not self.confirm:
+            return
+        for info in infos:
+            try:
+                info.wait_for_publish(self.timeout)
+            except (ValueError, RuntimeError) as e:
+                PUBLISH_FAILED.inc(reason="error")
+                raise PublishError(f"Publish failed: {e}") from e
+            if not info.is_published():
+                PUBLISH_FAILED.inc(reason="ack_timeout")
+                raise PublishError(f"No PUBACK within {self.timeout}s")
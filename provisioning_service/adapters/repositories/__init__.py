@@ -1,7 +1,19 @@
 from .agent_repo import AgentRepository
 from .rule_repo import RuleRepository
 from .segment_repo import SegmentStateRepository
+from .dedup_repo import RequestDedupRepository, request_key
+from .async_repos import (
+    AsyncAgentRepository, AsyncRuleRepository, AsyncSegmentStateRepository, AsyncRequestDedupRepository
+)
+from .indexes import (
+    QueryPlanError, ensure_indexes, verify_query_plans, ensure_indexes_async, verify_query_plans_async
+)
 
 # This defines what is available when someone types:
 # from provisioning_service.adapters.repositories import ...
-__all__ = ["AgentRepository", "RuleRepository", "SegmentStateRepository"]
\ No newline at end of file
+__all__ = [
+    "AgentRepository", "RuleRepository", "SegmentStateRepository",
+    "AsyncAgentRepository", "AsyncRuleRepository", "AsyncSegmentStateRepository",
+    "RequestDedupRepository", "AsyncRequestDedupRepository", "request_key",
+    "QueryPlanError", "ensure_indexes", "verify_query_plans", "ensure_indexes_async", "verify_query_plans_async"
+]
\ No newline at end of file
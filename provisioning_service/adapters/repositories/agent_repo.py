@@ -1,19 +1,179 @@
-from typing import Optional
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from ...core.config import settings
 from ...core.entities import AgentStateEntity
+from ...core.metrics import registry
 from .base import BaseRepository
 
+BATCH_SIZE = registry.histogram(
+    "agent_write_batch_size", "Agent upserts per bulk_write flush",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+)
+FLUSH_LATENCY = registry.histogram("agent_write_flush_seconds", "Duration of agent bulk_write flushes")
+PENDING = registry.gauge("agent_write_pending", "Agent upserts waiting for the next flush")
+
+ASSIGNMENT_FIELDS = {
+    "_id": 0, "agent_id": 1, "tenant_id": 1, "groups": 1, "location": 1, "encoding": 1, "assigned_segments": 1
+}
+
+def assignment_update(agent: dict, segments: List[str]) -> UpdateOne:
+    """
+    Conditional on the inputs the new segments were computed from: an agent that
+    re-bootstrapped (new groups, location or assignment) since is left alone.
+    """
+    return UpdateOne(
+        {"tenant_id": agent["tenant_id"], "agent_id": agent["agent_id"], "groups": agent.get("groups"), "location": agent.get("location"),
+         "assigned_segments": agent.get("assigned_segments")},
+        {"$set": {"assigned_segments": segments}}
+    )
+
+class AgentWriteBatcher:
+    """
+    Accumulates agent upserts from concurrent callers and flushes them as one
+    unordered bulk_write once AGENT_WRITE_BATCH_SIZE is reached or the oldest
+    pending write is AGENT_WRITE_BATCH_DELAY_MS old. Each caller gets a Future
+    that resolves once the batch holding its write is durable.
+    """
+    def __init__(self, collection, max_batch: int, max_delay: float):
+        self.collection = collection
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        # agent_id -> (latest $set document, futures waiting on it)
+        self._pending: Dict[str, Tuple[dict, List[Future]]] = {}
+        self._oldest: Optional[float] = None
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="agent-write-batcher", daemon=True).start()
+
+    def submit(self, agent: AgentStateEntity) -> Future:
+        future = Future()
+        data = agent.model_dump(exclude={"id"})
+        key = (agent.tenant_id, agent.agent_id)
+        with self._cond:
+            entry = self._pending.get(key)
+            if entry:
+                # Same agent twice in one window - the last write wins
+                entry[1].append(future)
+                self._pending[key] = (data, entry[1])
+            else:
+                self._pending[key] = (data, [future])
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            PENDING.set(len(self._pending))
+            if len(self._pending) >= self.max_batch or len(self._pending) == 1:
+                self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                while len(self._pending) < self.max_batch:
+                    remaining = self._oldest + self.max_delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if len(self._pending) <= self.max_batch:
+                    batch, self._pending, self._oldest = self._pending, {}, None
+                else:
+                    # Leftovers go out in the next flush right away
+                    keys = list(self._pending)[:self.max_batch]
+                    batch = {key: self._pending.pop(key) for key in keys}
+                PENDING.set(len(self._pending))
+            self._flush(batch)
+
+    def _flush(self, batch: Dict[Tuple[str, str], Tuple[dict, List[Future]]]):
+        keys = list(batch)
+        ops = [UpdateOne({"tenant_id": tenant, "agent_id": aid}, {"$set": batch[(tenant, aid)][0]}, upsert=True)
+               for tenant, aid in keys]
+        failed = {}
+        start = time.perf_counter()
+        try:
+            self.collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                failed[keys[err["index"]]] = Exception(err.get("errmsg", "bulk write error"))
+        except Exception as e:
+            failed = {key: e for key in keys}
+        FLUSH_LATENCY.observe(time.perf_counter() - start)
+        BATCH_SIZE.observe(len(ops))
+
+        for key, (_, futures) in batch.items():
+            for future in futures:
+                if key in failed:
+                    future.set_exception(failed[key])
+                else:
+                    future.set_result(None)
+
 class AgentRepository(BaseRepository):
     def __init__(self, db):
         super().__init__(db, "agents_state")
+        self._batcher = None
+        if settings.AGENT_WRITE_BATCHING:
+            self._batcher = AgentWriteBatcher(
+                self.collection,
+                settings.AGENT_WRITE_BATCH_SIZE,
+                settings.AGENT_WRITE_BATCH_DELAY_MS / 1000
+            )
 
     def upsert_agent(self, agent: AgentStateEntity):
+        """Blocks until the write is durable (batched or not)."""
+        if self._batcher:
+            self._batcher.submit(agent).result()
+            return
         data = agent.model_dump(exclude={"id"})
-        self.collection.update_one(
-            {"agent_id": agent.agent_id},
-            {"$set": data},
-            upsert=True
-        )
-
-    def get_agent(self, agent_id: str) -> Optional[AgentStateEntity]:
-        doc = self.collection.find_one({"agent_id": agent_id})
-        return AgentStateEntity(**doc) if doc else None
\ No newline at end of file
+        with self._timed("update_one"):
+            self.collection.update_one(
+                {"tenant_id": agent.tenant_id, "agent_id": agent.agent_id},
+                {"$set": data},
+                upsert=True
+            )
+
+    def submit_upsert(self, agent: AgentStateEntity) -> Future:
+        """Non-blocking variant: the Future resolves once the write is durable."""
+        if self._batcher:
+            return self._batcher.submit(agent)
+        future = Future()
+        try:
+            self.upsert_agent(agent)
+            future.set_result(None)
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def get_agent(self, tenant_id: str, agent_id: str) -> Optional[AgentStateEntity]:
+        with self._timed("find_one"):
+            doc = self.collection.find_one({"tenant_id": tenant_id, "agent_id": agent_id})
+        return AgentStateEntity.model_validate(doc) if doc else None
+
+    # --- Bulk re-evaluation ---
+    def find_assignment_inputs(self):
+        """Streams the fields the policy engine needs for every stored agent."""
+        return self.collection.find({}, ASSIGNMENT_FIELDS)
+
+    def update_assignments(self, changes: List[Tuple[dict, List[str]]]):
+        """
+        (agent doc from find_assignment_inputs, new segments) pairs, written as
+        conditional updates in unordered bulk writes of AGENT_WRITE_BATCH_SIZE.
+        """
+        ops = [assignment_update(agent, segments) for agent, segments in changes]
+        for i in range(0, len(ops), settings.AGENT_WRITE_BATCH_SIZE):
+            with self._timed("bulk_write"):
+                self.collection.bulk_write(ops[i:i + settings.AGENT_WRITE_BATCH_SIZE], ordered=False)
+
+    # --- Presence ---
+    def update_presence(self, presence: Dict[Tuple[str, str], Tuple[float, str]]):
+        """
+        (tenant_id, agent_id) -> (last_seen, status), in unordered bulk writes of PRESENCE_FLUSH_BATCH_SIZE.
+        Never upserts (unknown agents are ignored) and $max keeps last_seen from moving back.
+        """
+        ops = [UpdateOne({"tenant_id": tenant, "agent_id": aid},
+                         {"$set": {"status": status}, "$max": {"last_seen": last_seen}})
+               for (tenant, aid), (last_seen, status) in presence.items()]
+        for i in range(0, len(ops), settings.PRESENCE_FLUSH_BATCH_SIZE):
+            with self._timed("bulk_write"):
+                self.collection.bulk_write(ops[i:i + settings.PRESENCE_FLUSH_BATCH_SIZE], ordered=False)
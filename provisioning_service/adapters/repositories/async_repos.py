@@ -0,0 +1,166 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from pymongo import ReturnDocument
+from ...core.config import settings
+from ...core.entities import AgentStateEntity
+from .base import BaseRepository
+from .change_watcher import AsyncChangeWatcher
+from .agent_repo import ASSIGNMENT_FIELDS, assignment_update
+from .rule_repo import RULE_FIELDS, RELOADS
+from ...core.policy_engine import CompiledPolicy
+from .segment_repo import CACHE_LOOKUPS, COUNTER_FIELDS, VERSION_FIELDS, VersionCache
+from .dedup_repo import LOOKUPS as DEDUP_LOOKUPS, ResponseCache, expiry_cutoff, stored_update
+
+# asyncio counterparts of the repositories, for an AsyncMongoClient database.
+# Method names match the synchronous repositories; the caches are shared types.
+
+class AsyncAgentRepository(BaseRepository):
+    def __init__(self, db):
+        super().__init__(db, "agents_state")
+
+    async def upsert_agent(self, agent: AgentStateEntity):
+        data = agent.model_dump(exclude={"id"})
+        with self._timed("update_one"):
+            await self.collection.update_one(
+                {"tenant_id": agent.tenant_id, "agent_id": agent.agent_id},
+                {"$set": data},
+                upsert=True
+            )
+
+    async def get_agent(self, tenant_id: str, agent_id: str) -> Optional[AgentStateEntity]:
+        with self._timed("find_one"):
+            doc = await self.collection.find_one({"tenant_id": tenant_id, "agent_id": agent_id})
+        return AgentStateEntity.model_validate(doc) if doc else None
+
+    async def find_assignment_inputs(self) -> List[dict]:
+        with self._timed("find"):
+            return await self.collection.find({}, ASSIGNMENT_FIELDS).to_list(None)
+
+    async def update_assignments(self, changes: List[Tuple[dict, List[str]]]):
+        ops = [assignment_update(agent, segments) for agent, segments in changes]
+        for i in range(0, len(ops), settings.AGENT_WRITE_BATCH_SIZE):
+            with self._timed("bulk_write"):
+                await self.collection.bulk_write(ops[i:i + settings.AGENT_WRITE_BATCH_SIZE], ordered=False)
+
+class AsyncRuleRepository(BaseRepository):
+    def __init__(self, db):
+        super().__init__(db, "segment_rules")
+        self._index: Optional[CompiledPolicy] = None
+        self._lock = asyncio.Lock()
+        self._watcher: Optional[AsyncChangeWatcher] = None
+        self._listeners: List[Callable[[CompiledPolicy, CompiledPolicy], None]] = []
+
+    async def get_segments_for_groups(self, tenant_id: str, groups: List[str], location: Optional[str] = None) -> List[str]:
+        return (await self._get_index()).evaluate(tenant_id, groups, location)
+
+    async def get_policy(self) -> CompiledPolicy:
+        return await self._get_index()
+
+    def add_listener(self, listener: Callable[[CompiledPolicy, CompiledPolicy], None]):
+        """`listener(old, new)` runs (on the event loop) after a reload that changed the rule set."""
+        self._listeners.append(listener)
+
+    async def get_all_target_segments(self) -> List[str]:
+        return list((await self._get_index()).segments)
+
+    async def _get_index(self) -> CompiledPolicy:
+        index = self._index
+        if index is None:
+            if self._watcher is None:
+                self._watcher = AsyncChangeWatcher(self.collection, lambda change: self.reload(), "segment_rules").start()
+            return await self.reload()
+        if not self._watcher.active and time.monotonic() - index.loaded_at > settings.RULE_CACHE_TTL_SECONDS:
+            return await self.reload(stale=index)
+        return index
+
+    async def reload(self, stale: Optional[CompiledPolicy] = None) -> CompiledPolicy:
+        async with self._lock:
+            if stale is not None and self._index is not stale:
+                return self._index
+            with self._timed("find"):
+                docs = await self.collection.find({}, RULE_FIELDS).to_list(None)
+            old, self._index = self._index, CompiledPolicy(docs)
+            new = self._index
+
+        changed = old is None or old.fingerprint != new.fingerprint
+        RELOADS.inc(changed=str(changed).lower())
+
+        if changed and old is not None:
+            for listener in self._listeners:
+                listener(old, new)
+        return new
+
+class AsyncSegmentStateRepository(BaseRepository):
+    def __init__(self, db):
+        super().__init__(db, "segments_state")
+        self._cache = VersionCache(settings.SEGMENT_VERSION_CACHE_MAX_ENTRIES)
+        self._watcher: Optional[AsyncChangeWatcher] = None
+
+    async def increment_version(self, tenant_id: str, segment_id: str) -> int:
+        with self._timed("find_one_and_update"):
+            doc = await self.collection.find_one_and_update(
+                {"tenant_id": tenant_id, "segment_id": segment_id},
+                {"$inc": {"version_counter": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                projection=COUNTER_FIELDS
+            )
+        self._cache.put(tenant_id, segment_id, doc["version_counter"])
+        return doc["version_counter"]
+
+    async def get_versions_map(self, tenant_id: str, segment_ids: List[str]) -> Dict[str, int]:
+        if self._watcher is None:
+            self._watcher = AsyncChangeWatcher(
+                self.collection, self._on_change, "segments_state", full_document="updateLookup"
+            ).start()
+        max_age = None if self._watcher.active else settings.SEGMENT_VERSION_CACHE_TTL_SECONDS
+        hits, misses = self._cache.get_many(tenant_id, segment_ids, max_age)
+        CACHE_LOOKUPS.inc(len(hits), result="hit")
+        CACHE_LOOKUPS.inc(len(misses), result="miss")
+        if misses:
+            with self._timed("find"):
+                cursor = self.collection.find({"tenant_id": tenant_id, "segment_id": {"$in": misses}}, VERSION_FIELDS)
+                fetched = {doc["segment_id"]: doc["version_counter"] async for doc in cursor}
+            for seg in misses:
+                self._cache.put(tenant_id, seg, fetched.get(seg))
+            hits.update(fetched)
+        return {seg: ver for seg, ver in hits.items() if ver is not None}
+
+    async def _on_change(self, change: Optional[dict]):
+        if change is None:
+            self._cache.clear()
+            return
+        doc = change.get("fullDocument")
+        if doc and "segment_id" in doc:
+            self._cache.put(doc.get("tenant_id"), doc["segment_id"], doc.get("version_counter"))
+        elif change.get("operationType") in ("delete", "drop", "invalidate"):
+            self._cache.clear()
+
+class AsyncRequestDedupRepository(BaseRepository):
+    def __init__(self, db):
+        super().__init__(db, "request_dedup")
+        self.ttl = settings.DEDUP_TTL_SECONDS
+        self.shared = settings.DEDUP_BACKEND == "mongo"
+        self._cache = ResponseCache(self.ttl, settings.DEDUP_MAX_ENTRIES)
+
+    async def get(self, key: str) -> Optional[dict]:
+        response = self._cache.get(key)
+        if response is not None:
+            DEDUP_LOOKUPS.inc(result="memory")
+            return response
+        if self.shared:
+            with self._timed("find_one"):
+                doc = await self.collection.find_one({"_id": key, "created_at": {"$gt": expiry_cutoff(self.ttl)}})
+            if doc is not None:
+                DEDUP_LOOKUPS.inc(result="mongo")
+                self._cache.put(key, doc["response"])
+                return doc["response"]
+        DEDUP_LOOKUPS.inc(result="miss")
+        return None
+
+    async def put(self, key: str, response: dict):
+        self._cache.put(key, response)
+        if self.shared:
+            with self._timed("update_one"):
+                await self.collection.update_one({"_id": key}, stored_update(response), upsert=True)
@@ -1,3 +1,12 @@
+from ...core.metrics import registry
+
+MONGO_LATENCY = registry.histogram("mongo_op_seconds", "Duration of MongoDB calls", ["collection", "op"])
+
 class BaseRepository:
     def __init__(self, db, collection_name: str):
-        self.collection = db[collection_name]
\ No newline at end of file
+        self.collection = db[collection_name]
+        self.collection_name = collection_name
+
+    def _timed(self, op: str):
+        """`with self._timed("find"):` - records the call in mongo_op_seconds."""
+        return MONGO_LATENCY.time(collection=self.collection_name, op=op)
@@ -0,0 +1,83 @@
+import asyncio
+import threading
+import time
+from pymongo.errors import OperationFailure, PyMongoError
+from provisioning_service.core.logger import get_logger
+
+logger = get_logger("ChangeWatcher")
+
+class ChangeWatcher:
+    """
+    Follows a collection's change stream on a background thread and calls
+    `on_change(change)` for every event. Once the stream is open `on_change(None)`
+    is called so the owner can (re)load its snapshot without missing events.
+
+    Change streams require a replica set. When they are unavailable `active` stays
+    False and owners are expected to fall back to TTL-based polling.
+    """
+    RETRY_DELAY = 30
+
+    def __init__(self, collection, on_change, name: str, **watch_kwargs):
+        self.collection = collection
+        self.watch_kwargs = watch_kwargs
+        self.on_change = on_change
+        self.name = name
+        self.active = False
+        self._thread = threading.Thread(target=self._run, name=f"watch-{name}", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                with self.collection.watch(**self.watch_kwargs) as stream:
+                    self.active = True
+                    logger.info(f"Change stream open for '{self.name}'")
+                    self.on_change(None)
+                    for change in stream:
+                        self.on_change(change)
+            except OperationFailure as e:
+                # Standalone mongod: change streams are not supported at all
+                self.active = False
+                logger.warning(f"Change streams unavailable for '{self.name}', using TTL polling ({e.code})")
+                return
+            except PyMongoError as e:
+                self.active = False
+                logger.warning(f"Change stream for '{self.name}' interrupted: {e}")
+            time.sleep(self.RETRY_DELAY)
+
+class AsyncChangeWatcher:
+    """asyncio counterpart of ChangeWatcher for AsyncMongoClient collections."""
+    RETRY_DELAY = 30
+
+    def __init__(self, collection, on_change, name: str, **watch_kwargs):
+        self.collection = collection
+        self.watch_kwargs = watch_kwargs
+        self.on_change = on_change
+        self.name = name
+        self.active = False
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    async def _run(self):
+        while True:
+            try:
+                async with await self.collection.watch(**self.watch_kwargs) as stream:
+                    self.active = True
+                    logger.info(f"Change stream open for '{self.name}'")
+                    await self.on_change(None)
+                    async for change in stream:
+                        await self.on_change(change)
+            except OperationFailure as e:
+                self.active = False
+                logger.warning(f"Change streams unavailable for '{self.name}', using TTL polling ({e.code})")
+                return
+            except PyMongoError as e:
+                self.active = False
+                logger.warning(f"Change stream for '{self.name}' interrupted: {e}")
+            await asyncio.sleep(self.RETRY_DELAY)
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from ...core.config import settings
+from ...core.metrics import registry
+from .base import BaseRepository
+
+# result: "memory" / "mongo" (a duplicate, answered from that tier) or "miss"
+LOOKUPS = registry.counter("request_dedup_lookups_total", "Request de-duplication lookups", ["result"])
+
+# Old agents send these for every request - they identify nothing and are never de-duplicated
+LEGACY_REQUEST_IDS = frozenset({"", "init", "resync"})
+
+def request_key(tenant_id: str, agent_id: str, request_id: Optional[str]) -> Optional[str]:
+    if not request_id or request_id in LEGACY_REQUEST_IDS:
+        return None
+    return f"{tenant_id}/{agent_id}/{request_id}"
+
+class ResponseCache:
+    """Bounded LRU of request key -> response document; entries expire `ttl` seconds after they were stored."""
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, response: dict):
+        with self._lock:
+            self._entries[key] = (response, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+class RequestDedupRepository(BaseRepository):
+    """
+    Responses of processed requests, so a redelivered or retried one is answered by replay.
+    The in-process cache is always consulted first; with DEDUP_BACKEND=mongo responses are
+    also stored in `request_dedup` (expired by a TTL index), so a duplicate picked up by
+    another worker process is caught too.
+    """
+    def __init__(self, db):
+        super().__init__(db, "request_dedup")
+        self.ttl = settings.DEDUP_TTL_SECONDS
+        self.shared = settings.DEDUP_BACKEND == "mongo"
+        self._cache = ResponseCache(self.ttl, settings.DEDUP_MAX_ENTRIES)
+
+    def get(self, key: str) -> Optional[dict]:
+        response = self._cache.get(key)
+        if response is not None:
+            LOOKUPS.inc(result="memory")
+            return response
+        if self.shared:
+            # The TTL monitor only runs every 60s - enforce the TTL on read as well
+            with self._timed("find_one"):
+                doc = self.collection.find_one({"_id": key, "created_at": {"$gt": expiry_cutoff(self.ttl)}})
+            if doc is not None:
+                LOOKUPS.inc(result="mongo")
+                self._cache.put(key, doc["response"])
+                return doc["response"]
+        LOOKUPS.inc(result="miss")
+        return None
+
+    def put(self, key: str, response: dict):
+        self._cache.put(key, response)
+        if self.shared:
+            with self._timed("update_one"):
+                self.collection.update_one({"_id": key}, stored_update(response), upsert=True)
+
+def expiry_cutoff(ttl: float) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=ttl)
+
+def stored_update(response: dict) -> dict:
+    return {"$set": {"response": response, "created_at": datetime.now(timezone.utc)}}
@@ -0,0 +1,161 @@
+from typing import Dict, List, NamedTuple
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from provisioning_service.core.config import settings
+from provisioning_service.core.logger import get_logger
+
+logger = get_logger("MongoIndexes")
+
+# Index set per collection. The unique indexes also close the upsert race: concurrent
+# upserts of one agent / segment can no longer insert two documents (the server retries
+# the losing upsert as an update). Agent and segment IDs are only unique within a tenant.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "agents_state": [
+        IndexModel([("tenant_id", ASCENDING), ("agent_id", ASCENDING)], name="tenant_agent_unique", unique=True),
+    ],
+    "segments_state": [
+        IndexModel([("tenant_id", ASCENDING), ("segment_id", ASCENDING)], name="tenant_segment_unique", unique=True),
+    ],
+    "segment_rules": [
+        # required_group first: serves group lookups with or without a tenant
+        IndexModel([("required_group", ASCENDING), ("tenant_id", ASCENDING)], name="group_tenant"),
+        IndexModel([("target_segment", ASCENDING)], name="target_segment"),
+    ],
+    "request_dedup": [
+        # Lookups go by _id; this one only lets the server expire old responses
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl",
+                   expireAfterSeconds=int(settings.DEDUP_TTL_SECONDS)),
+    ],
+}
+
+# Superseded indexes, dropped once their replacement exists: a unique index on the bare
+# ID would keep two tenants from using the same agent / segment ID.
+LEGACY_INDEXES: Dict[str, List[str]] = {
+    "agents_state": ["agent_id_unique"],
+    "segments_state": ["segment_id_unique"],
+}
+
+# Segment state written before it was tenant-scoped belongs to the default tenant
+# (the one the bridge assigns to agents that name none).
+UNSCOPED = {"tenant_id": {"$exists": False}}
+
+class HotQuery(NamedTuple):
+    name: str
+    collection: str
+    command: dict  # explainable command, as the repository issues it
+
+# Every filtered query the repositories issue on the request path. Whole-collection reads
+# (rule set reload, bulk re-evaluation) are scans by design and not listed.
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery("AgentRepository.upsert_agent", "agents_state", {"update": "agents_state", "updates": [
+        {"q": {"tenant_id": "t", "agent_id": "x"}, "u": {"$set": {"status": "ONLINE"}}, "upsert": True}]}),
+    HotQuery("AgentRepository.update_presence", "agents_state", {"update": "agents_state", "updates": [
+        {"q": {"tenant_id": "t", "agent_id": "x"}, "u": {"$set": {"status": "ONLINE"}, "$max": {"last_seen": 0}}}]}),
+    HotQuery("AgentRepository.get_agent", "agents_state", {
+        "find": "agents_state", "filter": {"tenant_id": "t", "agent_id": "x"}}),
+    HotQuery("SegmentStateRepository.increment_version", "segments_state", {
+        "findAndModify": "segments_state", "query": {"tenant_id": "t", "segment_id": "x"},
+        "update": {"$inc": {"version_counter": 1}}, "upsert": True, "new": True}),
+    HotQuery("SegmentStateRepository.get_versions_map", "segments_state", {
+        "find": "segments_state", "filter": {"tenant_id": "t", "segment_id": {"$in": ["x", "y"]}}}),
+    HotQuery("RequestDedupRepository.get", "request_dedup", {
+        "find": "request_dedup", "filter": {"_id": "t/a/r", "created_at": {"$gt": 0}}}),
+    HotQuery("RuleRepository.get_segments_for_groups (no cache)", "segment_rules", {
+        "find": "segment_rules", "filter": {"required_group": {"$in": ["x", "y"]}}}),
+    HotQuery("RuleRepository.get_segments_for_groups (tenant)", "segment_rules", {
+        "find": "segment_rules", "filter": {"required_group": {"$in": ["x", "y"]}, "tenant_id": "t"}}),
+    HotQuery("RuleRepository.get_all_target_segments (no cache)", "segment_rules", {
+        "distinct": "segment_rules", "key": "target_segment"}),
+]
+
+class QueryPlanError(RuntimeError):
+    """A hot query would scan its whole collection."""
+
+def plan_stages(plan) -> List[str]:
+    """Every `stage` in an explain output (classic and SBE plans nest differently)."""
+    stages = []
+    if isinstance(plan, dict):
+        if isinstance(plan.get("stage"), str):
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+def _winning_plan(explain: dict) -> dict:
+    return explain.get("queryPlanner", {}).get("winningPlan", explain)
+
+def _scans(explain: dict) -> bool:
+    return "COLLSCAN" in plan_stages(_winning_plan(explain))
+
+def _report(failures: List[str]):
+    if failures:
+        raise QueryPlanError("Hot queries without an index:\n  " + "\n  ".join(failures))
+    logger.info(f"Query plans verified ({len(HOT_QUERIES)} hot queries use an index)")
+
+def _index_error(collection: str, e: OperationFailure) -> OperationFailure:
+    if e.code == 11000:
+        # Duplicates written before the unique index existed - they have to be merged by hand
+        logger.error(f"Duplicate keys in '{collection}' block a unique index: {e.details}")
+    elif e.code in (85, 86):
+        # IndexOptionsConflict / IndexKeySpecsConflict - e.g. DEDUP_TTL_SECONDS was changed
+        logger.error(f"An index on '{collection}' exists with other options - collMod or drop it: {e.details}")
+    return e
+
+# --- Sync (pymongo Database) ---
+def ensure_indexes(db) -> Dict[str, List[str]]:
+    """Creates missing indexes (idempotent). Returns the index names per collection."""
+    backfilled = db["segments_state"].update_many(UNSCOPED, {"$set": {"tenant_id": settings.TENANT_ID}})
+    if backfilled.modified_count:
+        logger.info(f"Assigned {backfilled.modified_count} unscoped segment(s) to tenant '{settings.TENANT_ID}'")
+    created = {}
+    for collection, models in INDEXES.items():
+        try:
+            created[collection] = db[collection].create_indexes(models)
+        except OperationFailure as e:
+            raise _index_error(collection, e)
+        existing = db[collection].index_information()
+        for name in LEGACY_INDEXES.get(collection, []):
+            if name in existing:
+                db[collection].drop_index(name)
+                logger.info(f"Dropped superseded index '{name}' on '{collection}'")
+    logger.info(f"Indexes ensured: {created}")
+    return created
+
+def verify_query_plans(db):
+    """Explains every hot query; raises QueryPlanError listing those that would scan."""
+    failures = []
+    for query in HOT_QUERIES:
+        explain = db.command("explain", query.command, verbosity="queryPlanner")
+        if _scans(explain):
+            failures.append(f"{query.name}: COLLSCAN on {query.collection}")
+    _report(failures)
+
+# --- Async (AsyncMongoClient database) ---
+async def ensure_indexes_async(db) -> Dict[str, List[str]]:
+    backfilled = await db["segments_state"].update_many(UNSCOPED, {"$set": {"tenant_id": settings.TENANT_ID}})
+    if backfilled.modified_count:
+        logger.info(f"Assigned {backfilled.modified_count} unscoped segment(s) to tenant '{settings.TENANT_ID}'")
+    created = {}
+    for collection, models in INDEXES.items():
+        try:
+            created[collection] = await db[collection].create_indexes(models)
+        except OperationFailure as e:
+            raise _index_error(collection, e)
+        existing = await db[collection].index_information()
+        for name in LEGACY_INDEXES.get(collection, []):
+            if name in existing:
+                await db[collection].drop_index(name)
+                logger.info(f"Dropped superseded index '{name}' on '{collection}'")
+    logger.info(f"Indexes ensured: {created}")
+    return created
+
+async def verify_query_plans_async(db):
+    failures = []
+    for query in HOT_QUERIES:
+        explain = await db.command("explain", query.command, verbosity="queryPlanner")
+        if _scans(explain):
+            failures.append(f"{query.name}: COLLSCAN on {query.collection}")
+    _report(failures)
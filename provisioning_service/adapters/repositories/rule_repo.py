@@ -1,14 +1,79 @@
-from typing import List, Optional
-from ...core.entities import SegmentRuleEntity
+import threading
+import time
+from typing import Callable, List, Optional
+from ...core.config import settings
+from ...core.policy_engine import CompiledPolicy
+from ...core.metrics import registry
 from .base import BaseRepository
+from .change_watcher import ChangeWatcher
+
+RELOADS = registry.counter("rule_reloads_total", "Rule set reloads (changed=false: nothing to recompile against)", ["changed"])
+
+# Projection for loading the rule set
+RULE_FIELDS = {"_id": 0, "required_group": 1, "required_location": 1, "target_segment": 1, "tenant_id": 1}
 
 class RuleRepository(BaseRepository):
     def __init__(self, db):
         super().__init__(db, "segment_rules")
+        self._index: Optional[CompiledPolicy] = None
+        self._lock = threading.Lock()
+        self._watcher: Optional[ChangeWatcher] = None
+        self._listeners: List[Callable[[CompiledPolicy, CompiledPolicy], None]] = []
+
+    def get_segments_for_groups(self, tenant_id: str, groups: List[str], location: Optional[str] = None) -> List[str]:
+        """Resolves every segment the agent's groups (and location) qualify for, from the compiled rules."""
+        if not settings.RULE_CACHE_ENABLED:
+            with self._timed("find"):
+                docs = list(self.collection.find({"required_group": {"$in": groups}}, RULE_FIELDS))
+            return CompiledPolicy(docs).evaluate(tenant_id, groups, location)
+        return self._get_index().evaluate(tenant_id, groups, location)
+
+    def get_policy(self) -> CompiledPolicy:
+        return self._get_index()
+
+    def add_listener(self, listener: Callable[[CompiledPolicy, CompiledPolicy], None]):
+        """`listener(old, new)` runs after a reload that changed the rule set."""
+        self._listeners.append(listener)
 
-    def find_rule_for_group(self, group: str) -> Optional[SegmentRuleEntity]:
-        doc = self.collection.find_one({"required_group": group})
-        return SegmentRuleEntity(**doc) if doc else None
-        
     def get_all_target_segments(self) -> List[str]:
-        return self.collection.distinct("target_segment")
\ No newline at end of file
+        if not settings.RULE_CACHE_ENABLED:
+            with self._timed("distinct"):
+                return self.collection.distinct("target_segment")
+        return list(self._get_index().segments)
+
+    # --- Index Management ---
+    def _get_index(self) -> CompiledPolicy:
+        index = self._index
+        if index is None:
+            self._start_watcher()
+            return self.reload()
+        if not self._watcher.active and time.monotonic() - index.loaded_at > settings.RULE_CACHE_TTL_SECONDS:
+            # Poll fallback (no change stream)
+            return self.reload(stale=index)
+        return index
+
+    def _start_watcher(self):
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = ChangeWatcher(self.collection, lambda change: self.reload(), "segment_rules").start()
+
+    def reload(self, stale: Optional[CompiledPolicy] = None) -> CompiledPolicy:
+        """
+        Loads every rule in one query, compiles it and atomically swaps the snapshot.
+        When `stale` is given and another thread already replaced it, that newer snapshot is reused.
+        """
+        with self._lock:
+            if stale is not None and self._index is not stale:
+                return self._index
+            with self._timed("find"):
+                docs = list(self.collection.find({}, RULE_FIELDS))
+            old, self._index = self._index, CompiledPolicy(docs)
+            new = self._index
+
+        changed = old is None or old.fingerprint != new.fingerprint
+        RELOADS.inc(changed=str(changed).lower())
+
+        if changed and old is not None:
+            for listener in self._listeners:
+                listener(old, new)
+        return new
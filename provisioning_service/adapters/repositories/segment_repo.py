@@ -1,20 +1,117 @@
-from typing import List, Dict
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
 from pymongo import ReturnDocument
+from ...core.config import settings
+from ...core.metrics import registry
 from .base import BaseRepository
+from .change_watcher import ChangeWatcher
+
+CACHE_LOOKUPS = registry.counter("segment_version_cache_lookups_total", "Segment version lookups", ["result"])
+
+# Projections: version reads only need the counter (no _id, no ObjectId decoding)
+VERSION_FIELDS = {"_id": 0, "segment_id": 1, "version_counter": 1}
+COUNTER_FIELDS = {"_id": 0, "version_counter": 1}
+
+class VersionCache:
+    """
+    Bounded LRU of (tenant_id, segment_id) -> version_counter (None = segment has no state yet).
+    Versions only move forward, so late or duplicated updates can never roll an entry back.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, tenant_id: str, segment_ids: List[str], max_age: Optional[float]):
+        """Returns (hits, misses). Entries older than `max_age` seconds count as misses."""
+        hits, misses = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for seg in segment_ids:
+                key = (tenant_id, seg)
+                entry = self._entries.get(key)
+                if entry is None or (max_age is not None and now - entry[1] > max_age):
+                    misses.append(seg)
+                    continue
+                self._entries.move_to_end(key)
+                hits[seg] = entry[0]
+        return hits, misses
+
+    def put(self, tenant_id: str, segment_id: str, version: Optional[int]):
+        key = (tenant_id, segment_id)
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[0] is not None:
+                version = current[0] if version is None else max(version, current[0])
+            self._entries[key] = (version, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
 class SegmentStateRepository(BaseRepository):
     def __init__(self, db):
         super().__init__(db, "segments_state")
+        self._cache = VersionCache(settings.SEGMENT_VERSION_CACHE_MAX_ENTRIES)
+        self._watcher: Optional[ChangeWatcher] = None
+        self._watcher_lock = threading.Lock()
 
-    def increment_version(self, segment_id: str) -> int:
-        doc = self.collection.find_one_and_update(
-            {"segment_id": segment_id},
-            {"$inc": {"version_counter": 1}},
-            upsert=True,
-            return_document=ReturnDocument.AFTER
-        )
+    def increment_version(self, tenant_id: str, segment_id: str) -> int:
+        with self._timed("find_one_and_update"):
+            doc = self.collection.find_one_and_update(
+                {"tenant_id": tenant_id, "segment_id": segment_id},
+                {"$inc": {"version_counter": 1}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+                projection=COUNTER_FIELDS
+            )
+        # Write-through: this process sees its own bump immediately
+        self._cache.put(tenant_id, segment_id, doc["version_counter"])
         return doc["version_counter"]
-        
-    def get_versions_map(self, segment_ids: List[str]) -> Dict[str, int]:
-        cursor = self.collection.find({"segment_id": {"$in": segment_ids}})
-        return {doc["segment_id"]: doc["version_counter"] for doc in cursor}
\ No newline at end of file
+
+    def get_versions_map(self, tenant_id: str, segment_ids: List[str]) -> Dict[str, int]:
+        if not settings.SEGMENT_VERSION_CACHE_ENABLED:
+            return self._fetch_versions(tenant_id, segment_ids)
+
+        self._start_watcher()
+        # Without a change stream, other workers' bumps are only picked up after the TTL
+        max_age = None if self._watcher.active else settings.SEGMENT_VERSION_CACHE_TTL_SECONDS
+        hits, misses = self._cache.get_many(tenant_id, segment_ids, max_age)
+        CACHE_LOOKUPS.inc(len(hits), result="hit")
+        CACHE_LOOKUPS.inc(len(misses), result="miss")
+        if misses:
+            fetched = self._fetch_versions(tenant_id, misses)
+            for seg in misses:
+                self._cache.put(tenant_id, seg, fetched.get(seg))
+            hits.update(fetched)
+        return {seg: ver for seg, ver in hits.items() if ver is not None}
+
+    def _fetch_versions(self, tenant_id: str, segment_ids: List[str]) -> Dict[str, int]:
+        with self._timed("find"):
+            cursor = self.collection.find({"tenant_id": tenant_id, "segment_id": {"$in": segment_ids}}, VERSION_FIELDS)
+            return {doc["segment_id"]: doc["version_counter"] for doc in cursor}
+
+    # --- Cross-process coherence ---
+    def _start_watcher(self):
+        if self._watcher is None:
+            with self._watcher_lock:
+                if self._watcher is None:
+                    self._watcher = ChangeWatcher(
+                        self.collection, self._on_change, "segments_state", full_document="updateLookup"
+                    ).start()
+
+    def _on_change(self, change: Optional[dict]):
+        if change is None:
+            # Stream (re)opened - anything cached before may have missed events
+            self._cache.clear()
+            return
+        doc = change.get("fullDocument")
+        if doc and "segment_id" in doc:
+            self._cache.put(doc.get("tenant_id"), doc["segment_id"], doc.get("version_counter"))
+        elif change.get("operationType") in ("delete", "drop", "invalidate"):
+            self._cache.clear()
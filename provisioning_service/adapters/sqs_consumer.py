@@ -1,30 +1,487 @@
 import boto3
 import json
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future, wait as wait_futures
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
 from ..core.config import settings
+from ..core.metrics import registry
 from provisioning_service.core.logger import get_logger
+from .tenant_scheduler import FairWorkerPool, tenant_label
 
 logger = get_logger("SQSConsumer")
 
+RECEIVE_LATENCY = registry.histogram("sqs_receive_seconds", "Duration of ReceiveMessage calls (incl. long polling)")
+RECEIVED = registry.counter("sqs_messages_received_total", "Messages received from SQS", ["type"])
+INFLIGHT = registry.gauge("sqs_messages_inflight", "Messages received but not yet acknowledged")
+DISPATCH_WAIT = registry.histogram("sqs_dispatch_wait_seconds", "Time from receipt until a worker lane starts the message", ["type"])
+HANDLE_LATENCY = registry.histogram("sqs_handle_seconds", "Duration of the message callback", ["type", "outcome"])
+ACK_LATENCY = registry.histogram("sqs_ack_seconds", "Duration of delete / visibility change calls", ["op"])
+ACKED = registry.counter("sqs_acked_total", "Messages acknowledged", ["result"])
+VISIBILITY_EXTENDED = registry.counter("sqs_visibility_extended_total", "Visibility extensions of messages still being handled")
+TENANT_LATENCY = registry.histogram("tenant_message_seconds", "Time from receipt until handled, per tenant", ["tenant", "type"])
+
+# SQS hard limit for ReceiveMessage / *Batch calls
+SQS_MAX_BATCH = 10
+ACK_FLUSH_INTERVAL = 0.05
+
+# What the acker does with a finished message
+ACK_DELETE = "delete"    # handled (or invalid) - remove it
+ACK_RETRY = "retry"      # handler failed - visible again after SQS_FAILURE_VISIBILITY_TIMEOUT
+ACK_RELEASE = "release"  # never started (shutting down) - visible again right away
+
+def envelope_fields(body) -> Tuple[str, str, str]:
+    """(type, tenant_id, agent or segment id) of a decoded body - a dict or a parsed SQSMessage."""
+    if isinstance(body, dict):
+        payload = body.get("payload") or {}
+        return (body.get("type", "unknown"), body.get("tenant_id", ""),
+                payload.get("agent_id") or payload.get("segment_id") or "")
+    payload = body.payload
+    return body.type, body.tenant_id, getattr(payload, "agent_id", None) or getattr(payload, "segment_id", "")
+
+def held_ack(future: Future) -> str:
+    """What to do with a message whose callback returned `future`, once it has resolved."""
+    error = future.exception()
+    if error is not None:
+        logger.error(f"Error: {error}")
+        return ACK_RETRY
+    return ACK_DELETE
+
+def ordering_key(body) -> str:
+    """Messages sharing a key are handled strictly in arrival order (per agent / per segment)."""
+    _, tenant_id, key = envelope_fields(body)
+    return f"{tenant_id}/{key}"
+
+class OrderedWorkerPool:
+    """
+    Fixed set of worker lanes. Each lane is a single thread with its own FIFO,
+    and a key always hashes to the same lane, so per-key ordering is preserved
+    while unrelated keys run concurrently.
+    """
+    def __init__(self, concurrency: int, name: str = "sqs-lane"):
+        self.lanes = [queue.Queue() for _ in range(max(1, concurrency))]
+        self.threads = []
+        for i, lane in enumerate(self.lanes):
+            t = threading.Thread(target=self._run_lane, args=(lane,), name=f"{name}-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, key: str, fn, *args, tenant: str = ""):
+        lane = self.lanes[zlib.crc32(key.encode()) % len(self.lanes)]
+        lane.put((fn, args))
+
+    def drain_pending(self) -> list:
+        """Removes and returns the (fn, args) items no lane has started yet (used when shutting down)."""
+        items = []
+        for lane in self.lanes:
+            while True:
+                try:
+                    items.append(lane.get_nowait())
+                except queue.Empty:
+                    break
+        return items
+
+    def _run_lane(self, lane: queue.Queue):
+        while True:
+            fn, args = lane.get()
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"Lane Error: {e}")
+
+class VisibilityHeartbeat:
+    """
+    Keeps received messages invisible while they are being handled: a thread extends every
+    message held `interval` seconds since its last extension by `timeout` seconds
+    (change_message_visibility_batch, 10 per call). A message held longer than
+    `max_extension` is left to expire, so a hung handler's message is redelivered eventually.
+    """
+    def __init__(self, sqs_client, queue_url: str, timeout: int, interval: float, max_extension: float):
+        self.sqs = sqs_client
+        self.queue_url = queue_url
+        self.timeout = timeout
+        self.interval = interval
+        self.max_extension = max_extension
+        self._held: Dict[str, List[float]] = {}  # receipt handle -> [received_at, extended_at]
+        self._lock = threading.Lock()
+        self._extending = threading.Lock()  # held while extension calls are in progress
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "VisibilityHeartbeat":
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sqs-visibility", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def track(self, handles: List[str]):
+        now = time.monotonic()
+        with self._lock:
+            for handle in handles:
+                self._held[handle] = [now, now]
+
+    def untrack(self, handles: List[str], settle: bool = False):
+        """
+        settle=True also waits for an extension that may be in flight - required before
+        setting a message's visibility, which a late extension would otherwise overwrite.
+        """
+        with self._lock:
+            for handle in handles:
+                self._held.pop(handle, None)
+        if settle:
+            with self._extending:
+                pass
+
+    def _run(self):
+        # Waking at half the interval keeps every message within 1.5 x interval of an extension
+        while not self._stop.wait(self.interval / 2):
+            try:
+                self.extend_due()
+            except Exception as e:
+                logger.error(f"Visibility Heartbeat Error: {e}")
+
+    def extend_due(self) -> int:
+        """Extends the messages that are due. Returns how many were extended."""
+        extended = 0
+        with self._extending:
+            now = time.monotonic()
+            with self._lock:
+                due = [h for h, (received_at, extended_at) in self._held.items()
+                       if now - extended_at >= self.interval and now - received_at < self.max_extension]
+            for i in range(0, len(due), SQS_MAX_BATCH):
+                batch = due[i:i + SQS_MAX_BATCH]
+                entries = [{"Id": str(j), "ReceiptHandle": h, "VisibilityTimeout": self.timeout}
+                           for j, h in enumerate(batch)]
+                try:
+                    with ACK_LATENCY.time(op="extend_batch"):
+                        response = self.sqs.change_message_visibility_batch(QueueUrl=self.queue_url, Entries=entries)
+                except Exception as e:
+                    logger.error(f"Visibility Extension Error: {e}")
+                    continue
+                failed = {f["Id"] for f in response.get('Failed', [])}
+                for f in response.get('Failed', []):
+                    logger.warning(f"Visibility Extension Failed: {f.get('Code')} - {f.get('Message')}")
+                with self._lock:
+                    for j, handle in enumerate(batch):
+                        if str(j) in failed:
+                            # Receipt no longer valid (deleted, or already redelivered) - stop trying
+                            self._held.pop(handle, None)
+                        elif handle in self._held:
+                            self._held[handle][1] = now
+                extended += len(batch) - len(failed)
+        if extended:
+            VISIBILITY_EXTENDED.inc(extended)
+        return extended
+
+def visibility_heartbeat(sqs_client, queue_url: str) -> VisibilityHeartbeat:
+    return VisibilityHeartbeat(
+        sqs_client, queue_url,
+        timeout=settings.SQS_VISIBILITY_TIMEOUT,
+        interval=settings.SQS_VISIBILITY_HEARTBEAT_SECONDS,
+        max_extension=settings.SQS_VISIBILITY_MAX_EXTENSION_SECONDS
+    )
+
 class SQSConsumer:
-    def __init__(self):
-        self.sqs = boto3.client(
-            'sqs', 
-            endpoint_url=settings.SQS_ENDPOINT_URL, 
+    """
+    `decode` turns a raw SQS body into what the callback receives (default: json.loads).
+    It may raise for a malformed body (the message is retried) or return None for one
+    that should be dropped (the message is deleted without calling the callback).
+
+    A callback may return a concurrent.futures.Future for work it handed off (a coalesced
+    update trigger): the message stays held, and is deleted or retried once it resolves.
+
+    Messages are kept invisible while their handler runs (VisibilityHeartbeat). stop()
+    (e.g. from a SIGTERM handler) ends polling; start_listening then drains and returns.
+    """
+    def __init__(self, sqs_client=None, decode: Optional[Callable[[str], object]] = None):
+        self.sqs = sqs_client or boto3.client(
+            'sqs',
+            endpoint_url=settings.SQS_ENDPOINT_URL,
             region_name=settings.AWS_REGION
         )
         self.queue_url = settings.SQS_QUEUE_URL
+        self.decode = decode or json.loads
+        self.visibility = visibility_heartbeat(self.sqs, self.queue_url)
+        self._stopping = threading.Event()
+
+        self._held = set()  # single mode: Futures of messages acknowledged once they resolve
+
+        # Batched mode state
+        self._completions = queue.Queue()
+        self._inflight = 0
+        self._inflight_cond = threading.Condition()
+
+    def stop(self):
+        """Stops polling (safe to call from a signal handler). Messages in hand are drained first."""
+        if not self._stopping.is_set():
+            logger.info("Stop requested - finishing in-flight messages")
+        self._stopping.set()
+
+    def _receive(self, max_messages: int) -> dict:
+        with RECEIVE_LATENCY.time():
+            return self.sqs.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=max_messages,
+                WaitTimeSeconds=settings.SQS_WAIT_TIME_SECONDS,
+                VisibilityTimeout=settings.SQS_VISIBILITY_TIMEOUT
+            )
 
     def start_listening(self, callback):
+        if settings.SQS_BATCH_MODE:
+            return self.start_listening_batched(callback)
+
         logger.info("Listening for SQS messages...")
-        while True:
-            response = self.sqs.receive_message(
-                QueueUrl=self.queue_url, MaxNumberOfMessages=1, WaitTimeSeconds=5
-            )
-            if 'Messages' in response:
+        self.visibility.start()
+        while not self._stopping.is_set():
+            response = self._receive(1)
+            if 'Messages' in response and self._stopping.is_set():
+                # Stopped during the long poll - hand it straight back
+                for msg in response['Messages']:
+                    with ACK_LATENCY.time(op="release"):
+                        self.sqs.change_message_visibility(
+                            QueueUrl=self.queue_url, ReceiptHandle=msg['ReceiptHandle'], VisibilityTimeout=0
+                        )
+                    ACKED.inc(result="released")
+            elif 'Messages' in response:
                 for msg in response['Messages']:
+                    kind, tenant_id, outcome = "unknown", "", "error"
+                    start = time.perf_counter()
+                    self.visibility.track([msg['ReceiptHandle']])
+                    result = None
                     try:
-                        body = json.loads(msg['Body'])
-                        callback(body)
-                        self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=msg['ReceiptHandle'])
+                        body = self.decode(msg['Body'])
+                        if body is None:
+                            kind = "invalid"
+                            RECEIVED.inc(type=kind)
+                        else:
+                            kind, tenant_id, _ = envelope_fields(body)
+                            RECEIVED.inc(type=kind)
+                            result = callback(body)
+                        outcome = "ok"
+                        if isinstance(result, Future):
+                            self._held.add(result)
+                            result.add_done_callback(partial(self._settle_held, msg['ReceiptHandle']))
+                        else:
+                            self._delete(msg['ReceiptHandle'])
                     except Exception as e:
-                        logger.error(f"Error: {e}")
\ No newline at end of file
+                        logger.error(f"Error: {e}")
+                    if not isinstance(result, Future):
+                        # Deleted, or (failed) reappears once its no longer extended visibility runs out
+                        self.visibility.untrack([msg['ReceiptHandle']])
+                    elapsed = time.perf_counter() - start
+                    HANDLE_LATENCY.observe(elapsed, type=kind, outcome=outcome)
+                    if outcome == "ok":
+                        TENANT_LATENCY.observe(elapsed, tenant=tenant_label(tenant_id), type=kind)
+        if self._held:
+            logger.info(f"Waiting for {len(self._held)} held messages...")
+            wait_futures(list(self._held), timeout=settings.SQS_DRAIN_TIMEOUT_SECONDS)
+        self.visibility.stop()
+        logger.info("Stopped listening")
+
+    def _delete(self, handle: str):
+        with ACK_LATENCY.time(op="delete"):
+            self.sqs.delete_message(QueueUrl=self.queue_url, ReceiptHandle=handle)
+        ACKED.inc(result="deleted")
+
+    def _settle_held(self, handle: str, future: Future):
+        # Runs on whichever thread resolved the Future
+        try:
+            if held_ack(future) == ACK_DELETE:
+                self._delete(handle)
+        except Exception as e:
+            logger.error(f"Delete Error: {e}")
+        finally:
+            self.visibility.untrack([handle])
+            self._held.discard(future)
+
+    # --- Batched Mode ---
+    def start_listening_batched(self, callback):
+        """
+        Receives up to 10 messages per poll and hands them to an ordered worker pool.
+        At most SQS_PREFETCH messages are held (received but not yet acknowledged) at once.
+        Successes are deleted with delete_message_batch; failures are made visible
+        again after SQS_FAILURE_VISIBILITY_TIMEOUT via change_message_visibility_batch.
+
+        After stop(), messages no handler has started yet are released (visibility 0, so
+        another worker gets them at once) and running handlers get up to
+        SQS_DRAIN_TIMEOUT_SECONDS to finish before this returns.
+        """
+        concurrency = settings.SQS_WORKER_CONCURRENCY
+        prefetch = max(settings.SQS_PREFETCH, 1)
+        if settings.TENANT_FAIR_SCHEDULING:
+            pool = FairWorkerPool(concurrency, settings.TENANT_WEIGHTS, settings.TENANT_MAX_CONCURRENCY)
+        else:
+            pool = OrderedWorkerPool(concurrency)
+        threading.Thread(target=self._ack_loop, name="sqs-acker", daemon=True).start()
+        self.visibility.start()
+
+        logger.info(f"Listening for SQS messages (batched: concurrency={concurrency}, prefetch={prefetch}, "
+                    f"fair={settings.TENANT_FAIR_SCHEDULING})...")
+        while not self._stopping.is_set():
+            # 1. Wait for capacity (re-checking for a stop while full)
+            with self._inflight_cond:
+                while self._inflight >= prefetch and not self._stopping.is_set():
+                    self._inflight_cond.wait(1)
+                if self._stopping.is_set():
+                    break
+                max_messages = min(SQS_MAX_BATCH, prefetch - self._inflight)
+
+            # 2. Poll
+            try:
+                response = self._receive(max_messages)
+            except Exception as e:
+                logger.error(f"Receive Error: {e}")
+                time.sleep(1)
+                continue
+
+            messages = response.get('Messages', [])
+            if not messages:
+                continue
+
+            with self._inflight_cond:
+                self._inflight += len(messages)
+            INFLIGHT.inc(len(messages))
+            self.visibility.track([msg['ReceiptHandle'] for msg in messages])
+            received_at = time.perf_counter()
+            if self._stopping.is_set():
+                # Stopped during the long poll - hand these straight back
+                for msg in messages:
+                    self._completions.put((msg['ReceiptHandle'], ACK_RELEASE))
+                break
+
+            # 3. Dispatch (per-key ordering)
+            for msg in messages:
+                try:
+                    body = self.decode(msg['Body'])
+                except Exception as e:
+                    logger.error(f"Error: Malformed message body - {e}")
+                    RECEIVED.inc(type="malformed")
+                    self._completions.put((msg['ReceiptHandle'], ACK_RETRY))
+                    continue
+                if body is None:
+                    RECEIVED.inc(type="invalid")
+                    self._completions.put((msg['ReceiptHandle'], ACK_DELETE))
+                    continue
+                kind, tenant_id, key = envelope_fields(body)
+                RECEIVED.inc(type=kind)
+                pool.submit(f"{tenant_id}/{key}", self._handle, callback, msg, body, received_at,
+                            tenant=str(tenant_id))
+
+        # Queued behind other work in their lanes - release now rather than when a lane gets to them
+        for _, (_, msg, _, _) in pool.drain_pending():
+            self._completions.put((msg['ReceiptHandle'], ACK_RELEASE))
+        self._drain()
+
+    def _drain(self):
+        """Waits (up to SQS_DRAIN_TIMEOUT_SECONDS) until every received message is acknowledged or released."""
+        deadline = time.monotonic() + settings.SQS_DRAIN_TIMEOUT_SECONDS
+        with self._inflight_cond:
+            logger.info(f"Draining {self._inflight} in-flight messages...")
+            while self._inflight > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._inflight_cond.wait(remaining)
+            left = self._inflight
+        self.visibility.stop()
+        if left:
+            logger.warning(f"Drain timed out with {left} messages still being handled - "
+                           f"they are redelivered once their visibility timeout expires")
+        else:
+            logger.info("Drained - stopped listening")
+
+    def _handle(self, callback, msg: dict, body, received_at: float):
+        if self._stopping.is_set():
+            # Prefetched but not started - let a surviving worker have it now
+            self._completions.put((msg['ReceiptHandle'], ACK_RELEASE))
+            return
+        kind, tenant_id, _ = envelope_fields(body)
+        start = time.perf_counter()
+        DISPATCH_WAIT.observe(start - received_at, type=kind)
+        ok = True
+        result = None
+        try:
+            result = callback(body)
+        except Exception as e:
+            logger.error(f"Error: {e}")
+            ok = False
+        now = time.perf_counter()
+        HANDLE_LATENCY.observe(now - start, type=kind, outcome="ok" if ok else "error")
+        TENANT_LATENCY.observe(now - received_at, tenant=tenant_label(tenant_id), type=kind)
+        if isinstance(result, Future):
+            # Held (still in flight, visibility extended) until the handed-off work is done
+            result.add_done_callback(lambda future: self._completions.put((msg['ReceiptHandle'], held_ack(future))))
+            return
+        self._completions.put((msg['ReceiptHandle'], ACK_DELETE if ok else ACK_RETRY))
+
+    def _ack_loop(self):
+        """Collects completions and acknowledges them in batches of up to 10 (or every ~50ms)."""
+        pending = {ACK_DELETE: [], ACK_RETRY: [], ACK_RELEASE: []}
+        deadline = time.monotonic() + ACK_FLUSH_INTERVAL
+        while True:
+            timeout = max(deadline - time.monotonic(), 0)
+            try:
+                handle, action = self._completions.get(timeout=timeout)
+                pending[action].append(handle)
+            except queue.Empty:
+                pass
+
+            now = time.monotonic()
+            for action, handles in pending.items():
+                if len(handles) >= SQS_MAX_BATCH or (handles and now >= deadline):
+                    batch = handles[:SQS_MAX_BATCH]
+                    del handles[:SQS_MAX_BATCH]
+                    if action == ACK_DELETE:
+                        self._delete_batch(batch)
+                    elif action == ACK_RETRY:
+                        self._visibility_batch(batch, settings.SQS_FAILURE_VISIBILITY_TIMEOUT, "retry", "retried")
+                    else:
+                        self._visibility_batch(batch, 0, "release", "released")
+            if now >= deadline:
+                deadline = now + ACK_FLUSH_INTERVAL
+
+    def _delete_batch(self, handles):
+        self.visibility.untrack(handles)
+        entries = [{"Id": str(i), "ReceiptHandle": h} for i, h in enumerate(handles)]
+        failures = len(handles)
+        try:
+            with ACK_LATENCY.time(op="delete_batch"):
+                response = self.sqs.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            failures = len(response.get('Failed', []))
+            for failed in response.get('Failed', []):
+                logger.error(f"Delete Failed: {failed.get('Code')} - {failed.get('Message')}")
+        except Exception as e:
+            logger.error(f"Delete Batch Error: {e}")
+        ACKED.inc(len(handles) - failures, result="deleted")
+        ACKED.inc(failures, result="failed")
+        self._release(len(handles))
+
+    def _visibility_batch(self, handles, visibility_timeout: int, op: str, result: str):
+        self.visibility.untrack(handles, settle=True)
+        entries = [
+            {"Id": str(i), "ReceiptHandle": h, "VisibilityTimeout": visibility_timeout}
+            for i, h in enumerate(handles)
+        ]
+        try:
+            with ACK_LATENCY.time(op=f"{op}_batch"):
+                response = self.sqs.change_message_visibility_batch(QueueUrl=self.queue_url, Entries=entries)
+            for failed in response.get('Failed', []):
+                logger.error(f"Visibility Change Failed: {failed.get('Code')} - {failed.get('Message')}")
+        except Exception as e:
+            logger.error(f"Visibility Batch Error: {e}")
+        ACKED.inc(len(handles), result=result)
+        self._release(len(handles))
+
+    def _release(self, count: int):
+        INFLIGHT.dec(count)
+        with self._inflight_cond:
+            self._inflight -= count
+            self._inflight_cond.notify_all()
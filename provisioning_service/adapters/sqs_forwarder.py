@@ -0,0 +1,160 @@
+import json
+import queue
+import threading
+import time
+import uuid
+import zlib
+from typing import List, Optional, Tuple
+from ..core.config import settings
+from ..core.metrics import registry
+from provisioning_service.core.logger import get_logger
+from .sqs_consumer import ordering_key
+
+logger = get_logger("SqsForwarder")
+
+SQS_MAX_BATCH = 10
+MAX_RETRY_BACKOFF = 2.0
+
+QUEUE_DEPTH = registry.gauge("bridge_queue_depth", "Envelopes buffered in the bridge waiting for SQS")
+FORWARD_LATENCY = registry.histogram("bridge_forward_latency_seconds", "Time from enqueue to SQS acceptance")
+FORWARDED = registry.counter("bridge_forwarded_total", "Envelopes accepted by SQS")
+DROPPED = registry.counter("bridge_dropped_total", "Envelopes dropped by the bridge", ["reason"])
+
+class SqsBatchForwarder:
+    """
+    Decouples MQTT ingestion from SQS latency. Envelopes go into a bounded queue
+    that sender threads drain with send_message_batch (up to 10 per call, flushed
+    after BRIDGE_FLUSH_MS even if the batch is not full).
+
+    When the queue is full, BRIDGE_QUEUE_FULL_POLICY decides: "block" waits up to
+    BRIDGE_ENQUEUE_TIMEOUT_MS (slowing paho's network thread, so the broker buffers),
+    "drop" rejects immediately. Either way a rejected envelope is counted.
+
+    Each sender owns a slice of the buffer and an ordering key (tenant + agent or
+    segment) always maps to the same sender, so a key's envelopes are sent in order.
+    For FIFO queues (URL ending in .fifo) that key becomes the MessageGroupId, so
+    the order also survives across workers.
+
+    Failed sends and retryable failed entries are retried by the same sender (keeping
+    the order) up to BRIDGE_SEND_ATTEMPTS times; only then, or when SQS rejects an entry
+    as the sender's fault, is an envelope dropped. SQS still accepts the entries after a
+    failed one, so on FIFO queues a call carries at most one entry per MessageGroupId:
+    a group's next envelope is only sent once the previous one is accepted (or dropped).
+    """
+    def __init__(self, sqs_client, queue_url: str):
+        self.sqs = sqs_client
+        self.queue_url = queue_url
+        self.fifo = queue_url.endswith(".fifo")
+        self.flush_interval = settings.BRIDGE_FLUSH_MS / 1000
+        self.block = settings.BRIDGE_QUEUE_FULL_POLICY == "block"
+        self.enqueue_timeout = settings.BRIDGE_ENQUEUE_TIMEOUT_MS / 1000
+        self.send_attempts = max(settings.BRIDGE_SEND_ATTEMPTS, 1)
+        self.retry_backoff = settings.BRIDGE_RETRY_BACKOFF_MS / 1000
+        senders = max(settings.BRIDGE_SENDER_THREADS, 1)
+        self._queues: "List[queue.Queue[Tuple[str, float, Optional[str]]]]" = [
+            queue.Queue(maxsize=max(settings.BRIDGE_QUEUE_MAX // senders, 1)) for _ in range(senders)
+        ]
+        for i, q in enumerate(self._queues):
+            threading.Thread(target=self._sender_loop, args=(q,), name=f"sqs-sender-{i}", daemon=True).start()
+
+    def forward(self, envelope: dict) -> bool:
+        """Buffers an envelope for sending. Returns False if it was dropped."""
+        key = ordering_key(envelope)
+        item = (json.dumps(envelope), time.monotonic(), key if self.fifo else None)
+        target = self._queues[zlib.crc32(key.encode()) % len(self._queues)]
+        try:
+            if self.block:
+                target.put(item, timeout=self.enqueue_timeout)
+            else:
+                target.put_nowait(item)
+        except queue.Full:
+            DROPPED.inc(reason="queue_full")
+            logger.warning("Forward queue full - dropping envelope")
+            return False
+        self._report_depth()
+        return True
+
+    def _report_depth(self):
+        QUEUE_DEPTH.set(sum(q.qsize() for q in self._queues))
+
+    def _sender_loop(self, q: queue.Queue):
+        while True:
+            batch = [q.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < SQS_MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._report_depth()
+            self._send(batch)
+
+    def _send(self, batch: List[Tuple[str, float, Optional[str]]]):
+        entries = {}
+        for i, (body, _, group_id) in enumerate(batch):
+            entry = {"Id": str(i), "MessageBody": body}
+            if group_id is not None:
+                # Explicit dedup IDs: identical bodies (e.g. a retried bootstrap) are distinct messages,
+                # while our own retries of this entry keep its ID and are deduplicated by SQS
+                entry["MessageGroupId"] = group_id
+                entry["MessageDeduplicationId"] = uuid.uuid4().hex
+            entries[entry["Id"]] = entry
+
+        if self.fifo:
+            for wave in self._waves(batch):
+                self._send_entries(entries, {i: batch[i] for i in wave})
+        else:
+            self._send_entries(entries, dict(enumerate(batch)))
+
+    @staticmethod
+    def _waves(batch: List[Tuple[str, float, Optional[str]]]) -> List[List[int]]:
+        """Batch positions split into calls: the n-th envelope of every group goes in call n."""
+        waves, seen = [], {}
+        for i, (_, _, group_id) in enumerate(batch):
+            n = seen.get(group_id, 0)
+            seen[group_id] = n + 1
+            if n == len(waves):
+                waves.append([])
+            waves[n].append(i)
+        return waves
+
+    def _send_entries(self, entries: dict, pending: dict):
+        delay = self.retry_backoff
+        for attempt in range(1, self.send_attempts + 1):
+            if attempt > 1:
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_BACKOFF)
+            try:
+                response = self.sqs.send_message_batch(
+                    QueueUrl=self.queue_url, Entries=[entries[str(i)] for i in pending]
+                )
+            except Exception as e:
+                logger.error(f"Send Batch Error (attempt {attempt}/{self.send_attempts}): {e}")
+                continue
+
+            now = time.monotonic()
+            retry, rejected = {}, 0
+            for failed in response.get('Failed', []):
+                i = int(failed['Id'])
+                if failed.get('SenderFault'):
+                    # Invalid entry - resending it cannot succeed
+                    logger.error(f"Send Rejected: {failed.get('Code')} - {failed.get('Message')}")
+                    rejected += 1
+                else:
+                    logger.warning(f"Send Failed, retrying: {failed.get('Code')} - {failed.get('Message')}")
+                    retry[i] = pending[i]
+                pending.pop(i)
+            for _, enqueued_at, _ in pending.values():
+                FORWARD_LATENCY.observe(now - enqueued_at)
+            FORWARDED.inc(len(pending))
+            if rejected:
+                DROPPED.inc(rejected, reason="rejected")
+            pending = retry
+            if not pending:
+                return
+
+        logger.error(f"Dropping {len(pending)} envelope(s) after {self.send_attempts} attempts")
+        DROPPED.inc(len(pending), reason="send_error")
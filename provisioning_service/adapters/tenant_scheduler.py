@@ -0,0 +1,230 @@
+import asyncio
+import threading
+import zlib
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, List, Optional
+from ..core.config import settings
+from ..core.metrics import registry
+from provisioning_service.core.logger import get_logger
+
+logger = get_logger("TenantScheduler")
+
+QUEUED = registry.gauge("tenant_messages_queued", "Received messages waiting for a worker lane", ["tenant"])
+ACTIVE = registry.gauge("tenant_messages_active", "Messages being handled", ["tenant"])
+
+MIN_WEIGHT = 0.01
+OTHER_TENANTS = "other"
+
+_labels = set()
+_labels_lock = threading.Lock()
+
+def tenant_label(tenant: str) -> str:
+    """
+    The `tenant` label for a metric. Tenants in TENANT_WEIGHTS always get their own; others
+    get one while fewer than TENANT_METRIC_LABEL_LIMIT are in use. Unnamed tenants and the
+    rest share "other", so arbitrary tenant IDs cannot grow the metric series without bound.
+    """
+    if tenant in settings.TENANT_WEIGHTS or tenant in _labels:
+        return tenant
+    if not tenant:
+        return OTHER_TENANTS
+    with _labels_lock:
+        if len(_labels) < settings.TENANT_METRIC_LABEL_LIMIT:
+            _labels.add(tenant)
+            return tenant
+    return OTHER_TENANTS
+
+class DeficitRoundRobin:
+    """
+    Per-tenant FIFOs served by weighted deficit round robin (every message costs 1).
+    A tenant with weight 3 is served three messages for every one of a weight-1
+    tenant while both have work queued; an idle tenant's credit is dropped, so
+    nobody can save up a burst. Not thread-safe - the caller holds a lock.
+
+    With `lanes` > 1 every tenant has one FIFO per lane and pop() serves one lane, but
+    the service order and the credit table are shared: a message served on any lane
+    spends the tenant's credit, so weights hold across the whole pool, not per lane.
+    """
+    def __init__(self, weights: Optional[Dict[str, float]] = None, default_weight: float = 1.0, lanes: int = 1):
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        self.lanes = max(1, lanes)
+        self._queues: Dict[str, List[Deque]] = {}
+        self._queued: Dict[str, int] = {}  # per tenant, over all lanes
+        self._deficit: Dict[str, float] = {}
+        self._active: Deque[str] = deque()  # tenants with queued work, in service order
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def push(self, tenant: str, item, lane: int = 0):
+        queues = self._queues.get(tenant)
+        if queues is None:
+            queues = self._queues[tenant] = [deque() for _ in range(self.lanes)]
+        if not self._queued.get(tenant):
+            self._active.append(tenant)
+            self._deficit[tenant] = 0.0
+            self._queued[tenant] = 0
+        queues[lane].append(item)
+        self._queued[tenant] += 1
+        self._size += 1
+
+    def pop(self, eligible: Callable[[str], bool] = lambda tenant: True, lane: int = 0):
+        """Next (tenant, item) for `lane` in fair order, skipping tenants `eligible` rejects; None if nothing can run."""
+        # Tenants without work on this lane keep their place. A topped-up tenant that still lacks
+        # a whole credit (weight < 1) yields its turn - every top-up adds credit, so this ends
+        i = 0
+        while i < len(self._active):
+            tenant = self._active[i]
+            q = self._queues[tenant][lane]
+            if not q or not eligible(tenant):
+                i += 1
+                continue
+            if self._deficit[tenant] < 1:
+                # New round for this tenant: top up its credit (weights < 1 need several rounds)
+                self._deficit[tenant] += max(self.weights.get(tenant, self.default_weight), MIN_WEIGHT)
+                if self._deficit[tenant] < 1:
+                    self._to_back(i)
+                    continue
+            self._deficit[tenant] -= 1
+            item = q.popleft()
+            self._queued[tenant] -= 1
+            self._size -= 1
+            if not self._queued[tenant]:
+                del self._active[i]
+                self._deficit[tenant] = 0.0
+            elif self._deficit[tenant] < 1:
+                self._to_back(i)
+            return tenant, item
+        return None
+
+    def _to_back(self, i: int):
+        self._active.rotate(-i)
+        self._active.append(self._active.popleft())
+        self._active.rotate(i)
+
+class FairWorkerPool:
+    """
+    Drop-in for OrderedWorkerPool that keeps per-key ordering (a key always maps to
+    the same lane, and a key belongs to one tenant) but lets each lane pick its next
+    message by tenant, from one DeficitRoundRobin shared by all lanes, instead of
+    strictly by arrival.
+    `max_per_tenant` caps how many lanes may work on one tenant at once (0 = no cap).
+    """
+    def __init__(self, concurrency: int, weights: Optional[Dict[str, float]] = None,
+                 max_per_tenant: int = 0, name: str = "sqs-lane"):
+        self.max_per_tenant = max_per_tenant
+        self._lock = threading.Lock()
+        self._active: Dict[str, int] = {}
+        self.queue = DeficitRoundRobin(weights, lanes=concurrency)
+        self._wakeups = [threading.Condition(self._lock) for _ in range(self.queue.lanes)]
+        self.threads = []
+        for i in range(self.queue.lanes):
+            t = threading.Thread(target=self._run_lane, args=(i,), name=f"{name}-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, key: str, fn, *args, tenant: str = ""):
+        index = zlib.crc32(key.encode()) % self.queue.lanes
+        QUEUED.inc(tenant=tenant_label(tenant))
+        with self._lock:
+            self.queue.push(tenant, (fn, args), index)
+            self._wakeups[index].notify()
+
+    def _eligible(self, tenant: str) -> bool:
+        return not self.max_per_tenant or self._active.get(tenant, 0) < self.max_per_tenant
+
+    def drain_pending(self) -> list:
+        """Removes and returns the (fn, args) items no lane has started yet (used when shutting down)."""
+        items = []
+        with self._lock:
+            for index in range(self.queue.lanes):
+                picked = self.queue.pop(lane=index)
+                while picked is not None:
+                    tenant, item = picked
+                    QUEUED.dec(tenant=tenant_label(tenant))
+                    items.append(item)
+                    picked = self.queue.pop(lane=index)
+        return items
+
+    def _run_lane(self, index: int):
+        wakeup = self._wakeups[index]
+        while True:
+            with self._lock:
+                picked = self.queue.pop(self._eligible, index)
+                while picked is None:
+                    wakeup.wait()
+                    picked = self.queue.pop(self._eligible, index)
+                tenant, (fn, args) = picked
+                self._active[tenant] = self._active.get(tenant, 0) + 1
+            label = tenant_label(tenant)
+            QUEUED.dec(tenant=label)
+            ACTIVE.inc(tenant=label)
+            try:
+                fn(*args)
+            except Exception as e:
+                logger.error(f"Lane Error: {e}")
+            finally:
+                ACTIVE.dec(tenant=label)
+                with self._lock:
+                    self._active[tenant] -= 1
+                    if self.max_per_tenant:
+                        # Any lane may be holding back this tenant's next message
+                        for other in self._wakeups:
+                            other.notify()
+
+class AsyncFairGate:
+    """
+    asyncio counterpart of FairWorkerPool for AsyncSQSConsumer: at most `concurrency`
+    handlers hold a slot at once, and waiting handlers are admitted by tenant with one
+    DeficitRoundRobin. `max_per_tenant` caps the slots one tenant may hold (0 = no cap).
+    Runs on the event loop only.
+    """
+    def __init__(self, concurrency: int, weights: Optional[Dict[str, float]] = None, max_per_tenant: int = 0):
+        self.concurrency = max(1, concurrency)
+        self.max_per_tenant = max_per_tenant
+        self._waiting = DeficitRoundRobin(weights)
+        self._active: Dict[str, int] = {}
+        self._running = 0
+
+    def _eligible(self, tenant: str) -> bool:
+        return not self.max_per_tenant or self._active.get(tenant, 0) < self.max_per_tenant
+
+    @asynccontextmanager
+    async def slot(self, tenant: str):
+        admitted = asyncio.get_running_loop().create_future()
+        QUEUED.inc(tenant=tenant_label(tenant))
+        self._waiting.push(tenant, admitted)
+        self._admit()
+        try:
+            await admitted
+        except asyncio.CancelledError:
+            if admitted.done() and not admitted.cancelled():
+                self._release(tenant)  # admitted in the same loop turn the waiter was cancelled
+            raise
+        try:
+            yield
+        finally:
+            self._release(tenant)
+
+    def _admit(self):
+        while self._running < self.concurrency:
+            picked = self._waiting.pop(self._eligible)
+            if picked is None:
+                return
+            tenant, admitted = picked
+            QUEUED.dec(tenant=tenant_label(tenant))
+            if admitted.cancelled():
+                continue
+            self._running += 1
+            self._active[tenant] = self._active.get(tenant, 0) + 1
+            ACTIVE.inc(tenant=tenant_label(tenant))
+            admitted.set_result(None)
+
+    def _release(self, tenant: str):
+        self._running -= 1
+        self._active[tenant] -= 1
+        ACTIVE.dec(tenant=tenant_label(tenant))
+        self._admit()
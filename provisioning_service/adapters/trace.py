@@ -0,0 +1,67 @@
+import gzip
+import json
+import threading
+import time
+import zlib
+from typing import Iterator, Tuple
+from ..core.metrics import registry
+from provisioning_service.core.logger import get_logger
+
+logger = get_logger("Trace")
+
+# Trace file: gzip'd JSON lines. A header, then one [offset_ms, envelope] per envelope
+# (offset from the start of the recording), in the order the bridge forwarded them.
+#
+#   {"format": "sqs-envelope-trace", "version": 1, "started_at": 1760000000.0}
+#   [0.0, {"type": "BOOTSTRAP", "tenant_id": "tenant-cp", "payload": {...}}]
+#   [12.5, {"type": "UPDATE_TRIGGER", ...}]
+TRACE_FORMAT = "sqs-envelope-trace"
+TRACE_VERSION = 1
+FLUSH_INTERVAL_SECONDS = 1.0
+
+RECORDED = registry.counter("bridge_trace_recorded_total", "Envelopes written to the trace file", ["type"])
+
+class TraceRecorder:
+    """
+    Appends every envelope to a trace file as it is offered to SQS (so the trace is the
+    incoming load, including envelopes the forwarder may later drop). The gzip stream is
+    sync-flushed about once a second, so a killed bridge leaves a readable trace.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._last_flush = self._started
+        self._file.write(json.dumps({"format": TRACE_FORMAT, "version": TRACE_VERSION, "started_at": time.time()}) + "\n")
+        logger.info(f"Recording envelopes to {path}")
+
+    def record(self, envelope: dict):
+        now = time.monotonic()
+        line = json.dumps([round((now - self._started) * 1000, 3), envelope], separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            if now - self._last_flush >= FLUSH_INTERVAL_SECONDS:
+                self._file.flush()
+                self._file.buffer.flush(zlib.Z_SYNC_FLUSH)
+                self._last_flush = now
+        RECORDED.inc(type=envelope.get("type", "UNKNOWN"))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def read_trace(path: str) -> Iterator[Tuple[float, dict]]:
+    """Yields (offset_seconds, envelope). A trace cut short by a crash ends at its last complete line."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("format") != TRACE_FORMAT or header.get("version") != TRACE_VERSION:
+            raise ValueError(f"{path} is not a version {TRACE_VERSION} envelope trace")
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                offset_ms, envelope = json.loads(line)
+                yield offset_ms / 1000, envelope
+        except EOFError:
+            logger.warning(f"{path} is truncated - replaying up to the last complete envelope")
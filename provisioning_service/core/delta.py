@@ -0,0 +1,47 @@
+import difflib
+import hashlib
+import json
+import zlib
+from typing import List
+
+# Segment policies are ordered lists of rule lines. A delta is a compact list of
+# operations that rebuilds the target from the base:
+#   ["c", start, end]  -> copy base[start:end]
+#   ["i", [lines...]]  -> insert new lines
+# serialized as JSON and zlib-compressed.
+
+def encode_policy(lines: List[str]) -> bytes:
+    """Canonical (uncompressed) bytes of a policy - what the sha256 is computed over."""
+    return json.dumps(lines, separators=(",", ":")).encode()
+
+def decode_policy(data: bytes) -> List[str]:
+    return json.loads(data)
+
+def policy_digest(lines: List[str]) -> str:
+    return hashlib.sha256(encode_policy(lines)).hexdigest()
+
+def compress_policy(lines: List[str]) -> bytes:
+    return zlib.compress(encode_policy(lines), 6)
+
+def decompress_policy(blob: bytes) -> List[str]:
+    return decode_policy(zlib.decompress(blob))
+
+def make_delta(base: List[str], target: List[str]) -> bytes:
+    ops = []
+    matcher = difflib.SequenceMatcher(a=base, b=target, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["c", i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append(["i", target[j1:j2]])
+        # "delete": nothing to emit - the lines are simply not copied
+    return zlib.compress(json.dumps(ops, separators=(",", ":")).encode(), 9)
+
+def apply_delta(base: List[str], delta: bytes) -> List[str]:
+    result = []
+    for op in json.loads(zlib.decompress(delta)):
+        if op[0] == "c":
+            result.extend(base[op[1]:op[2]])
+        else:
+            result.extend(op[1])
+    return result
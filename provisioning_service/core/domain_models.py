@@ -1,5 +1,9 @@
-from typing import List, Dict, Optional, Literal, Union
-from pydantic import BaseModel, Field
+from typing import Annotated, List, Dict, Optional, Literal, Union
+from pydantic import BaseModel, Field, TypeAdapter
+
+# Tenant and segment IDs name directories of the artifact store and path segments of its URLs
+SAFE_ID_PATTERN = r"^[A-Za-z0-9_-]+$"
+SafeId = Annotated[str, Field(pattern=SAFE_ID_PATTERN)]
 
 # --- Sub-Models ---
 class UserContext(BaseModel):
@@ -13,16 +17,51 @@ class BootstrapPayload(BaseModel):
     request_id: str
     agent_id: str
     context: UserContext
+    accept_encodings: List[str] = ["json"]  # agent's preference order, see core/wire.py
+
+class ResyncPayload(BaseModel):
+    request_id: str
+    agent_id: str
+    segment_versions: Dict[str, int]  # last applied version per cached segment
+    encoding: str = "json"  # encoding negotiated at bootstrap
 
 class UpdateTriggerPayload(BaseModel):
-    segment_id: str
+    segment_id: SafeId
     reason: str = "SIMULATED_ADMIN_ACTION"
+    policy_rules: Optional[List[str]] = None  # None = simulated edit of the previous version
 
 # --- The Envelope (Polymorphic) ---
 class SQSMessage(BaseModel):
-    type: Literal["BOOTSTRAP", "UPDATE_TRIGGER"]
-    tenant_id: str
-    payload: Union[BootstrapPayload, UpdateTriggerPayload]
+    type: Literal["BOOTSTRAP", "UPDATE_TRIGGER", "RESYNC"]
+    tenant_id: SafeId
+    payload: Union[BootstrapPayload, ResyncPayload, UpdateTriggerPayload]
+
+# One envelope class per type, so validation picks the payload model from "type"
+# instead of trying each member of the union in turn
+class BootstrapMessage(SQSMessage):
+    type: Literal["BOOTSTRAP"]
+    payload: BootstrapPayload
+
+class UpdateTriggerMessage(SQSMessage):
+    type: Literal["UPDATE_TRIGGER"]
+    payload: UpdateTriggerPayload
+
+class ResyncMessage(SQSMessage):
+    type: Literal["RESYNC"]
+    payload: ResyncPayload
+
+# Built once at import: validate_json parses the raw SQS body straight into the model
+SQS_ENVELOPE = TypeAdapter(Annotated[
+    Union[BootstrapMessage, UpdateTriggerMessage, ResyncMessage], Field(discriminator="type")
+])
+
+# --- Segment Artifacts ---
+class SegmentArtifact(BaseModel):
+    version: int
+    sha256: str
+    full_url: str
+    delta_url_template: str  # "{base}" is replaced by one of delta_bases
+    delta_bases: List[int]
 
 # --- Response Model (MQTT) ---
 class PolicyResponse(BaseModel):
@@ -30,4 +69,15 @@ class PolicyResponse(BaseModel):
     assigned_segments: List[str]
     segment_topics: List[str]
     segment_versions: Dict[str, int]
-    download_url: str
\ No newline at end of file
+    # Current version of each segment: sha256 of its policy, fetched from the URL template with
+    # "{sha256}" filled in (agents holding that content already skip the download)
+    segment_hashes: Dict[str, str] = {}
+    artifact_url_template: Optional[str] = None
+    encoding: str = "json"  # negotiated wire encoding for this agent
+    reason: str = "BOOTSTRAP"  # or "REASSIGNMENT" after a rule change
+
+class ResyncResponse(BaseModel):
+    type: str = "RESYNC_RESPONSE"
+    status: str
+    stale_segments: Dict[str, int]  # segment -> current version (only those behind)
+    updates: List[dict]  # one SEGMENT_UPDATE notification per stale segment
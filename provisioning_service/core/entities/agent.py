@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, Optional
 import time
 from pydantic import Field
 from .base import BaseEntity
@@ -7,5 +7,9 @@ class AgentStateEntity(BaseEntity):
     agent_id: str
     tenant_id: str
     assigned_segments: List[str]
+    # Inputs of the assignment - kept so rule changes can re-evaluate stored agents
+    groups: Optional[List[str]] = None
+    location: Optional[str] = None
+    encoding: str = "json"  # negotiated wire encoding for private updates
     last_seen: float = Field(default_factory=time.time)
     status: str = "ONLINE"
\ No newline at end of file
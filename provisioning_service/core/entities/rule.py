@@ -1,5 +1,8 @@
+from typing import Optional
 from .base import BaseEntity
 
 class SegmentRuleEntity(BaseEntity):
     required_group: str
-    target_segment: str
\ No newline at end of file
+    target_segment: str
+    required_location: Optional[str] = None  # also require the agent's location
+    tenant_id: Optional[str] = None  # None = applies to every tenant
\ No newline at end of file
@@ -0,0 +1,150 @@
+import hashlib
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Segment rules compiled into bitsets.
+#
+# Every attribute a rule can require ("group:<name>", "location:<name>") gets a bit,
+# and every target segment gets a bit. An agent is reduced to an attribute mask, and
+# evaluation ORs together the segment bitsets of the rules whose required attributes
+# are all present in that mask:
+#
+#   simple rules   (one attribute)  -> attr bit -> segment bitset        (one dict lookup)
+#   compound rules (group+location) -> first attr bit -> [(mask, segment bitset)]
+#
+# Results are memoized per (tenant, mask): a fleet shares a handful of group/location
+# combinations, so re-evaluating every stored agent costs one evaluation per distinct
+# combination rather than one per agent.
+
+def _rule_attributes(doc: dict) -> List[str]:
+    attrs = [f"group:{doc['required_group']}"]
+    if doc.get("required_location"):
+        attrs.append(f"location:{doc['required_location']}")
+    return attrs
+
+def agent_attributes(groups: Iterable[str], location: Optional[str] = None) -> List[str]:
+    attrs = [f"group:{g}" for g in groups]
+    if location:
+        attrs.append(f"location:{location}")
+    return attrs
+
+MEMO_MAX_ENTRIES = 100_000
+
+class CompiledPolicy:
+    """Immutable snapshot of the rules. Rules without a tenant_id apply to every tenant."""
+    def __init__(self, docs):
+        self.attr_bits: Dict[str, int] = {}
+        self.segments: List[str] = []
+        self._seg_bits: Dict[str, int] = {}
+        seg_bits = self._seg_bits
+        self._simple: Dict[Optional[str], Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self._compound: Dict[Optional[str], Dict[int, List[Tuple[int, int]]]] = defaultdict(lambda: defaultdict(list))
+        self._memo: Dict[Tuple[Optional[str], int], int] = {}
+        self._results: Dict[tuple, List[str]] = {}
+
+        keys = []
+        for doc in docs:
+            segment = doc["target_segment"]
+            if segment not in seg_bits:
+                seg_bits[segment] = 1 << len(self.segments)
+                self.segments.append(segment)
+            bits = [self.attr_bits.setdefault(a, len(self.attr_bits)) for a in _rule_attributes(doc)]
+            tenant = doc.get("tenant_id")
+            if len(bits) == 1:
+                self._simple[tenant][bits[0]] |= seg_bits[segment]
+            else:
+                mask = sum(1 << b for b in bits)
+                self._compound[tenant][bits[0]].append((mask, seg_bits[segment]))
+            keys.append((tenant or "", *_rule_attributes(doc), segment))
+
+        # Identifies the rule set - reloads that change nothing skip re-evaluation
+        self.fingerprint = hashlib.sha1(repr(sorted(keys)).encode()).hexdigest()
+        self.loaded_at = time.monotonic()
+
+    # --- Evaluation ---
+    def attributes_mask(self, groups: Iterable[str], location: Optional[str] = None) -> int:
+        """Attributes no rule refers to are dropped, so they don't split the memo."""
+        mask = 0
+        for attr in agent_attributes(groups, location):
+            bit = self.attr_bits.get(attr)
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def evaluate_mask(self, tenant_id: Optional[str], mask: int) -> int:
+        key = (tenant_id, mask)
+        result = self._memo.get(key)
+        if result is None:
+            result = 0
+            for scope in (None, tenant_id) if tenant_id is not None else (None,):
+                simple = self._simple.get(scope, {})
+                compound = self._compound.get(scope, {})
+                remaining = mask
+                while remaining:
+                    low = remaining & -remaining
+                    bit = low.bit_length() - 1
+                    result |= simple.get(bit, 0)
+                    for rule_mask, seg_bits in compound.get(bit, ()):
+                        if rule_mask & mask == rule_mask:
+                            result |= seg_bits
+                    remaining ^= low
+            if len(self._memo) >= MEMO_MAX_ENTRIES:
+                self._memo.clear()
+            self._memo[key] = result
+        return result
+
+    def encode(self, segments: Iterable[str]) -> int:
+        """Segment list -> bitset; -1 if a segment is no longer targeted by any rule."""
+        seg_bits = 0
+        for segment in segments:
+            bit = self._seg_bits.get(segment)
+            if bit is None:
+                return -1
+            seg_bits |= bit
+        return seg_bits
+
+    def decode(self, seg_bits: int) -> List[str]:
+        segments = []
+        while seg_bits:
+            low = seg_bits & -seg_bits
+            segments.append(self.segments[low.bit_length() - 1])
+            seg_bits ^= low
+        return segments
+
+    def evaluate(self, tenant_id: str, groups: List[str], location: Optional[str] = None) -> List[str]:
+        key = (tenant_id, tuple(groups), location)
+        result = self._results.get(key)
+        if result is None:
+            result = self.decode(self.evaluate_mask(tenant_id, self.attributes_mask(groups, location)))
+            if len(self._results) >= MEMO_MAX_ENTRIES:
+                self._results.clear()
+            self._results[key] = result
+        return list(result)
+
+def plan_reassignments(policy: CompiledPolicy, agents: Iterable[dict]) -> List[Tuple[dict, List[str]]]:
+    """
+    Bulk re-evaluation: returns (agent doc, new segments) for every agent whose
+    assignment differs from its stored `assigned_segments`. Agents stored without
+    their groups (written before groups were persisted) are skipped.
+    """
+    changes = []
+    verdicts: Dict[tuple, Optional[List[str]]] = {}  # agents with identical inputs share one verdict
+    for agent in agents:
+        groups = agent.get("groups")
+        if groups is None:
+            continue
+        key = (agent.get("tenant_id"), tuple(groups), agent.get("location"), tuple(agent.get("assigned_segments") or ()))
+        if key not in verdicts:
+            new_bits = policy.evaluate_mask(key[0], policy.attributes_mask(groups, key[2]))
+            verdicts[key] = None if policy.encode(key[3]) == new_bits else policy.decode(new_bits)
+        if verdicts[key] is not None:
+            changes.append((agent, verdicts[key]))
+    return changes
+
+def segments_by_tenant(changes: List[Tuple[dict, List[str]]]) -> Dict[str, List[str]]:
+    """Distinct segments per tenant across `plan_reassignments` output (version lookups are tenant-scoped)."""
+    segments: Dict[str, set] = {}
+    for agent, assigned in changes:
+        segments.setdefault(agent["tenant_id"], set()).update(assigned)
+    return {tenant: list(segs) for tenant, segs in segments.items()}
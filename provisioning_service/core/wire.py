@@ -0,0 +1,145 @@
+import json
+from typing import Any, Dict, List, Optional, Union
+import msgpack
+from pydantic import BaseModel
+
+# Wire encodings for MQTT control messages.
+#
+#   "json"       - default, human readable (first byte is "{").
+#   "msgpack-v1" - opt-in compact encoding: 0xC1 marker + schema version byte, then a
+#                  MessagePack body. 0xC1 is never used by MessagePack or JSON, so a
+#                  receiver can always tell the two apart from the first byte.
+#
+# Known message kinds are packed as positional arrays instead of maps, and values
+# implied by the topic are dropped: segment IDs appear once per message (versions
+# are aligned by position), segment topics are rebuilt from the tenant, and a
+# SEGMENT_UPDATE does not repeat the segment its topic already names.
+# Segment IDs are not interned across messages: each is already written once per
+# message, and a shared table would have to be synced to every agent and rebuilt on
+# rule changes, for a few bytes per ID.
+
+ENCODING_JSON = "json"
+ENCODING_COMPACT = "msgpack-v1"
+SUPPORTED_ENCODINGS = (ENCODING_COMPACT, ENCODING_JSON)
+
+MAGIC = 0xC1
+SCHEMA_VERSION = 1
+
+KIND_MAP = 0
+KIND_POLICY_RESPONSE = 1
+KIND_SEGMENT_UPDATE = 2
+_BODY_LENGTHS = {KIND_MAP: 2, KIND_POLICY_RESPONSE: 5, KIND_SEGMENT_UPDATE: 6}
+
+COMPACT_TOPIC_SUFFIX = "/c"
+
+class WireFormatError(ValueError):
+    pass
+
+# --- MessagePack (C extension of the msgpack package) ---
+def packb(obj: Any) -> bytes:
+    try:
+        return msgpack.packb(obj, use_bin_type=True)
+    except (TypeError, ValueError, OverflowError) as e:
+        raise WireFormatError(f"Cannot encode: {e}") from e
+
+def unpackb(data: bytes) -> Any:
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except msgpack.ExtraData as e:
+        raise WireFormatError("Trailing bytes after MessagePack body") from e
+    except (ValueError, TypeError) as e:
+        # Truncated / malformed body, invalid UTF-8, non-string map keys
+        raise WireFormatError(f"Malformed MessagePack body ({e})") from e
+
+# --- Negotiation ---
+def negotiate_encoding(accepted: Optional[List[str]], compact_enabled: bool) -> str:
+    """Picks the first encoding the agent accepts that the service offers."""
+    for encoding in accepted or ():
+        if encoding == ENCODING_COMPACT and compact_enabled:
+            return ENCODING_COMPACT
+        if encoding == ENCODING_JSON:
+            return ENCODING_JSON
+    return ENCODING_JSON
+
+def segment_topic(tenant_id: str, segment_id: str, encoding: str = ENCODING_JSON) -> str:
+    topic = f"sase/{tenant_id}/segment/{segment_id}"
+    return topic + COMPACT_TOPIC_SUFFIX if encoding == ENCODING_COMPACT else topic
+
+# Agent heartbeats and last-will messages (always JSON: {"status": ..., "session": ...})
+PRESENCE_TOPIC_FILTER = "sase/+/presence/+"
+
+def presence_topic(tenant_id: str, agent_id: str) -> str:
+    return f"sase/{tenant_id}/presence/{agent_id}"
+
+# --- Messages ---
+def _compact_body(payload: Dict) -> list:
+    if {"assigned_segments", "segment_versions", "status"} <= payload.keys():
+        segments = payload["assigned_segments"]
+        versions = payload["segment_versions"]
+        extra = {k: v for k, v in payload.items()
+                 if k not in ("status", "assigned_segments", "segment_topics", "segment_versions")}
+        # nil = no version known (JSON leaves the key out)
+        return [KIND_POLICY_RESPONSE, payload["status"], segments,
+                [versions.get(seg) for seg in segments], extra]
+    if payload.get("type") == "SEGMENT_UPDATE" and "sha256" in payload:
+        return [KIND_SEGMENT_UPDATE, payload["version"], bytes.fromhex(payload["sha256"]),
+                payload["full_url"], payload["delta_url"], payload["delta_bases"]]
+    return [KIND_MAP, payload]
+
+def encode_message(payload: Union[Dict, BaseModel], encoding: str = ENCODING_JSON) -> bytes:
+    """Models are serialized directly (model_dump_json) - no intermediate dict for JSON."""
+    if encoding == ENCODING_JSON:
+        if isinstance(payload, BaseModel):
+            return payload.model_dump_json().encode()
+        return json.dumps(payload).encode()
+    if encoding == ENCODING_COMPACT:
+        if isinstance(payload, BaseModel):
+            payload = payload.model_dump()
+        return bytes((MAGIC, SCHEMA_VERSION)) + packb(_compact_body(payload))
+    raise WireFormatError(f"Unknown encoding '{encoding}'")
+
+def decode_message(data: bytes, topic: str = "") -> Dict:
+    """Decodes either encoding. `topic` restores the values the compact form leaves out."""
+    if not data or data[0] != MAGIC:
+        return json.loads(data)
+    if len(data) < 2 or data[1] != SCHEMA_VERSION:
+        raise WireFormatError(f"Unsupported schema version {data[1] if len(data) > 1 else None}")
+
+    body = unpackb(data[2:])
+    if not isinstance(body, list) or not body:
+        raise WireFormatError("Compact body is not a message array")
+    kind = body[0]
+    if not isinstance(kind, int) or kind not in _BODY_LENGTHS:
+        raise WireFormatError(f"Unknown message kind {kind!r}")
+    if len(body) != _BODY_LENGTHS[kind]:
+        raise WireFormatError(f"Message kind {kind} has {len(body)} fields, expected {_BODY_LENGTHS[kind]}")
+    parts = topic.split("/")
+    if kind == KIND_POLICY_RESPONSE:
+        _, status, segments, versions, extra = body
+        if not (isinstance(segments, list) and isinstance(versions, list) and isinstance(extra, dict)
+                and len(segments) == len(versions) and all(isinstance(seg, str) for seg in segments)):
+            raise WireFormatError("Malformed policy response")
+        tenant_id = parts[1] if len(parts) > 1 else ""
+        return {
+            "status": status,
+            "assigned_segments": segments,
+            "segment_topics": [segment_topic(tenant_id, seg, ENCODING_COMPACT) for seg in segments],
+            "segment_versions": {seg: ver for seg, ver in zip(segments, versions) if ver is not None},
+            **extra,
+        }
+    if kind == KIND_SEGMENT_UPDATE:
+        _, version, digest, full_url, delta_url, delta_bases = body
+        if not isinstance(digest, bytes):
+            raise WireFormatError("Malformed segment update")
+        return {
+            "type": "SEGMENT_UPDATE",
+            "segment": parts[3] if len(parts) > 3 else "",
+            "version": version,
+            "sha256": digest.hex(),
+            "full_url": full_url,
+            "delta_url": delta_url,
+            "delta_bases": delta_bases,
+        }
+    if not isinstance(body[1], dict):
+        raise WireFormatError("Malformed map message")
+    return body[1]
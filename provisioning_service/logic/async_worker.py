@@ -0,0 +1,212 @@
+import asyncio
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import List, Optional
+from ..core.config import settings
+from ..core.domain_models import SQSMessage, BootstrapPayload, UpdateTriggerPayload, ResyncPayload, PolicyResponse
+from ..core.wire import negotiate_encoding
+from provisioning_service.core.logger import get_logger
+from ..core.policy_engine import plan_reassignments, segments_by_tenant
+from .update_coalescer import PendingUpdate
+from .worker import ProvisioningOrchestrator, STAGE_LATENCY, HANDLE_LATENCY, IN_FLIGHT, DUPLICATES
+
+logger = get_logger("AsyncOrchestrator")
+
+class AsyncProvisioningOrchestrator(ProvisioningOrchestrator):
+    """
+    asyncio variant of ProvisioningOrchestrator for the async repositories/publisher.
+    Segment resolution, entity/response building and coalescing are inherited;
+    only the I/O sequencing is awaited here.
+    """
+    def __init__(self, agent_repo, rule_repo, seg_repo, publisher, artifact_store=None, dedup=None,
+                 reevaluate_rules: Optional[bool] = None):
+        super().__init__(agent_repo, rule_repo, seg_repo, publisher, artifact_store, dedup, reevaluate_rules)
+        self.loop = asyncio.get_running_loop()
+        self._reevaluation_lock = asyncio.Lock()
+        self._reevaluation_task: Optional[asyncio.Task] = None
+        # Artifact file I/O and delta computation - sized apart from the loop's default executor
+        self._blocking = ThreadPoolExecutor(max_workers=max(settings.ASYNC_BLOCKING_THREADS, 1),
+                                            thread_name_prefix="async-blocking")
+
+    def _create_reevaluator(self) -> None:
+        # Passes run as tasks on the event loop, one at a time under _reevaluation_lock
+        return None
+
+    def _run_blocking(self, fn, *args):
+        return self.loop.run_in_executor(self._blocking, partial(fn, *args))
+
+    async def handle_message(self, msg: SQSMessage):
+        outcome = "error"
+        start = time.perf_counter()
+        try:
+            with IN_FLIGHT.track_inprogress(type=msg.type):
+                result = await self._route(msg)
+            outcome = "ok"
+            return result
+        finally:
+            HANDLE_LATENCY.observe(time.perf_counter() - start, type=msg.type, outcome=outcome)
+
+    async def _route(self, msg: SQSMessage):
+        if msg.type == "BOOTSTRAP":
+            await self.handle_bootstrap(msg.tenant_id, msg.payload)
+        elif msg.type == "UPDATE_TRIGGER":
+            return await self.handle_update_trigger(msg.tenant_id, msg.payload)
+        elif msg.type == "RESYNC":
+            await self.handle_resync(msg.tenant_id, msg.payload)
+
+    async def handle_bootstrap(self, tenant_id: str, payload: BootstrapPayload):
+        logger.info(f"Processing Bootstrap for {payload.agent_id}")
+
+        # 0. Duplicate? Replay the earlier response
+        key = self._dedup_key(tenant_id, payload)
+        if key:
+            with STAGE_LATENCY.time(type="BOOTSTRAP", stage="dedup"):
+                cached = await self.dedup.get(key)
+            if cached is not None:
+                with STAGE_LATENCY.time(type="BOOTSTRAP", stage="publish"):
+                    resp = PolicyResponse.model_validate(cached)
+                    await self.publisher.send_private_response(payload.agent_id, tenant_id, resp, resp.encoding)
+                DUPLICATES.inc(type="BOOTSTRAP")
+                logger.info(f"Replayed Bootstrap Response for duplicate request {payload.request_id}")
+                return
+
+        # 1. Logic
+        with STAGE_LATENCY.time(type="BOOTSTRAP", stage="resolve"):
+            assigned_segments = await self.rule_repo.get_segments_for_groups(
+                tenant_id, payload.context.groups, payload.context.location
+            )
+
+        # 2. Persist + 3. Fetch Versions (concurrently)
+        with STAGE_LATENCY.time(type="BOOTSTRAP", stage="persist_versions"):
+            _, versions = await asyncio.gather(
+                self.agent_repo.upsert_agent(self._agent_state(tenant_id, payload, assigned_segments)),
+                self.seg_repo.get_versions_map(tenant_id, assigned_segments)
+            )
+
+        # 4. Response
+        with STAGE_LATENCY.time(type="BOOTSTRAP", stage="artifact"):
+            artifacts = await self._run_blocking(self._segment_artifacts, tenant_id, versions) if self.artifact_store else {}
+        with STAGE_LATENCY.time(type="BOOTSTRAP", stage="publish"):
+            resp = self._policy_response(tenant_id, assigned_segments, versions, payload.accept_encodings,
+                                         artifacts=artifacts)
+            if key:
+                await self.dedup.put(key, resp.model_dump())
+            await self.publisher.send_private_response(payload.agent_id, tenant_id, resp, resp.encoding)
+        logger.info("Sent Bootstrap Response")
+
+    async def handle_resync(self, tenant_id: str, payload: ResyncPayload):
+        logger.info(f"Processing Resync for {payload.agent_id} ({len(payload.segment_versions)} segments)")
+
+        with STAGE_LATENCY.time(type="RESYNC", stage="versions"):
+            versions = await self.seg_repo.get_versions_map(tenant_id, list(payload.segment_versions))
+        stale = self._stale_segments(payload.segment_versions, versions)
+
+        artifacts = {}
+        if self.artifact_store and stale:
+            with STAGE_LATENCY.time(type="RESYNC", stage="artifact"):
+                artifacts = await self._run_blocking(
+                    lambda: {seg: self.artifact_store.describe(tenant_id, seg, ver) for seg, ver in stale.items()}
+                )
+        with STAGE_LATENCY.time(type="RESYNC", stage="publish"):
+            resp = self._resync_response(stale, artifacts)
+            encoding = negotiate_encoding([payload.encoding], settings.WIRE_COMPACT_ENABLED)
+            await self.publisher.send_private_response(payload.agent_id, tenant_id, resp, encoding)
+        logger.info(f"Sent Resync Response ({len(stale)} stale)")
+
+    async def reevaluate_assignments(self, policy=None) -> int:
+        async with self._reevaluation_lock:
+            policy = policy or await self.rule_repo.get_policy()
+            agents = await self.agent_repo.find_assignment_inputs()
+            with STAGE_LATENCY.time(type="REASSIGNMENT", stage="plan"):
+                changes = plan_reassignments(policy, agents)
+            if not changes:
+                logger.info("Rules changed - no agent assignments affected")
+                return 0
+
+            with STAGE_LATENCY.time(type="REASSIGNMENT", stage="versions"):
+                segments = segments_by_tenant(changes)
+                versions = dict(zip(segments, await asyncio.gather(*(
+                    self.seg_repo.get_versions_map(tenant, segs) for tenant, segs in segments.items()
+                ))))
+            with STAGE_LATENCY.time(type="REASSIGNMENT", stage="artifact"):
+                artifacts = await self._run_blocking(
+                    lambda: {tenant: self._segment_artifacts(tenant, tenant_versions)
+                             for tenant, tenant_versions in versions.items()}
+                )
+            with STAGE_LATENCY.time(type="REASSIGNMENT", stage="publish"):
+                results = await asyncio.gather(*(
+                    self.publisher.send_private_response(
+                        agent["agent_id"], agent["tenant_id"], resp, resp.encoding
+                    )
+                    for agent, resp in ((agent, self._reassignment_response(agent, segments, versions[agent["tenant_id"]],
+                                                                            artifacts[agent["tenant_id"]]))
+                                        for agent, segments in changes)
+                ), return_exceptions=True)
+            notified = []
+            for (agent, segments), result in zip(changes, results):
+                if isinstance(result, Exception):
+                    logger.warning(f"Reassignment of {agent['agent_id']} not delivered: {result}")
+                else:
+                    notified.append((agent, segments))
+
+            # Persist only what agents were told, so the rest still differ on the retry pass
+            if notified:
+                with STAGE_LATENCY.time(type="REASSIGNMENT", stage="persist"):
+                    await self.agent_repo.update_assignments(notified)
+            self._log_reassignment(len(notified), len(changes))
+            return len(notified)
+
+    def _on_rules_changed(self, old, new):
+        # Called on the event loop by AsyncRuleRepository.reload
+        self._schedule_reevaluation()
+
+    def _schedule_reevaluation(self, delay: float = 0):
+        if delay > 0:
+            self.loop.call_later(delay, self._schedule_reevaluation)
+        else:
+            self._reevaluation_task = self.loop.create_task(self._reevaluate_safely())
+
+    async def _reevaluate_safely(self):
+        try:
+            await self.reevaluate_assignments()
+        except Exception as e:
+            logger.error(f"Reassignment pass failed: {e} - retrying in {settings.RULE_REEVALUATION_RETRY_SECONDS:g}s")
+            self._schedule_reevaluation(settings.RULE_REEVALUATION_RETRY_SECONDS)
+
+    async def handle_update_trigger(self, tenant_id: str, payload: UpdateTriggerPayload) -> Optional[Future]:
+        logger.info(f"Processing Update Trigger for {payload.segment_id}")
+
+        if self.coalescer:
+            return self.coalescer.add(tenant_id, payload.segment_id, payload.policy_rules)
+
+        await self._publish_update(tenant_id, payload.segment_id, policy_rules=payload.policy_rules)
+
+    async def _publish_update(self, tenant_id: str, segment_id: str, trigger_count: int = 1,
+                              policy_rules: Optional[List[str]] = None, pending: Optional[PendingUpdate] = None):
+        if pending and pending.version is not None:
+            new_version = pending.version
+        else:
+            with STAGE_LATENCY.time(type="UPDATE_TRIGGER", stage="increment"):
+                new_version = await self.seg_repo.increment_version(tenant_id, segment_id)
+            if pending:
+                pending.version = new_version
+        artifact = None
+        if self.artifact_store:
+            # File I/O + delta computation - keep it off the event loop
+            with STAGE_LATENCY.time(type="UPDATE_TRIGGER", stage="artifact"):
+                artifact = await self._run_blocking(self._store_artifact, tenant_id, segment_id, new_version, policy_rules)
+        notify_payload = self._update_notification(segment_id, new_version, artifact)
+        with STAGE_LATENCY.time(type="UPDATE_TRIGGER", stage="publish"):
+            await self.publisher.broadcast_update(tenant_id, segment_id, notify_payload)
+        self._log_broadcast(segment_id, new_version, trigger_count)
+
+    def _flush_coalesced(self, tenant_id: str, segment_id: str, pending: PendingUpdate):
+        # Called from the coalescer thread - hop onto the event loop and wait for it
+        asyncio.run_coroutine_threadsafe(
+            self._publish_update(tenant_id, segment_id, pending.count, pending.policy_rules, pending), self.loop
+        ).result()
+
+    def close(self):
+        super().close()
+        self._blocking.shutdown(wait=True)
@@ -0,0 +1,128 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from ..core.metrics import registry
+from provisioning_service.core.logger import get_logger
+
+logger = get_logger("PresenceTracker")
+
+ONLINE = "ONLINE"
+OFFLINE = "OFFLINE"
+
+HEARTBEATS = registry.counter("presence_heartbeats_total", "Presence messages received", ["status"])
+AGENTS_ONLINE = registry.gauge("presence_agents_online", "Agents with a recent heartbeat")
+DIRTY = registry.gauge("presence_dirty_agents", "Agents whose presence awaits the next flush")
+WRITES = registry.counter("presence_writes_total", "Presence updates written to agents_state")
+FLUSH_LATENCY = registry.histogram("presence_flush_seconds", "Duration of presence flushes")
+
+class AgentPresence:
+    __slots__ = ("last_seen", "status", "session", "written_last_seen", "written_status")
+
+    def __init__(self, session: Optional[str]):
+        self.last_seen = 0.0
+        self.status = OFFLINE
+        self.session = session
+        self.written_last_seen = 0.0
+        self.written_status: Optional[str] = None
+
+class PresenceTracker:
+    """
+    Write-behind presence: heartbeats and last-will messages only update memory,
+    a flusher thread writes what changed every `flush_interval` seconds.
+
+    An agent is dirty when its status changed or its stored last_seen is older than
+    `resolution`. Agents silent for `timeout` seconds go OFFLINE (covers lost last
+    wills). A flush writes at most `max_writes` agents, status changes first.
+    """
+    def __init__(self, agent_repo, flush_interval: float, resolution: float, timeout: float,
+                 max_writes: int, clock=time.time):
+        self.agent_repo = agent_repo
+        self.flush_interval = flush_interval
+        self.resolution = resolution
+        self.timeout = timeout
+        self.max_writes = max(max_writes, 1)
+        self.clock = clock
+        self._agents: Dict[Tuple[str, str], AgentPresence] = {}  # (tenant_id, agent_id) -> presence
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "PresenceTracker":
+        self._thread = threading.Thread(target=self._run, name="presence-flusher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the flusher after writing everything still pending (used on shutdown)."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        while self.flush():
+            pass
+
+    def record(self, tenant_id: str, agent_id: str, status: str, session: Optional[str] = None):
+        HEARTBEATS.inc(status=status)
+        now = self.clock()
+        key = (tenant_id, agent_id)
+        with self._lock:
+            presence = self._agents.get(key)
+            if presence is None:
+                presence = self._agents[key] = AgentPresence(session)
+            if status == OFFLINE:
+                if session is not None and presence.session not in (None, session):
+                    return  # last will of a connection the agent has already replaced
+            else:
+                presence.session = session
+                presence.last_seen = now
+            presence.status = status
+            if status != presence.written_status or now - presence.written_last_seen >= self.resolution:
+                self._dirty.add(key)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # Nothing was marked written - the same agents are retried next interval
+                logger.error(f"Presence flush failed: {e}")
+
+    def _expire(self, now: float):
+        # Caller holds the lock
+        for key, presence in self._agents.items():
+            if presence.status == ONLINE and now - presence.last_seen >= self.timeout:
+                presence.status = OFFLINE
+                self._dirty.add(key)
+
+    def flush(self) -> int:
+        """Writes the dirty agents (up to max_writes). Returns how many were written."""
+        start = time.perf_counter()
+        with self._lock:
+            self._expire(self.clock())
+            changed = [key for key in self._dirty if self._agents[key].status != self._agents[key].written_status]
+            refreshed = [key for key in self._dirty if self._agents[key].status == self._agents[key].written_status]
+            picked = (changed + refreshed)[:self.max_writes]
+            batch = {key: (self._agents[key].last_seen, self._agents[key].status) for key in picked}
+            AGENTS_ONLINE.set(sum(1 for p in self._agents.values() if p.status == ONLINE))
+        if not batch:
+            DIRTY.set(len(self._dirty))
+            return 0
+
+        self.agent_repo.update_presence(batch)
+
+        with self._lock:
+            for key, (last_seen, status) in batch.items():
+                presence = self._agents.get(key)
+                if presence is None:
+                    continue
+                presence.written_last_seen, presence.written_status = last_seen, status
+                # Heartbeats that arrived during the write keep the agent dirty only if they would have anyway
+                if presence.status == status and presence.last_seen - last_seen < self.resolution:
+                    self._dirty.discard(key)
+                    if status == OFFLINE:
+                        del self._agents[key]  # written - memory only holds live agents
+            DIRTY.set(len(self._dirty))
+        WRITES.inc(len(batch))
+        FLUSH_LATENCY.observe(time.perf_counter() - start)
+        logger.debug(f"Flushed presence of {len(batch)} agents ({len(self._dirty)} still dirty)")
+        return len(batch)
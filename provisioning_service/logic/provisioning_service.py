@@ -1,4 +1,5 @@
 from typing import List, Dict
+from ..core.config import settings
 from ..core.entities import AgentStateEntity
 from ..core.domain_models import UserContext
 from ..adapters.repositories import AgentRepository, RuleRepository, SegmentStateRepository
@@ -17,27 +18,22 @@ class ProvisioningService:
         3. Fetch Versions (Repo Call)
         """
         
-        # 1. Business Logic: Determine assigned segments
-        assigned_segments = []
-        for group in context.groups:
-            rule = self.rule_repo.find_rule_for_group(group)
-            if rule:
-                assigned_segments.append(rule.target_segment)
-        
-        # Deduplicate
-        assigned_segments = list(set(assigned_segments))
+        # 1. Business Logic: Determine assigned segments (deduplicated)
+        assigned_segments = self.rule_repo.get_segments_for_groups(tenant_id, context.groups, context.location)
 
         # 2. Persistence Logic: Create Entity and Save
         agent_entity = AgentStateEntity(
             agent_id=agent_id,
             tenant_id=tenant_id,
             assigned_segments=assigned_segments,
+            groups=context.groups,
+            location=context.location,
             status="ONLINE"
         )
         self.agent_repo.upsert_agent(agent_entity)
 
         # 3. Enrichment Logic: Get current versions
-        versions_map = self.seg_repo.get_versions_map(assigned_segments)
+        versions_map = self.seg_repo.get_versions_map(tenant_id, assigned_segments)
         
         # Ensure every segment has a version (default to 0)
         for seg in assigned_segments:
@@ -49,7 +45,7 @@ class ProvisioningService:
             "versions": versions_map
         }
 
-    def pick_random_segment_update(self):
+    def pick_random_segment_update(self, tenant_id: str = settings.TENANT_ID):
         """Simulator Logic: Pick a segment and bump version"""
         import random
         all_segments = self.rule_repo.get_all_target_segments()
@@ -57,5 +53,5 @@ class ProvisioningService:
             return None, None
             
         target = random.choice(all_segments)
-        new_ver = self.seg_repo.increment_version(target)
+        new_ver = self.seg_repo.increment_version(tenant_id, target)
         return target, new_ver
\ No newline at end of file
@@ -0,0 +1,32 @@
+import random
+from typing import List, Optional
+
+ACTIONS = ["allow", "deny"]
+PROTOCOLS = ["tcp/443", "tcp/22", "tcp/3389", "udp/53", "tcp/5432", "tcp/8443"]
+
+def _random_rule(rng: random.Random, segment_id: str) -> str:
+    return (
+        f"{rng.choice(ACTIONS)} {rng.choice(PROTOCOLS)} {segment_id} -> "
+        f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.0/24"
+    )
+
+def simulate_policy(segment_id: str, version: int, base: Optional[List[str]], size: int) -> List[str]:
+    """
+    Simulator Logic: stands in for an admin editing a segment's policy.
+    A new segment gets `size` rules; every later version changes a handful of them.
+    Seeded by segment + version so every worker produces the same content.
+    """
+    rng = random.Random(f"{segment_id}:{version}")
+    if not base:
+        return [_random_rule(rng, segment_id) for _ in range(size)]
+
+    rules = list(base)
+    for _ in range(rng.randint(1, 3)):
+        op = rng.random()
+        if op < 0.6 and rules:
+            rules[rng.randrange(len(rules))] = _random_rule(rng, segment_id)
+        elif op < 0.8 and rules:
+            rules.pop(rng.randrange(len(rules)))
+        else:
+            rules.insert(rng.randint(0, len(rules)), _random_rule(rng, segment_id))
+    return rules
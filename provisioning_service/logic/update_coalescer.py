@@ -0,0 +1,103 @@
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+from provisioning_service.core.logger import get_logger
+
+logger = get_logger("UpdateCoalescer")
+
+class PendingUpdate:
+    def __init__(self, now: float, policy_rules: Optional[List[str]]):
+        self.first_seen = now
+        self.last_seen = now
+        self.count = 1
+        self.policy_rules = policy_rules
+        self.version: Optional[int] = None  # set by flush_fn once allocated - a retry reuses it
+        self.futures: List[Future] = []  # one per trigger, resolved once the update is published
+
+class UpdateCoalescer:
+    """
+    Debounces update triggers per (tenant, segment).
+    A pending update fires once no new trigger arrived for `window` seconds,
+    but never later than `max_delay` seconds after its first trigger.
+    flush_fn(tenant_id, segment_id, pending) records the version it allocates in pending.version.
+    add() returns a Future per trigger that resolves once an update including it was published -
+    callers hold the trigger's SQS message until then.
+    """
+    def __init__(self, window: float, max_delay: float, flush_fn: Callable[[str, str, PendingUpdate], None]):
+        self.window = window
+        self.max_delay = max(max_delay, window)
+        self.flush_fn = flush_fn
+        self._pending: Dict[Tuple[str, str], PendingUpdate] = {}
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="update-coalescer", daemon=True).start()
+
+    def add(self, tenant_id: str, segment_id: str, policy_rules: Optional[List[str]] = None) -> Future:
+        """The latest explicit policy in a burst wins."""
+        now = time.monotonic()
+        published = Future()
+        with self._cond:
+            pending = self._pending.get((tenant_id, segment_id))
+            if pending:
+                pending.last_seen = now
+                pending.count += 1
+                if policy_rules is not None:
+                    pending.policy_rules = policy_rules
+            else:
+                pending = self._pending[(tenant_id, segment_id)] = PendingUpdate(now, policy_rules)
+                self._cond.notify()
+            pending.futures.append(published)
+        return published
+
+    def _due_at(self, pending: PendingUpdate) -> float:
+        return min(pending.last_seen + self.window, pending.first_seen + self.max_delay)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                now = time.monotonic()
+                due = [key for key, p in self._pending.items() if self._due_at(p) <= now]
+                if not due:
+                    next_due = min(self._due_at(p) for p in self._pending.values())
+                    self._cond.wait(next_due - now)
+                    continue
+                ready = [(key, self._pending.pop(key)) for key in due]
+            for key, pending in ready:
+                self._fire(key, pending)
+
+    def flush_all(self):
+        """Fires every pending update immediately (used on shutdown)."""
+        with self._cond:
+            ready, self._pending = list(self._pending.items()), {}
+        for key, pending in ready:
+            self._fire(key, pending)
+
+    def _fire(self, key: Tuple[str, str], pending: PendingUpdate):
+        tenant_id, segment_id = key
+        try:
+            self.flush_fn(tenant_id, segment_id, pending)
+        except Exception as e:
+            # The triggers stay unacknowledged - retry here, SQS redelivers them if this process goes away
+            logger.error(f"Coalesced update for {segment_id} failed, retrying: {e}")
+            self._requeue(key, pending)
+            return
+        for published in pending.futures:
+            published.set_result(None)
+
+    def _requeue(self, key: Tuple[str, str], failed: PendingUpdate):
+        now = time.monotonic()
+        with self._cond:
+            pending = self._pending.get(key)
+            if pending is None:
+                failed.first_seen = failed.last_seen = now
+                self._pending[key] = failed
+                self._cond.notify()
+                return
+            # Newer triggers arrived meanwhile: their policy (if explicit) is the latest, and they
+            # get a version of their own - the failed one's is skipped, it was never broadcast
+            pending.count += failed.count
+            pending.futures.extend(failed.futures)
+            if pending.policy_rules is None:
+                pending.policy_rules = failed.policy_rules
@@ -1,69 +1,337 @@
-from ..core.domain_models import BootstrapPayload, UpdateTriggerPayload, PolicyResponse
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+from ..core.domain_models import (
+    SQSMessage, BootstrapPayload, UpdateTriggerPayload, ResyncPayload, PolicyResponse, ResyncResponse, SegmentArtifact
+)
 from ..core.entities import AgentStateEntity
-from ..adapters.repositories import AgentRepository, RuleRepository, SegmentStateRepository
+from ..adapters.repositories import AgentRepository, RuleRepository, SegmentStateRepository, request_key
 from ..adapters.mqtt_publisher import MqttPublisher
+from ..core.config import settings
+from ..core.metrics import registry
 from provisioning_service.core.logger import get_logger
+from .update_coalescer import UpdateCoalescer, PendingUpdate
+from .segment_policy import simulate_policy
+from ..core.wire import negotiate_encoding, segment_topic
+from ..core.policy_engine import CompiledPolicy, plan_reassignments, segments_by_tenant
 
 logger = get_logger("Orchestrator")
 
+# Per-stage latency: validate (main.decode_body), resolve, persist, versions, artifact, increment, publish, ...
+STAGE_LATENCY = registry.histogram("orchestrator_stage_seconds", "Duration of each handling stage", ["type", "stage"])
+HANDLE_LATENCY = registry.histogram("orchestrator_handle_seconds", "End-to-end handling time", ["type", "outcome"])
+IN_FLIGHT = registry.gauge("orchestrator_inflight", "Messages currently being handled", ["type"])
+DUPLICATES = registry.counter("orchestrator_duplicates_total", "Duplicate requests answered by replay", ["type"])
+
 class ProvisioningOrchestrator:
-    def __init__(self, agent_repo, rule_repo, seg_repo, publisher):
+    def __init__(self, agent_repo, rule_repo, seg_repo, publisher, artifact_store=None, dedup=None,
+                 reevaluate_rules: Optional[bool] = None):
         self.agent_repo = agent_repo
         self.rule_repo = rule_repo
         self.seg_repo = seg_repo
         self.publisher = publisher
+        self.artifact_store = artifact_store
+        self.dedup = dedup  # RequestDedupRepository, None = every request is processed
+
+        self.coalescer = None
+        if settings.UPDATE_COALESCE_WINDOW_MS > 0:
+            self.coalescer = UpdateCoalescer(
+                settings.UPDATE_COALESCE_WINDOW_MS / 1000,
+                settings.UPDATE_COALESCE_MAX_DELAY_MS / 1000,
+                self._flush_coalesced
+            )
+
+        self._reevaluator = None
+        if settings.RULE_REEVALUATION_ENABLED if reevaluate_rules is None else reevaluate_rules:
+            self._reevaluator = self._create_reevaluator()
+            rule_repo.add_listener(self._on_rules_changed)
+
+    def _create_reevaluator(self) -> Optional[ThreadPoolExecutor]:
+        # One pass at a time, off the watcher / request thread that noticed the change
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="reassign")
+
+    def handle_message(self, msg: SQSMessage):
+        """Routes a parsed envelope to its handler."""
+        outcome = "error"
+        start = time.perf_counter()
+        try:
+            with IN_FLIGHT.track_inprogress(type=msg.type):
+                result = self._route(msg)
+            outcome = "ok"
+            return result
+        finally:
+            HANDLE_LATENCY.observe(time.perf_counter() - start, type=msg.type, outcome=outcome)
+
+    def _route(self, msg: SQSMessage):
+        if msg.type == "BOOTSTRAP":
+            return self.handle_bootstrap(msg.tenant_id, msg.payload)
+        elif msg.type == "UPDATE_TRIGGER":
+            return self.handle_update_trigger(msg.tenant_id, msg.payload)
+        elif msg.type == "RESYNC":
+            return self.handle_resync(msg.tenant_id, msg.payload)
 
     def handle_bootstrap(self, tenant_id: str, payload: BootstrapPayload):
         logger.info(f"Processing Bootstrap for {payload.agent_id}")
 
-        # 1. Logic
-        # assigned_segments = ["seg-global"]
-        assigned_segments = []
-        for group in payload.context.groups:
-            rule = self.rule_repo.find_rule_for_group(group)
-            if rule:
-                assigned_segments.append(rule.target_segment)
+        # 0. Duplicate (redelivery / agent retry)? Replay the earlier response
+        key = self._dedup_key(tenant_id, payload)
+        if key:
+            with STAGE_LATENCY.time(type="BOOTSTRAP", stage="dedup"):
+                cached = self.dedup.get(key)
+            if cached is not None:
+                with STAGE_LATENCY.time(type="BOOTSTRAP", stage="publish"):
+                    resp = PolicyResponse.model_validate(cached)
+                    self.publisher.send_private_response(payload.agent_id, tenant_id, resp, resp.encoding)
+                DUPLICATES.inc(type="BOOTSTRAP")
+                logger.info(f"Replayed Bootstrap Response for duplicate request {payload.request_id}")
+                return
+
+        # 1. Logic (evaluated against the compiled rules)
+        with STAGE_LATENCY.time(type="BOOTSTRAP", stage="resolve"):
+            assigned_segments = self.rule_repo.get_segments_for_groups(
+                tenant_id, payload.context.groups, payload.context.location
+            )
+
+        # 2. Persist (may be batched with other agents' writes)
+        write = self.agent_repo.submit_upsert(self._agent_state(tenant_id, payload, assigned_segments))
+
+        # 3. Fetch Versions (overlaps with the pending write)
+        with STAGE_LATENCY.time(type="BOOTSTRAP", stage="versions"):
+            versions = self.seg_repo.get_versions_map(tenant_id, assigned_segments)
+
+        # Only answer once the agent's state is durable (time not hidden behind the version lookup)
+        with STAGE_LATENCY.time(type="BOOTSTRAP", stage="persist"):
+            write.result()
+
+        # 4. Response (+ per-version artifact URL and hash, so agents skip content they hold)
+        with STAGE_LATENCY.time(type="BOOTSTRAP", stage="artifact"):
+            artifacts = self._segment_artifacts(tenant_id, versions)
+        with STAGE_LATENCY.time(type="BOOTSTRAP", stage="publish"):
+            resp = self._policy_response(tenant_id, assigned_segments, versions, payload.accept_encodings,
+                                         artifacts=artifacts)
+            if key:
+                # Recorded once the state is durable - a failed publish is retried by replay
+                self.dedup.put(key, resp.model_dump())
+            self.publisher.send_private_response(payload.agent_id, tenant_id, resp, resp.encoding)
+        logger.info("Sent Bootstrap Response")
+
+    def handle_resync(self, tenant_id: str, payload: ResyncPayload):
+        """
+        Reconnecting agent with cached segments: answer with the ones it is behind on.
+        Assignments are not recomputed - one batched (cached) version lookup, no writes.
+        """
+        logger.info(f"Processing Resync for {payload.agent_id} ({len(payload.segment_versions)} segments)")
+
+        # 1. Current versions
+        with STAGE_LATENCY.time(type="RESYNC", stage="versions"):
+            versions = self.seg_repo.get_versions_map(tenant_id, list(payload.segment_versions))
+
+        # 2. Diff
+        stale = self._stale_segments(payload.segment_versions, versions)
+
+        # 3. Response (+ artifact descriptors so the agent can fetch deltas)
+        artifacts = {}
+        if self.artifact_store:
+            with STAGE_LATENCY.time(type="RESYNC", stage="artifact"):
+                artifacts = {seg: self.artifact_store.describe(tenant_id, seg, ver) for seg, ver in stale.items()}
+        with STAGE_LATENCY.time(type="RESYNC", stage="publish"):
+            resp = self._resync_response(stale, artifacts)
+            encoding = negotiate_encoding([payload.encoding], settings.WIRE_COMPACT_ENABLED)
+            self.publisher.send_private_response(payload.agent_id, tenant_id, resp, encoding)
+        logger.info(f"Sent Resync Response ({len(stale)} stale)")
+
+    def reevaluate_assignments(self, policy: Optional[CompiledPolicy] = None) -> int:
+        """
+        Re-evaluates every stored agent against the current rules and sends a private
+        PolicyResponse (reason REASSIGNMENT) only to the agents whose segments changed.
+        """
+        policy = policy or self.rule_repo.get_policy()
+
+        # 1. Diff (one evaluation per distinct tenant / groups / location combination)
+        with STAGE_LATENCY.time(type="REASSIGNMENT", stage="plan"):
+            changes = plan_reassignments(policy, self.agent_repo.find_assignment_inputs())
+        if not changes:
+            logger.info("Rules changed - no agent assignments affected")
+            return 0
+
+        # 2. Versions of every segment involved (one lookup per tenant)
+        with STAGE_LATENCY.time(type="REASSIGNMENT", stage="versions"):
+            versions = {tenant: self.seg_repo.get_versions_map(tenant, segments)
+                        for tenant, segments in segments_by_tenant(changes).items()}
+
+        with STAGE_LATENCY.time(type="REASSIGNMENT", stage="artifact"):
+            artifacts = {tenant: self._segment_artifacts(tenant, tenant_versions) for tenant, tenant_versions in versions.items()}
+
+        # 3. Targeted private updates (one unreachable agent doesn't hold up the rest)
+        notified = []
+        with STAGE_LATENCY.time(type="REASSIGNMENT", stage="publish"):
+            for agent, segments in changes:
+                tenant = agent["tenant_id"]
+                resp = self._reassignment_response(agent, segments, versions[tenant], artifacts[tenant])
+                try:
+                    self.publisher.send_private_response(agent["agent_id"], agent["tenant_id"], resp, resp.encoding)
+                    notified.append((agent, segments))
+                except Exception as e:
+                    logger.warning(f"Reassignment of {agent['agent_id']} not delivered: {e}")
+
+        # 4. Persist - only what agents were told, so the rest still differ on the retry pass
+        if notified:
+            with STAGE_LATENCY.time(type="REASSIGNMENT", stage="persist"):
+                self.agent_repo.update_assignments(notified)
+        self._log_reassignment(len(notified), len(changes))
+        return len(notified)
+
+    def _on_rules_changed(self, old: CompiledPolicy, new: CompiledPolicy):
+        self._schedule_reevaluation()
+
+    def _schedule_reevaluation(self, delay: float = 0):
+        if delay > 0:
+            timer = threading.Timer(delay, self._schedule_reevaluation)
+            timer.daemon = True
+            timer.start()
+        elif self._reevaluator:
+            self._reevaluator.submit(self._reevaluate_safely)
+
+    def _reevaluate_safely(self):
+        try:
+            self.reevaluate_assignments()
+        except Exception as e:
+            logger.error(f"Reassignment pass failed: {e} - retrying in {settings.RULE_REEVALUATION_RETRY_SECONDS:g}s")
+            self._schedule_reevaluation(settings.RULE_REEVALUATION_RETRY_SECONDS)
+
+    def handle_update_trigger(self, tenant_id: str, payload: UpdateTriggerPayload) -> Optional[Future]:
+        """
+        With coalescing, returns a Future that resolves once the coalesced broadcast is
+        published - the trigger's SQS message is only acknowledged then.
+        """
+        logger.info(f"Processing Update Trigger for {payload.segment_id}")
+
+        if self.coalescer:
+            # Bursts for the same segment collapse into one bump + broadcast
+            return self.coalescer.add(tenant_id, payload.segment_id, payload.policy_rules)
+
+        self._publish_update(tenant_id, payload.segment_id, policy_rules=payload.policy_rules)
+
+    def _publish_update(self, tenant_id: str, segment_id: str, trigger_count: int = 1,
+                        policy_rules: Optional[List[str]] = None, pending: Optional[PendingUpdate] = None):
+        # 1. Logic: Increment Version in DB (a retried coalesced update keeps the one it got)
+        if pending and pending.version is not None:
+            new_version = pending.version
+        else:
+            with STAGE_LATENCY.time(type="UPDATE_TRIGGER", stage="increment"):
+                new_version = self.seg_repo.increment_version(tenant_id, segment_id)
+            if pending:
+                pending.version = new_version
+
+        # 2. Store the version's artifact (+ deltas from recent versions)
+        artifact = None
+        if self.artifact_store:
+            with STAGE_LATENCY.time(type="UPDATE_TRIGGER", stage="artifact"):
+                artifact = self._store_artifact(tenant_id, segment_id, new_version, policy_rules)
+        
+        # 3. Logic: Create Notification Payload
+        notify_payload = self._update_notification(segment_id, new_version, artifact)
         
-        assigned_segments = list(set(assigned_segments))
+        # 4. Broadcast
+        with STAGE_LATENCY.time(type="UPDATE_TRIGGER", stage="publish"):
+            self.publisher.broadcast_update(tenant_id, segment_id, notify_payload)
+        self._log_broadcast(segment_id, new_version, trigger_count)
+
+    def _flush_coalesced(self, tenant_id: str, segment_id: str, pending: PendingUpdate):
+        self._publish_update(tenant_id, segment_id, pending.count, pending.policy_rules, pending)
 
-        # 2. Persist
-        agent_entity = AgentStateEntity(
+    def _store_artifact(self, tenant_id: str, segment_id: str, version: int,
+                        policy_rules: Optional[List[str]]) -> SegmentArtifact:
+        if policy_rules is None:
+            base = self.artifact_store.load_latest(tenant_id, segment_id, below=version)
+            policy_rules = simulate_policy(segment_id, version, base, settings.SEGMENT_POLICY_SIM_RULES)
+        return self.artifact_store.save_version(tenant_id, segment_id, version, policy_rules)
+
+    # --- Pure helpers (shared with the asyncio orchestrator) ---
+    def _dedup_key(self, tenant_id: str, payload: BootstrapPayload) -> Optional[str]:
+        return request_key(tenant_id, payload.agent_id, payload.request_id) if self.dedup else None
+
+    def _agent_state(self, tenant_id: str, payload: BootstrapPayload, assigned_segments: List[str]) -> AgentStateEntity:
+        return AgentStateEntity(
             agent_id=payload.agent_id,
             tenant_id=tenant_id,
-            assigned_segments=assigned_segments
+            assigned_segments=assigned_segments,
+            groups=payload.context.groups,
+            location=payload.context.location,
+            encoding=negotiate_encoding(payload.accept_encodings, settings.WIRE_COMPACT_ENABLED)
         )
-        self.agent_repo.upsert_agent(agent_entity)
 
-        # 3. Fetch Versions
-        versions = self.seg_repo.get_versions_map(assigned_segments)
+    def _segment_artifacts(self, tenant_id: str, versions: Dict[str, int]) -> Dict[str, SegmentArtifact]:
+        if not self.artifact_store:
+            return {}
+        return self.artifact_store.describe_many(tenant_id, versions)
 
-        # 4. Response
-        topics = [f"sase/{tenant_id}/segment/{seg}" for seg in assigned_segments]
-        resp = PolicyResponse(
+    def _policy_response(self, tenant_id: str, assigned_segments: List[str], versions: Dict[str, int],
+                         accept_encodings: Optional[List[str]] = None, reason: str = "BOOTSTRAP",
+                         artifacts: Optional[Dict[str, SegmentArtifact]] = None) -> PolicyResponse:
+        encoding = negotiate_encoding(accept_encodings, settings.WIRE_COMPACT_ENABLED)
+        topics = [segment_topic(tenant_id, seg, encoding) for seg in assigned_segments]
+        return PolicyResponse(
             status="SUCCESS",
             assigned_segments=assigned_segments,
             segment_topics=topics,
             segment_versions=versions,
-            download_url="http://cdn.sase.com/init.bin"
+            segment_hashes={seg: artifacts[seg].sha256 for seg in assigned_segments if seg in artifacts} if artifacts else {},
+            artifact_url_template=self.artifact_store.blob_url_template() if artifacts else None,
+            encoding=encoding,
+            reason=reason
         )
-        
-        self.publisher.send_private_response(payload.agent_id, tenant_id, resp.model_dump())
-        logger.info("Sent Bootstrap Response")
 
-    def handle_update_trigger(self, tenant_id: str, payload: UpdateTriggerPayload):
-        logger.info(f"Processing Update Trigger for {payload.segment_id}")
-        
-        # 1. Logic: Increment Version in DB
-        new_version = self.seg_repo.increment_version(payload.segment_id)
-        
-        # 2. Logic: Create Notification Payload
+    def _log_reassignment(self, notified: int, planned: int):
+        if notified < planned:
+            logger.error(f"Rules changed - {planned - notified} of {planned} reassignment(s) not delivered, "
+                         f"retrying in {settings.RULE_REEVALUATION_RETRY_SECONDS:g}s")
+            self._schedule_reevaluation(settings.RULE_REEVALUATION_RETRY_SECONDS)
+        logger.info(f"Rules changed - reassigned {notified} agent(s)")
+
+    def _reassignment_response(self, agent: dict, segments: List[str], versions: Dict[str, int],
+                               artifacts: Optional[Dict[str, SegmentArtifact]] = None) -> PolicyResponse:
+        return self._policy_response(
+            agent["tenant_id"], segments, {seg: versions[seg] for seg in segments if seg in versions},
+            [agent.get("encoding", "json")], reason="REASSIGNMENT", artifacts=artifacts
+        )
+
+    def _stale_segments(self, agent_versions: Dict[str, int], versions: Dict[str, int]) -> Dict[str, int]:
+        return {seg: ver for seg, ver in versions.items() if ver > agent_versions.get(seg, 0)}
+
+    def _resync_response(self, stale: Dict[str, int], artifacts: Dict[str, Optional[SegmentArtifact]]) -> ResyncResponse:
+        return ResyncResponse(
+            status="SUCCESS",
+            stale_segments=stale,
+            updates=[self._update_notification(seg, ver, artifacts.get(seg)) for seg, ver in stale.items()]
+        )
+
+    def _update_notification(self, segment_id: str, version: int, artifact: Optional[SegmentArtifact] = None) -> dict:
         notify_payload = {
             "type": "SEGMENT_UPDATE",
-            "segment": payload.segment_id,
-            "version": new_version,
-            "payload_content": f"blob_{payload.segment_id}_v{new_version}"
+            "segment": segment_id,
+            "version": version,
         }
-        
-        # 3. Broadcast
-        self.publisher.broadcast_update(tenant_id, payload.segment_id, notify_payload)
-        logger.info(f"Broadcasted v{new_version} for {payload.segment_id}")
\ No newline at end of file
+        if artifact is not None:
+            # Agents holding one of delta_bases fetch the small delta, others the full policy
+            notify_payload.update({
+                "sha256": artifact.sha256,
+                "full_url": artifact.full_url,
+                "delta_url": artifact.delta_url_template,
+                "delta_bases": artifact.delta_bases,
+            })
+        return notify_payload
+
+    def _log_broadcast(self, segment_id: str, version: int, trigger_count: int):
+        if trigger_count > 1:
+            logger.info(f"Broadcasted v{version} for {segment_id} (coalesced {trigger_count} triggers)")
+        else:
+            logger.info(f"Broadcasted v{version} for {segment_id}")
+
+    def close(self):
+        """Flushes any coalesced updates that are still waiting."""
+        if self.coalescer:
+            self.coalescer.flush_all()
+        if self._reevaluator:
+            self._reevaluator.shutdown(wait=True)
\ No newline at end of file
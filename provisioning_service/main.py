@@ -1,5 +1,10 @@
 import sys
 import os
+import argparse
+import asyncio
+import multiprocessing
+import signal
+import time
 
 from provisioning_service.core.logger import get_logger
 from provisioning_service.infra_utils import set_tab_title
@@ -7,60 +12,225 @@ from provisioning_service.infra_utils import set_tab_title
 # Ensure we can import modules if running directly
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from pymongo import MongoClient
+from pydantic import ValidationError
+from pymongo import MongoClient, AsyncMongoClient
 from provisioning_service.core.config import settings
-from provisioning_service.core.domain_models import SQSMessage
+from provisioning_service.core.domain_models import SQS_ENVELOPE
 from provisioning_service.adapters.sqs_consumer import SQSConsumer
+from provisioning_service.adapters.async_sqs_consumer import AsyncSQSConsumer
 from provisioning_service.adapters.mqtt_publisher import MqttPublisher
-from provisioning_service.adapters.repositories import AgentRepository, RuleRepository, SegmentStateRepository
-from provisioning_service.logic.worker import ProvisioningOrchestrator
+from provisioning_service.adapters.async_mqtt import AsyncMqttClient, AsyncMqttPublisher
+from provisioning_service.adapters.artifact_store import SegmentArtifactStore
+from provisioning_service.adapters.artifact_server import start_artifact_server
+from provisioning_service.adapters.metrics_server import start_metrics_server
+from provisioning_service.adapters.repositories import (
+    AgentRepository, RuleRepository, SegmentStateRepository,
+    AsyncAgentRepository, AsyncRuleRepository, AsyncSegmentStateRepository,
+    RequestDedupRepository, AsyncRequestDedupRepository,
+    ensure_indexes, verify_query_plans, ensure_indexes_async, verify_query_plans_async
+)
+from provisioning_service.logic.worker import ProvisioningOrchestrator, STAGE_LATENCY
+from provisioning_service.logic.async_worker import AsyncProvisioningOrchestrator
 
 logger = get_logger("ProvisioningService")
 
+def worker_client_id(worker_index=None) -> str:
+    return "backend-worker" if worker_index is None else f"backend-worker-{worker_index}"
+
+def worker_metrics_port(worker_index=None) -> int:
+    # Each supervised worker has its own registry - give it its own scrape port
+    return settings.METRICS_PORT if worker_index is None else settings.METRICS_PORT + 1 + worker_index
+
+def runs_reevaluation(worker_index=None) -> bool:
+    # Every worker sees each rule change - one of them re-evaluates, so agents get a single REASSIGNMENT
+    return settings.RULE_REEVALUATION_ENABLED and worker_index in (None, 0)
+
+def start_worker_metrics(worker_index=None):
+    if settings.METRICS_ENABLED:
+        start_metrics_server(worker_metrics_port(worker_index))
+
 # --- Wiring Dependencies ---
-def bootstrap_app():
+def bootstrap_app(worker_index=None):
     # 1. Infrastructure
     client = MongoClient(settings.MONGO_URI)
     db = client[settings.DB_NAME]
+    if settings.MONGO_ENSURE_INDEXES:
+        ensure_indexes(db)
+    if settings.MONGO_VERIFY_QUERY_PLANS:
+        verify_query_plans(db)
     
     # 2. Adapters
     agent_repo = AgentRepository(db)
     rule_repo = RuleRepository(db)
     seg_repo = SegmentStateRepository(db)
-    publisher = MqttPublisher()
+    publisher = MqttPublisher(client_id=worker_client_id(worker_index))
     
     # 3. Core Logic (Orchestrator)
     return ProvisioningOrchestrator(
         agent_repo=agent_repo,
         rule_repo=rule_repo,
         seg_repo=seg_repo,
-        publisher=publisher
+        publisher=publisher,
+        artifact_store=SegmentArtifactStore(),
+        dedup=RequestDedupRepository(db) if settings.DEDUP_ENABLED else None,
+        reevaluate_rules=runs_reevaluation(worker_index)
+    )
+
+async def bootstrap_async_app(worker_index=None):
+    # 1. Infrastructure
+    client = AsyncMongoClient(settings.MONGO_URI)
+    db = client[settings.DB_NAME]
+    if settings.MONGO_ENSURE_INDEXES:
+        await ensure_indexes_async(db)
+    if settings.MONGO_VERIFY_QUERY_PLANS:
+        await verify_query_plans_async(db)
+    mqtt_client = AsyncMqttClient(f"{worker_client_id(worker_index)}-async")
+    await mqtt_client.connect(settings.MQTT_HOST, settings.MQTT_PORT)
+
+    # 2. Adapters + 3. Core Logic
+    return AsyncProvisioningOrchestrator(
+        agent_repo=AsyncAgentRepository(db),
+        rule_repo=AsyncRuleRepository(db),
+        seg_repo=AsyncSegmentStateRepository(db),
+        publisher=AsyncMqttPublisher(mqtt_client),
+        artifact_store=SegmentArtifactStore(),
+        dedup=AsyncRequestDedupRepository(db) if settings.DEDUP_ENABLED else None,
+        reevaluate_rules=runs_reevaluation(worker_index)
     )
 
+def _validate(validate, data):
+    start = time.perf_counter()
+    try:
+        msg = validate(data)
+    except ValidationError as e:
+        if any(err["type"] == "json_invalid" for err in e.errors()):
+            raise  # not even JSON - the consumer treats it as malformed
+        # Malformed envelopes will never succeed - drop them
+        print(f"[Worker Error] Invalid Message: {e}")
+        return None
+    STAGE_LATENCY.observe(time.perf_counter() - start, type=msg.type, stage="validate")
+    return msg
+
+def decode_body(body: str):
+    """The consumers' decode hook: raw SQS body -> SQSMessage in one pass (no intermediate dict)."""
+    return _validate(SQS_ENVELOPE.validate_json, body)
+
 # --- Message Loop ---
-def run():
-    set_tab_title("Provisioning Service")
+def run(worker_index=None):
+    if worker_index is None:
+        set_tab_title("Provisioning Service")
+        if settings.ARTIFACT_SERVER_ENABLED:
+            start_artifact_server()
+    start_worker_metrics(worker_index)
     logger.info("Initializing Provisioning Worker...")
-    orchestrator = bootstrap_app()
-    consumer = SQSConsumer()
+    orchestrator = bootstrap_app(worker_index)
+    consumer = SQSConsumer(decode=decode_body)
 
-    def process_message(raw_data):
+    def process_message(msg):
         try:
-            # Parse Envelope
-            msg = SQSMessage(**raw_data)
-            
-            # Route to Logic
-            if msg.type == "BOOTSTRAP":
-                orchestrator.handle_bootstrap(msg.tenant_id, msg.payload)
-                
-            elif msg.type == "UPDATE_TRIGGER":
-                orchestrator.handle_update_trigger(msg.tenant_id, msg.payload)
-                
+            # Route to Logic (a coalesced update trigger returns a Future - acked once it resolves)
+            return orchestrator.handle_message(msg)
         except Exception as e:
+            # Re-raise so the consumer leaves the message on the queue for a retry
             print(f"[Worker Error] Processing Failed: {e}")
+            raise
+
+    # SIGTERM (supervisor, container stop): stop polling and drain instead of dying mid-message
+    signal.signal(signal.SIGTERM, lambda signum, frame: consumer.stop())
 
     print("[Service] 🚀 Worker Started. Listening to SQS...")
-    consumer.start_listening(process_message)
+    try:
+        consumer.start_listening(process_message)
+    finally:
+        orchestrator.close()
+
+async def run_async(worker_index=None):
+    if worker_index is None:
+        set_tab_title("Provisioning Service (async)")
+        if settings.ARTIFACT_SERVER_ENABLED:
+            start_artifact_server()
+    start_worker_metrics(worker_index)
+    logger.info("Initializing Async Provisioning Worker...")
+    orchestrator = await bootstrap_async_app(worker_index)
+    consumer = AsyncSQSConsumer(decode=decode_body)
+
+    async def process_message(msg):
+        try:
+            return await orchestrator.handle_message(msg)
+        except Exception as e:
+            print(f"[Worker Error] Processing Failed: {e}")
+            raise
+
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, consumer.stop)
+
+    print("[Service] 🚀 Async Worker Started. Listening to SQS...")
+    try:
+        await consumer.start_listening(process_message)
+    finally:
+        # flush_all blocks on coroutines scheduled on this loop - run it off-loop
+        await asyncio.to_thread(orchestrator.close)
+
+# --- Supervisor (multi-process) ---
+def worker_entry(worker_index: int, use_async: bool):
+    """Child process body: every worker builds its own Mongo client and MQTT connection."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor handles Ctrl+C
+    if use_async:
+        asyncio.run(run_async(worker_index))
+    else:
+        run(worker_index)
+
+def supervise(num_workers: int, use_async: bool):
+    """
+    Starts N worker processes and restarts any that die. Combine with a FIFO queue
+    (init_infra.py --fifo) to keep per-agent / per-segment ordering across processes.
+    """
+    set_tab_title(f"Provisioning Supervisor x{num_workers}")
+    logger.info(f"Supervisor starting {num_workers} workers...")
+    stopping = False
+
+    def start(index):
+        proc = multiprocessing.Process(target=worker_entry, args=(index, use_async), name=f"worker-{index}")
+        proc.start()
+        logger.info(f"Started worker-{index} (pid {proc.pid})")
+        return proc
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # One artifact server for all workers (they share ARTIFACT_DIR)
+    if settings.ARTIFACT_SERVER_ENABLED:
+        start_artifact_server()
+
+    workers = {i: start(i) for i in range(num_workers)}
+    while not stopping:
+        time.sleep(1)
+        for index, proc in list(workers.items()):
+            if not proc.is_alive() and not stopping:
+                logger.warning(f"worker-{index} exited with code {proc.exitcode}, restarting")
+                workers[index] = start(index)
+
+    logger.info("Supervisor stopping workers...")
+    for proc in workers.values():
+        proc.terminate()
+    # Workers drain on SIGTERM - give them the drain deadline plus time to flush and exit
+    for proc in workers.values():
+        proc.join(timeout=settings.SQS_DRAIN_TIMEOUT_SECONDS + 10)
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="SASE Provisioning Worker")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run the asyncio worker (async SQS, Mongo and MQTT adapters)")
+    parser.add_argument("--workers", type=int, default=settings.WORKER_PROCESSES,
+                        help="Number of worker processes (>1 starts a supervisor)")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        supervise(args.workers, args.use_async)
+    elif args.use_async:
+        asyncio.run(run_async())
+    else:
+        run()